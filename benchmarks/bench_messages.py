@@ -0,0 +1,137 @@
+"""
+Measures the construction, extraction, serialization and parsing of NLIP messages,
+for messages with 1, 10 and 100 submessages carrying small and large payloads.
+
+Run from the top of the repository with:
+
+    python -m benchmarks.bench_messages
+
+Timings can be saved as a baseline, and later runs compared with it. The comparison
+fails (exit status 1) when a case is slower than the baseline by more than the threshold:
+
+    python -m benchmarks.bench_messages --save benchmarks/baseline.json
+    python -m benchmarks.bench_messages --compare benchmarks/baseline.json --threshold 0.25
+
+Baselines are only meaningful on the machine and python version that produced them.
+
+"""
+
+import argparse
+import json
+import platform
+import sys
+from timeit import Timer
+
+from nlip_sdk.nlip import NLIP_Factory, NLIP_Message
+
+
+SUBMESSAGE_COUNTS = [1, 10, 100]
+
+# Size in bytes of the text and JSON payloads of the submessages
+PAYLOAD_SIZES = {'small': 64, 'large': 4096}
+
+
+def payload_text(size: int) -> str:
+    words = "the quick brown fox jumps over the lazy dog "
+    return (words * (size // len(words) + 1))[:size]
+
+
+def build_message(submessage_count: int, size: int) -> NLIP_Message:
+    text = payload_text(size)
+    msg = NLIP_Factory.create_text(text, messagetype="request")
+    msg.add_conversation_token("conversation-0123456789")
+    msg.add_authentication_token("bearer-abcdefghijklmnop")
+    for i in range(submessage_count - 1):
+        if i % 2 == 0:
+            msg.add_text(text, label=f"record{i}")
+        else:
+            msg.add_json({"record": i, "text": text, "score": i / 7, "valid": True})
+    return msg
+
+
+def cases(submessage_count: int, size_name: str) -> dict:
+    """Returns the benchmarked functions for a message shape, by case name"""
+    size = PAYLOAD_SIZES[size_name]
+    text = payload_text(size)
+    record = {"record": 1, "text": text, "score": 0.5, "valid": True}
+    msg = build_message(submessage_count, size)
+    encoded = msg.to_json()
+    shape = f"{submessage_count}x{size_name}"
+    return {
+        f"create_text[{size_name}]": lambda: NLIP_Factory.create_text(text),
+        f"create_json[{size_name}]": lambda: NLIP_Factory.create_json(record),
+        f"add_submessages[{shape}]": lambda: build_message(submessage_count, size),
+        f"extract_text[{shape}]": lambda: msg.extract_text(),
+        f"extract_field_list[{shape}]": lambda: msg.extract_field_list('structured', 'JSON'),
+        f"extract_token[{shape}]": lambda: msg.extract_conversation_token(),
+        f"to_json[{shape}]": lambda: msg.to_json(),
+        f"to_dict[{shape}]": lambda: msg.to_dict(),
+        f"from_json[{shape}]": lambda: NLIP_Message.from_json(encoded),
+    }
+
+
+def best_time(function, repeat: int) -> float:
+    timer = Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(selected: str = None, repeat: int = 5) -> dict:
+    results = dict()
+    for submessage_count in SUBMESSAGE_COUNTS:
+        for size_name in PAYLOAD_SIZES:
+            for name, function in cases(submessage_count, size_name).items():
+                # Cases that do not depend on the submessage count are only run once
+                if name in results or (selected is not None and selected not in name):
+                    continue
+                results[name] = best_time(function, repeat)
+                print(f"{name:<40} {results[name] * 1e6:>12.2f} us")
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Returns the names of the cases slower than the baseline by more than threshold"""
+    print(f"\n{'case':<40} {'baseline (us)':>14} {'now (us)':>12} {'ratio':>7}")
+    regressions = list()
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        ratio = seconds / baseline[name]
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<40} {baseline[name] * 1e6:>14.2f} {seconds * 1e6:>12.2f} {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of NLIP message handling")
+    parser.add_argument('--filter', help="only run the cases whose name contains this string")
+    parser.add_argument('--repeat', type=int, default=5, help="number of timing runs per case")
+    parser.add_argument('--save', metavar='PATH', help="save the timings as a baseline")
+    parser.add_argument('--compare', metavar='PATH', help="compare the timings with a saved baseline")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="largest accepted slowdown relative to the baseline (0.25 is 25%%)")
+    args = parser.parse_args(argv)
+
+    results = run(args.filter, args.repeat)
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'results': results}, fp, indent=2, sort_keys=True)
+            fp.write('\n')
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        if baseline.get('python') != platform.python_version():
+            print(f"\nWarning: the baseline was measured with python {baseline.get('python')}")
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than the baseline by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
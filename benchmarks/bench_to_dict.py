@@ -0,0 +1,49 @@
+"""
+Compares NLIP_Message.to_dict with the JSON round trip it replaced
+(json.loads of to_json) on messages with 1, 10, 100 and 1000 submessages.
+
+Run from the top of the repository with:
+
+    python -m benchmarks.bench_to_dict
+
+"""
+
+from json import loads
+from timeit import Timer
+
+from nlip_sdk.nlip import NLIP_Factory, NLIP_Message
+
+
+def make_message(submessage_count: int) -> NLIP_Message:
+    msg = NLIP_Factory.create_text("Summarize the attached records", messagetype="request")
+    msg.add_conversation_token("conversation-0123456789")
+    for i in range(submessage_count - 1):
+        if i % 2 == 0:
+            msg.add_text(f"Record {i}: the quick brown fox jumps over the lazy dog", label=f"record{i}")
+        else:
+            msg.add_json({"record": i, "tags": ["alpha", "beta"], "score": i / 7, "valid": True})
+    return msg
+
+
+def json_round_trip(msg: NLIP_Message) -> dict:
+    return loads(msg.to_json())
+
+
+def best_time(function, msg: NLIP_Message) -> float:
+    timer = Timer(lambda: function(msg))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number
+
+
+def main():
+    print(f"{'submessages':>12} {'round trip (us)':>16} {'to_dict (us)':>13} {'speedup':>8}")
+    for submessage_count in [1, 10, 100, 1000]:
+        msg = make_message(submessage_count)
+        assert msg.to_dict() == json_round_trip(msg)
+        before = best_time(json_round_trip, msg)
+        after = best_time(NLIP_Message.to_dict, msg)
+        print(f"{submessage_count:>12} {before * 1e6:>16.1f} {after * 1e6:>13.1f} {before / after:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
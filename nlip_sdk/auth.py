@@ -0,0 +1,262 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file contains a cache of the verification of the authentication tokens of NLIP Messages.
+
+TokenVerifier calls a verification function supplied by the application (a signature
+check, a remote introspection, ...) and remembers its result:
+    - valid tokens are remembered for ttl seconds, and never beyond their own expiry
+      time when the verification result gives one (e.g. the exp claim of a JWT),
+    - refused tokens are remembered for negative_ttl seconds, so that a client retrying
+      with a bad token does not cause a verification on every request,
+    - concurrent requests with the same token wait for a single verification.
+Tokens are not kept: entries are keyed by a keyed hash of the token, with a key drawn
+at random for each verifier.
+
+"""
+
+import asyncio
+import hashlib
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from nlip_sdk.errors import AuthenticationError
+from nlip_sdk.nlip import NLIP_Message
+
+
+def claims_expiry(claims):
+    """Returns the exp claim of a verification result, when it is a dictionary of claims"""
+    if isinstance(claims, dict):
+        expiry = claims.get('exp')
+        if isinstance(expiry, (int, float)):
+            return float(expiry)
+    return None
+
+
+def _retrieve_exception(flight: asyncio.Future):
+    # The callers waiting on a verification receive its exception. If they were all
+    # cancelled, the flight itself must not warn that its exception was never retrieved.
+    if not flight.cancelled():
+        flight.exception()
+
+
+class _Refused:
+    """ The cached result of a token that was refused """
+    __slots__ = ('reason',)
+
+    def __init__(self, reason: str):
+        self.reason = reason
+
+
+class _Flight:
+    """ A verification in progress in a thread, waited for by other threads """
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class TokenVerifier:
+    """
+    A cache of the results of a token verification function.
+
+    The verification function is called with the token and returns the claims of the token
+    (any value other than None or False, e.g. a dictionary), or returns None or False or raises
+    AuthenticationError if the token is not valid. It may be a coroutine function when the
+    asyncio methods are used. Other exceptions are considered transient: they are passed on
+    to the caller and not cached.
+
+    Constructor Arguments:
+        verify (Callable): The verification function
+        ttl (float): The time in seconds for which a valid token is not verified again
+        negative_ttl (float): The time in seconds for which a refused token is not verified again
+        max_entries (int): The largest number of tokens remembered
+        expiry (Callable): The function giving the expiry time of the claims (in clock time), or None
+        clock (Callable): The function giving the current time in seconds since the epoch
+    """
+    def __init__(self, verify, ttl:float=300.0, negative_ttl:float=30.0, max_entries:int=10000,
+                 expiry=claims_expiry, clock=time.time):
+        self.verify = verify
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.expiry = expiry
+        self.clock = clock
+        self._hash_key = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = dict()
+        self._async_flights = dict()
+        self.verifications = 0
+
+    def _key(self, token: str) -> bytes:
+        return hashlib.blake2b(token.encode('utf-8'), key=self._hash_key, digest_size=32).digest()
+
+    def _lookup(self, key: bytes):
+        """Returns the cached result for a key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _store(self, key: bytes, result):
+        now = self.clock()
+        if isinstance(result, _Refused):
+            expires = now + self.negative_ttl
+        else:
+            expires = now + self.ttl
+            claimed = self.expiry(result) if self.expiry is not None else None
+            if claimed is not None:
+                expires = min(expires, claimed)
+        if expires <= now:
+            return
+        with self._lock:
+            self._entries[key] = (result, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _claims(result):
+        if isinstance(result, _Refused):
+            raise AuthenticationError(result.reason)
+        return result
+
+    def _outcome(self, claims):
+        """Returns the result to cache for the value returned by the verification function"""
+        if claims is None or claims is False:
+            return _Refused("the token is not valid")
+        if self.expiry is not None:
+            expiry = self.expiry(claims)
+            if expiry is not None and expiry <= self.clock():
+                return _Refused("the token has expired")
+        return claims
+
+    def check(self, token: str):
+        """This function verifies a token, using the cached result when there is one.
+
+        Args:
+            token (str): The authentication token
+
+        Returns:
+            The claims returned by the verification function
+
+        Raises:
+            AuthenticationError: If the token is missing or is not valid
+        """
+        if not token:
+            raise AuthenticationError("no authentication token")
+        key = self._key(token)
+        result = self._lookup(key)
+        if result is not None:
+            return self._claims(result)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return self._claims(flight.result)
+        try:
+            self.verifications += 1
+            try:
+                claims = self.verify(token)
+            except AuthenticationError as e:
+                result = _Refused(e.reason)
+            else:
+                if inspect.isawaitable(claims):
+                    if inspect.iscoroutine(claims):
+                        claims.close()
+                    raise TypeError("an asynchronous verification function must be used with acheck")
+                result = self._outcome(claims)
+            self._store(key, result)
+            flight.result = result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return self._claims(result)
+
+    async def acheck(self, token: str):
+        """ The asyncio version of check, which accepts coroutine verification functions """
+        if not token:
+            raise AuthenticationError("no authentication token")
+        key = self._key(token)
+        result = self._lookup(key)
+        if result is not None:
+            return self._claims(result)
+        flight = self._async_flights.get(key)
+        if flight is None:
+            # The verification runs in a task of its own, so that cancelling the caller
+            # that started it does not cancel it for the callers waiting on it too
+            flight = self._async_flights[key] = asyncio.ensure_future(self._averify(key, token))
+            flight.add_done_callback(_retrieve_exception)
+        return self._claims(await asyncio.shield(flight))
+
+    async def _averify(self, key: str, token: str):
+        try:
+            self.verifications += 1
+            try:
+                claims = self.verify(token)
+                if inspect.isawaitable(claims):
+                    claims = await claims
+            except AuthenticationError as e:
+                result = _Refused(e.reason)
+            else:
+                result = self._outcome(claims)
+            self._store(key, result)
+            return result
+        finally:
+            del self._async_flights[key]
+
+    def check_message(self, msg: NLIP_Message, label: str = None):
+        """Verifies the authentication token of a message and returns its claims, see check"""
+        return self.check(msg.extract_authentication_token(label))
+
+    async def acheck_message(self, msg: NLIP_Message, label: str = None):
+        """ The asyncio version of check_message """
+        return await self.acheck(msg.extract_authentication_token(label))
+
+    def invalidate(self, token: str) -> bool:
+        """Forgets the result of a token, e.g. when it is revoked. Returns True if it was cached."""
+        with self._lock:
+            return self._entries.pop(self._key(token), None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
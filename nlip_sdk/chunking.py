@@ -0,0 +1,496 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file contains the transfer of large content in chunks spread over several NLIP Messages.
+
+The content is cut into chunks of a fixed size. Each chunk travels as two submessages
+labeled nlip-chunk:<transfer id>:<index> with the subformat nlip-chunk: a structured
+one describing the chunk (the transfer, the index and count of chunks, the chunk size,
+the offset and length of the chunk, the size of the content, and the format, subformat
+and label of the original submessage), and a binary one carrying the bytes of the chunk.
+The last chunk also carries the SHA-256 digest of the content. Chunks can be sent in any
+order, in messages of their own or alongside other submessages.
+
+ChunkedTransfer is the sender side. It reads the content, e.g. a file mapped in memory,
+only as its chunks are built, and can build any chunk again.
+
+ChunkReassembler is the receiver side. It writes each chunk to a spool file as it
+arrives, at its offset, so chunks may arrive out of order or more than once, and keeps
+the chunks received in a state file next to it. The description of a chunk is checked
+before anything is spooled: its offset and length must be those given by its index and
+the chunk size, so that the chunks cover the content exactly, and the digest must be
+carried by the last chunk only, so that no other chunk can change it. A reassembler
+created on the same spool directory, e.g. after a restart, resumes the transfers in
+progress: missing() gives the chunks still to be sent, which ChunkedTransfer.messages
+sends again.
+
+split_message replaces the large submessages of a message by references to transfers,
+and ChunkReassembler.restore puts the reassembled content back.
+
+"""
+
+import hashlib
+import json
+import os
+import uuid
+from base64 import b64decode
+from binascii import Error as Base64Error
+from typing import Union
+
+from nlip_sdk.errors import MalformedMessageError
+from nlip_sdk.nlip import AllowedFormats, NLIP_Message, NLIP_SubMessage, nlip_compare_string
+from nlip_sdk.template import NLIP_Template
+from nlip_sdk.utils import map_binary_file, read_file_chunks
+
+# Default size in bytes of the chunks
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Subformat of the submessages of chunks, and of the references to transfers left by split_message
+CHUNK_SUBFORMAT = 'nlip-chunk'
+REFERENCE_SUBFORMAT = 'nlip-chunk-reference'
+
+_LABEL_PREFIX = CHUNK_SUBFORMAT + ':'
+
+# How the content of a transfer is restored from its bytes
+_BYTES, _TEXT, _JSON = 'bytes', 'text', 'json'
+
+
+def chunk_label(transfer_id: str, index: int) -> str:
+    """Returns the label of the submessages of a chunk"""
+    return f"{_LABEL_PREFIX}{transfer_id}:{index}"
+
+
+def is_chunk(submsg: NLIP_SubMessage) -> bool:
+    """ Checks if a submessage belongs to a chunk """
+    return nlip_compare_string(submsg.subformat, CHUNK_SUBFORMAT) and bool(submsg.label) \
+        and submsg.label.startswith(_LABEL_PREFIX)
+
+
+class ChunkedTransfer:
+    """
+    The sender side of the transfer of content in chunks.
+
+    Constructor Arguments:
+        content (str, dict or bytes-like): The content. Text is sent UTF-8 encoded and a
+            dictionary as JSON; bytes-like content, e.g. a mapped file, is not copied.
+        format (str): The format of the submessage the content is restored as
+        subformat (str): The subformat of that submessage
+        label (str): The label of that submessage
+        chunk_size (int): The size in bytes of the chunks
+        transfer_id (str): The identifier of the transfer, a random one if None
+    """
+    def __init__(self, content: Union[str, dict, bytes, bytearray, memoryview], format: str, subformat: str,
+                 label: str = None, chunk_size: int = DEFAULT_CHUNK_SIZE, transfer_id: str = None):
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        if isinstance(content, str):
+            self.encoding, data = _TEXT, content.encode('utf-8')
+        elif isinstance(content, dict):
+            self.encoding, data = _JSON, json.dumps(content).encode('utf-8')
+        else:
+            self.encoding, data = _BYTES, content
+        self.data = memoryview(data).cast('B')
+        self.format = AllowedFormats(format)
+        self.subformat = subformat
+        self.label = label
+        self.chunk_size = chunk_size
+        self.transfer_id = transfer_id or uuid.uuid4().hex
+        self.count = max(1, -(-len(self.data) // chunk_size))
+        self._digest = None
+
+    @classmethod
+    def from_file(cls, filename: str, format: str, subformat: str, label: str = None,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE, transfer_id: str = None) -> 'ChunkedTransfer':
+        """Returns the transfer of the content of a file, which is mapped in memory rather than read"""
+        return cls(map_binary_file(filename), format, subformat, label, chunk_size, transfer_id)
+
+    @classmethod
+    def from_submessage(cls, submsg: NLIP_SubMessage, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                        transfer_id: str = None) -> 'ChunkedTransfer':
+        """Returns the transfer of the content of a submessage"""
+        return cls(submsg.content, submsg.format, submsg.subformat, submsg.label, chunk_size, transfer_id)
+
+    def digest(self) -> str:
+        """Returns the hexadecimal SHA-256 digest of the content, computed on first use"""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.data).hexdigest()
+        return self._digest
+
+    def chunk(self, index: int) -> list:
+        """This function builds the submessages of a chunk.
+
+        Args:
+            index (int): The index of the chunk, from 0 to count - 1
+
+        Returns:
+            list: The description and the payload submessages of the chunk
+        """
+        if not 0 <= index < self.count:
+            raise IndexError(f"chunk {index} out of range for {self.count} chunks")
+        offset = index * self.chunk_size
+        payload = self.data[offset:offset + self.chunk_size]
+        description = {'transfer': self.transfer_id, 'index': index, 'count': self.count,
+                       'chunk_size': self.chunk_size, 'offset': offset, 'length': len(payload),
+                       'size': len(self.data),
+                       'encoding': self.encoding, 'format': self.format.value, 'subformat': self.subformat,
+                       'label': self.label}
+        if index == self.count - 1:
+            description['sha256'] = self.digest()
+        label = chunk_label(self.transfer_id, index)
+        return [NLIP_SubMessage(format=AllowedFormats.structured, subformat=CHUNK_SUBFORMAT,
+                                content=description, label=label),
+                NLIP_SubMessage(format=AllowedFormats.binary, subformat=CHUNK_SUBFORMAT,
+                                content=payload, label=label)]
+
+    def messages(self, indices: list = None, base: Union[NLIP_Message, NLIP_Template] = None):
+        """This function builds the messages carrying the chunks, one chunk per message.
+
+        Args:
+            indices (list): The indices of the chunks to send, e.g. those missing at the
+                receiver after an interruption, all of them if None
+            base (NLIP_Message or NLIP_Template): The message the chunk submessages are added to,
+                e.g. one carrying the authentication and conversation tokens. By default
+                a message of format generic whose content is the transfer identifier.
+
+        Yields:
+            NLIP_Message: A message per chunk
+        """
+        if base is None:
+            base = NLIP_Message(format=AllowedFormats.generic, subformat=CHUNK_SUBFORMAT, content=self.transfer_id)
+        template = base if isinstance(base, NLIP_Template) else NLIP_Template(base)
+        for index in (range(self.count) if indices is None else indices):
+            msg = template.message()
+            for submsg in self.chunk(index):
+                msg.add_submessage(submsg)
+            yield msg
+
+    def reference(self) -> NLIP_SubMessage:
+        """Returns the submessage standing for the content in the message it was split from"""
+        return NLIP_SubMessage(format=AllowedFormats.generic, subformat=REFERENCE_SUBFORMAT,
+                               content={'transfer': self.transfer_id}, label=self.label)
+
+
+def split_message(msg: NLIP_Message, threshold: int = DEFAULT_CHUNK_SIZE,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE) -> tuple:
+    """This function moves the large submessages of a message to chunked transfers.
+
+    Args:
+        msg (NLIP_Message): The message, which is left unchanged
+        threshold (int): The size in bytes of text or binary content above which a submessage is moved
+        chunk_size (int): The size in bytes of the chunks
+
+    Returns:
+        tuple: The message with references in place of the large submessages (see
+        ChunkReassembler.restore), and the list of the ChunkedTransfer of those submessages
+    """
+    if not msg.submessages:
+        return msg, []
+    transfers = list()
+    submessages = list()
+    for submsg in msg.submessages:
+        content = submsg.content
+        size = len(content) if isinstance(content, str) else \
+            memoryview(content).nbytes if isinstance(content, (bytes, bytearray, memoryview)) else 0
+        if size > threshold:
+            transfer = ChunkedTransfer.from_submessage(submsg, chunk_size)
+            transfers.append(transfer)
+            submsg = transfer.reference()
+        submessages.append(submsg)
+    if not transfers:
+        return msg, []
+    return msg.model_copy(update={'submessages': submessages}), transfers
+
+
+class SpooledTransfer:
+    """
+    The receiver side of one transfer: a spool file holding the chunks received so far,
+    and a state file recording them.
+
+    Attributes:
+        transfer_id (str): The identifier of the transfer
+        path (str): The spool file, which holds the whole content once the transfer is complete
+        count (int), size (int): The number of chunks and the size in bytes of the content
+        chunk_size (int): The size in bytes of the chunks, all but the last one
+        format (str), subformat (str), label (str): Those of the submessage the content is restored as
+        sha256 (str): The digest of the content, once the last chunk has arrived
+        received (set): The indices of the chunks received
+    """
+    def __init__(self, spool_dir: str, description: dict):
+        self.transfer_id = description['transfer']
+        self.count = description['count']
+        self.size = description['size']
+        self.chunk_size = description['chunk_size']
+        self.encoding = description.get('encoding', _BYTES)
+        self.format = description['format']
+        self.subformat = description['subformat']
+        self.label = description.get('label')
+        self.sha256 = description.get('sha256')
+        self.received = set(description.get('received', ()))
+        self.path = os.path.join(spool_dir, f"{self.transfer_id}.part")
+        self._state_path = os.path.join(spool_dir, f"{self.transfer_id}.json")
+
+    def _state(self) -> dict:
+        return {'transfer': self.transfer_id, 'count': self.count, 'size': self.size,
+                'chunk_size': self.chunk_size, 'encoding': self.encoding,
+                'format': self.format, 'subformat': self.subformat, 'label': self.label,
+                'sha256': self.sha256, 'received': sorted(self.received)}
+
+    def _save(self):
+        # Replaced at once, so that an interruption leaves the previous state
+        temporary = self._state_path + '.tmp'
+        with open(temporary, 'w') as fp:
+            json.dump(self._state(), fp)
+        os.replace(temporary, self._state_path)
+
+    def missing(self) -> list:
+        """Returns the indices of the chunks not received yet"""
+        return [index for index in range(self.count) if index not in self.received]
+
+    def is_complete(self) -> bool:
+        return len(self.received) == self.count
+
+    def write(self, description: dict, payload: bytes):
+        """Writes a chunk at its offset in the spool file, unless it was already received.
+        The description must have been checked by check_description."""
+        index = description['index']
+        sha256 = description.get('sha256')
+        if (description['count'] != self.count or description['size'] != self.size
+                or description['chunk_size'] != self.chunk_size
+                or (sha256 is not None and self.sha256 is not None and sha256 != self.sha256)):
+            raise MalformedMessageError(f"chunk {index} does not match transfer {self.transfer_id}")
+        if len(payload) != description['length']:
+            raise MalformedMessageError(f"chunk {index} of transfer {self.transfer_id} has an invalid length")
+        offset = description['offset']
+        if sha256 is not None and self.sha256 is None:
+            self.sha256 = sha256
+        if index in self.received:
+            return
+        mode = 'r+b' if os.path.exists(self.path) else 'wb'
+        with open(self.path, mode) as fp:
+            if mode == 'wb':
+                fp.truncate(self.size)
+            fp.seek(offset)
+            fp.write(payload)
+        self.received.add(index)
+        self._save()
+
+    def verify(self) -> bool:
+        """ Checks the digest of the spool file, reading it in chunks. It fails without a digest. """
+        if self.sha256 is None:
+            return False
+        digest = hashlib.sha256()
+        for chunk in read_file_chunks(self.path):
+            digest.update(chunk)
+        return digest.hexdigest() == self.sha256
+
+    def to_submessage(self) -> NLIP_SubMessage:
+        """This function restores the submessage of a complete transfer. Binary content is
+        the spool file mapped in memory, so the spool file must be kept while it is used.
+
+        Returns:
+            NLIP_SubMessage: The submessage with the content transferred
+        """
+        if not self.is_complete():
+            raise MalformedMessageError(f"transfer {self.transfer_id} misses chunks {self.missing()}")
+        if self.encoding == _BYTES:
+            content = map_binary_file(self.path)
+        else:
+            with open(self.path, 'rb') as fp:
+                content = fp.read().decode('utf-8')
+            if self.encoding == _JSON:
+                content = json.loads(content)
+        return NLIP_SubMessage(format=self.format, subformat=self.subformat, content=content, label=self.label)
+
+    def discard(self):
+        """Removes the spool and state files"""
+        for path in (self.path, self._state_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def check_description(description) -> dict:
+    """This function checks the description of a chunk received from a peer, before anything is spooled.
+
+    Args:
+        description: The content of the description submessage of the chunk
+
+    Returns:
+        dict: The description
+    """
+    if not isinstance(description, dict):
+        raise MalformedMessageError("chunk description must be a JSON object")
+    transfer_id = description.get('transfer')
+    if not isinstance(transfer_id, str) or os.path.basename(transfer_id) != transfer_id \
+            or transfer_id in ('', '.', '..'):
+        raise MalformedMessageError(f"invalid transfer identifier {transfer_id!r}")
+    for name in ('index', 'count', 'chunk_size', 'offset', 'length', 'size'):
+        # bool is a subclass of int, and is refused as well
+        if type(description.get(name)) is not int:
+            raise MalformedMessageError(f"chunk description field {name} must be an integer, "
+                                        f"not {description.get(name)!r}")
+    for name in ('format', 'subformat'):
+        if not isinstance(description.get(name), str):
+            raise MalformedMessageError(f"chunk description field {name} must be a string")
+    if not isinstance(description.get('label'), (str, type(None))):
+        raise MalformedMessageError("chunk description field label must be a string")
+    if description.get('encoding', _BYTES) not in (_BYTES, _TEXT, _JSON):
+        raise MalformedMessageError(f"unknown chunk encoding {description.get('encoding')!r}")
+    index, count, size, chunk_size = (description[name] for name in ('index', 'count', 'size', 'chunk_size'))
+    if chunk_size <= 0 or size < 0 or count != max(1, -(-size // chunk_size)) or not 0 <= index < count:
+        raise MalformedMessageError(f"chunk {index} of transfer {transfer_id} has an inconsistent count")
+    # The offset and length are derived from the index, so that chunks can not overlap or leave gaps
+    offset = index * chunk_size
+    if description['offset'] != offset or description['length'] != min(chunk_size, size - offset):
+        raise MalformedMessageError(f"chunk {index} of transfer {transfer_id} has an invalid offset or length")
+    # Only the last chunk carries the digest
+    sha256 = description.get('sha256')
+    if (sha256 is None) != (index < count - 1):
+        raise MalformedMessageError(f"chunk {index} of transfer {transfer_id} must carry the digest "
+                                    f"if and only if it is the last one")
+    if sha256 is not None and (not isinstance(sha256, str) or len(sha256) != 64 or not _is_hex(sha256)):
+        raise MalformedMessageError(f"invalid digest in chunk {index} of transfer {transfer_id}")
+    return description
+
+
+def _is_hex(value: str) -> bool:
+    try:
+        bytes.fromhex(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _payload_bytes(content) -> bytes:
+    if isinstance(content, str):
+        # Binary content decoded from JSON is the base64 encoding
+        try:
+            return b64decode(content, validate=True)
+        except Base64Error as e:
+            raise MalformedMessageError(f"chunk payload is not valid base64 ({e})")
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        return content
+    raise MalformedMessageError("chunk payload must be binary")
+
+
+class ChunkReassembler:
+    """
+    The receiver side of chunked transfers, spooling chunks to files in a directory.
+    The transfers in progress found in the directory are resumed.
+
+    Constructor Arguments:
+        spool_dir (str): The directory of the spool and state files, created if needed
+    """
+    def __init__(self, spool_dir: str):
+        self.spool_dir = spool_dir
+        os.makedirs(spool_dir, exist_ok=True)
+        self.transfers = dict()
+        for name in os.listdir(spool_dir):
+            if name.endswith('.json'):
+                with open(os.path.join(spool_dir, name)) as fp:
+                    transfer = SpooledTransfer(spool_dir, json.load(fp))
+                self.transfers[transfer.transfer_id] = transfer
+
+    def missing(self, transfer_id: str) -> list:
+        """Returns the indices of the chunks of a transfer not received yet, None if no chunk was received"""
+        transfer = self.transfers.get(transfer_id)
+        return transfer.missing() if transfer is not None else None
+
+    def add_chunk(self, description: dict, payload) -> SpooledTransfer:
+        """This function spools a chunk.
+
+        Args:
+            description (dict): The content of the description submessage of the chunk
+            payload (bytes or str): The content of the payload submessage, base64 encoded if str
+
+        Returns:
+            SpooledTransfer: The transfer, if this chunk completed it, else None
+        """
+        check_description(description)
+        payload = _payload_bytes(payload)
+        transfer_id = description['transfer']
+        transfer = self.transfers.get(transfer_id)
+        if transfer is None:
+            # Registered only once the chunk is written, so that a refused chunk leaves nothing behind
+            new = SpooledTransfer(self.spool_dir, dict(description, received=()))
+            new.write(description, payload)
+            transfer = self.transfers[transfer_id] = new
+            was_complete = False
+        else:
+            was_complete = transfer.is_complete()
+            transfer.write(description, payload)
+        if transfer.is_complete() and not was_complete:
+            if not transfer.verify():
+                transfer.discard()
+                del self.transfers[transfer_id]
+                raise MalformedMessageError(f"transfer {transfer_id} does not match its digest")
+            return transfer
+        return None
+
+    def add_message(self, msg: NLIP_Message) -> list:
+        """This function spools the chunks carried by a message.
+
+        Args:
+            msg (NLIP_Message): The message
+
+        Returns:
+            list: The transfers completed by the chunks of this message
+        """
+        descriptions = dict()
+        payloads = dict()
+        for submsg in msg.submessages or ():
+            if is_chunk(submsg):
+                if nlip_compare_string(submsg.format, AllowedFormats.structured):
+                    descriptions[submsg.label] = submsg.content
+                else:
+                    payloads[submsg.label] = submsg.content
+        completed = list()
+        for label, description in descriptions.items():
+            if label not in payloads:
+                raise MalformedMessageError(f"chunk {label} has no payload")
+            transfer = self.add_chunk(description, payloads[label])
+            if transfer is not None:
+                completed.append(transfer)
+        return completed
+
+    def restore(self, msg: NLIP_Message) -> NLIP_Message:
+        """This function puts back the content of complete transfers in a message given by split_message.
+
+        Args:
+            msg (NLIP_Message): The message with references to transfers
+
+        Returns:
+            NLIP_Message: A message with the restored submessages in place of the references
+        """
+        if not msg.submessages:
+            return msg
+        submessages = list()
+        for submsg in msg.submessages:
+            if nlip_compare_string(submsg.subformat, REFERENCE_SUBFORMAT) and isinstance(submsg.content, dict):
+                transfer = self.transfers.get(submsg.content.get('transfer'))
+                if transfer is None:
+                    raise MalformedMessageError(f"unknown transfer {submsg.content.get('transfer')!r}")
+                submsg = transfer.to_submessage()
+            submessages.append(submsg)
+        return msg.model_copy(update={'submessages': submessages})
+
+    def discard(self, transfer_id: str):
+        """Forgets a transfer and removes its files"""
+        transfer = self.transfers.pop(transfer_id, None)
+        if transfer is not None:
+            transfer.discard()
@@ -0,0 +1,238 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file contains an asyncio client that exchanges NLIP Messages with peer agents.
+
+NLIPClient POSTs the JSON encoding of a message over HTTP/1.1 and parses the reply
+incrementally as it arrives. Connections are kept alive and pooled per host, the
+number of connections is bounded per host and overall, and requests are retried
+when a pooled connection turns out to be closed or the peer is overloaded.
+
+Only HTTP/1.1 is implemented, on the asyncio streams of the standard library,
+so the client has no dependency beyond the SDK.
+
+"""
+
+import asyncio
+import ssl
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from nlip_sdk.errors import MalformedMessageError, TransportError
+from nlip_sdk.nlip import NLIP_Message
+from nlip_sdk.streaming import NLIP_StreamParser
+from nlip_sdk.transport import JSON_CONTENT_TYPE, format_head, iter_body, read_head
+
+
+# Statuses after which a request is retried
+RETRY_STATUSES = frozenset((502, 503, 504))
+
+
+class _Connection:
+    """ A keep-alive connection to a host """
+    __slots__ = ('reader', 'writer', 'idle_since')
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.idle_since = None
+
+    def is_usable(self, keepalive_expiry: float) -> bool:
+        return (not self.writer.is_closing() and not self.reader.at_eof()
+                and time.monotonic() - self.idle_since < keepalive_expiry)
+
+    def close(self):
+        self.writer.close()
+
+
+class _HostPool:
+    """ The idle connections to a host and the bound on the connections in use """
+    def __init__(self, max_connections: int):
+        self.idle = deque()
+        self.limit = asyncio.Semaphore(max_connections)
+
+
+class NLIPClient:
+    """
+    An asyncio client sending NLIP messages to peer agents over pooled HTTP/1.1 connections.
+    It should be closed after use, e.g. by using it as an async context manager.
+
+    Constructor Arguments:
+        base_url (str): The URL used when send is not given one, e.g. http://localhost:8010/nlip/
+        max_connections (int): The largest number of connections in use at once, over all hosts
+        max_connections_per_host (int): The largest number of connections in use at once to a host
+        timeout (float): The time in seconds allowed for a whole exchange, None for no limit
+        connect_timeout (float): The time in seconds allowed to open a connection
+        retries (int): The number of times a failed exchange is retried
+        backoff (float): The delay in seconds before the first retry, doubled at each retry
+        keepalive_expiry (float): The time in seconds after which idle connections are not reused
+        headers (dict): Additional headers sent with every request
+        ssl_context (SSLContext): The TLS settings for https URLs, the system defaults if None
+    """
+    def __init__(self, base_url:str=None, max_connections:int=100, max_connections_per_host:int=10,
+                 timeout:float=30.0, connect_timeout:float=10.0, retries:int=2, backoff:float=0.1,
+                 keepalive_expiry:float=5.0, headers:dict=None, ssl_context:ssl.SSLContext=None):
+        self.base_url = base_url
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.keepalive_expiry = keepalive_expiry
+        self.headers = dict(headers) if headers else dict()
+        self.ssl_context = ssl_context
+        self._limit = asyncio.Semaphore(max_connections)
+        self._pools = dict()
+        self._closed = False
+
+    async def __aenter__(self) -> 'NLIPClient':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Closes all the idle connections. Connections in use are closed when their exchange ends."""
+        self._closed = True
+        for pool in self._pools.values():
+            while pool.idle:
+                pool.idle.pop().close()
+
+    async def send(self, msg:NLIP_Message, url:str=None, on_submessage=None) -> NLIP_Message:
+        """This function sends a message and returns the reply of the peer.
+
+        Args:
+            msg (NLIP_Message): The message to send
+            url (str): The URL of the peer, base_url if None
+            on_submessage (Callable): Optional callback called with (position, submessage)
+                for each submessage of the reply as soon as it has arrived
+
+        Returns:
+            NLIP_Message: The reply, or None if the peer replied without a body
+        """
+        return await self.send_json(msg.to_json().encode('utf-8'), url, on_submessage)
+
+    async def send_json(self, body:bytes, url:str=None, on_submessage=None) -> NLIP_Message:
+        """This function sends a message already encoded as JSON, e.g. to send it to several 
+        peers while encoding it once, and returns the reply of the peer.
+
+        Args:
+            body (bytes): The UTF-8 encoded JSON of the message
+            url (str): The URL of the peer, base_url if None
+            on_submessage (Callable): Optional callback called with (position, submessage)
+                for each submessage of the reply as soon as it has arrived
+
+        Returns:
+            NLIP_Message: The reply, or None if the peer replied without a body
+        """
+        url = url or self.base_url
+        if url is None:
+            raise ValueError("No URL given and no base_url set")
+        attempt = 0
+        while True:
+            try:
+                if self.timeout is None:
+                    return await self._exchange(url, body, on_submessage)
+                return await asyncio.wait_for(self._exchange(url, body, on_submessage), self.timeout)
+            except TransportError as e:
+                if e.status not in RETRY_STATUSES or attempt >= self.retries:
+                    raise
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                if attempt >= self.retries:
+                    raise TransportError(url, f"connection failed ({e!r})")
+            except asyncio.TimeoutError:
+                raise TransportError(url, "timed out")
+            except OSError as e:
+                raise TransportError(url, f"could not connect ({e})")
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+
+    async def _exchange(self, url: str, body: bytes, on_submessage) -> NLIP_Message:
+        parts = urlsplit(url)
+        secure = parts.scheme == 'https'
+        host = parts.hostname
+        port = parts.port or (443 if secure else 80)
+        target = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        key = (parts.scheme, host, port)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = _HostPool(self.max_connections_per_host)
+
+        # The limit of the host is taken first, so that requests waiting for a busy host 
+        # do not hold connections that requests to other hosts could use
+        async with pool.limit, self._limit:
+            connection = await self._acquire(pool, host, port, secure)
+            reusable = False
+            try:
+                headers = {'Host': parts.netloc, 'Content-Type': JSON_CONTENT_TYPE,
+                           'Accept': JSON_CONTENT_TYPE, 'Content-Length': str(len(body)),
+                           'Connection': 'keep-alive'}
+                headers.update(self.headers)
+                connection.writer.write(format_head(f"POST {target} HTTP/1.1", headers))
+                connection.writer.write(body)
+                await connection.writer.drain()
+
+                head = await read_head(connection.reader)
+                if head is None:
+                    raise ConnectionResetError("connection closed by the peer")
+                try:
+                    status = int(head.first_line[1])
+                except ValueError:
+                    raise MalformedMessageError(f"invalid HTTP status {head.first_line[1]}")
+                until_close = head.body_until_close()
+                if status >= 300:
+                    reason = head.first_line[2] if len(head.first_line) > 2 else ''
+                    async for _ in iter_body(connection.reader, head, until_close=until_close):
+                        pass
+                    reusable = head.keep_alive() and not until_close
+                    raise TransportError(url, f"{status} {reason}", status)
+                reply = None
+                if head.has_body() or until_close:
+                    parser = NLIP_StreamParser(on_submessage=on_submessage)
+                    received = 0
+                    async for piece in iter_body(connection.reader, head, until_close=until_close):
+                        received += len(piece)
+                        parser.feed(piece)
+                    if received:
+                        reply = parser.close()
+                reusable = head.keep_alive() and not until_close
+                return reply
+            finally:
+                self._release(pool, connection, reusable)
+
+    async def _acquire(self, pool: _HostPool, host: str, port: int, secure: bool) -> _Connection:
+        while pool.idle:
+            connection = pool.idle.pop()
+            if connection.is_usable(self.keepalive_expiry):
+                return connection
+            connection.close()
+        context = None
+        if secure:
+            context = self.ssl_context or ssl.create_default_context()
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=context),
+                                                self.connect_timeout)
+        return _Connection(reader, writer)
+
+    def _release(self, pool: _HostPool, connection: _Connection, reusable: bool):
+        if reusable and not self._closed:
+            connection.idle_since = time.monotonic()
+            pool.idle.append(connection)
+        else:
+            connection.close()
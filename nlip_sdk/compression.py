@@ -0,0 +1,334 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file provides optional compression of NLIP Messages.
+
+A whole message can be compressed into an envelope that starts with a header naming
+the codec, or large submessages can be compressed selectively. A compressed submessage
+is itself a valid binary submessage: its subformat is compressed/<codec>, its label is
+kept, and its content is the compressed JSON of the original submessage. In both cases
+decompress_message restores the original message, whatever codec was used.
+
+The codecs of the standard library (zlib, gzip) are always available; zstd and lz4 are
+available when the zstandard and lz4 packages are installed.
+
+Compressed data comes from peers, so decompression is bounded: decompress_message stops
+and raises MalformedMessageError as soon as the decompressed data of a message exceeds
+max_size bytes (DEFAULT_MAX_SIZE by default), so that a small payload can not expand
+into an unbounded amount of memory.
+
+"""
+
+import gzip
+import zlib
+from base64 import b64decode
+from binascii import Error as Base64Error
+
+from nlip_sdk.errors import MalformedMessageError, RethrownException
+from nlip_sdk.json_backend import encode_model, get_backend
+from nlip_sdk.nlip import AllowedFormats, NLIP_Message, NLIP_SubMessage
+
+
+# Prefix of the subformat of compressed submessages
+COMPRESSED_SUBFORMAT = 'compressed/'
+
+# First bytes of a compressed message envelope, followed by the flags, the length of
+# the codec name, the codec name and the compressed encoding of the message.
+MAGIC = b'\x00NLZ'
+_WIRE_FLAG = 0x01
+
+# Default limit in bytes of the decompressed data of a message
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+class Codec:
+    """
+    A compression algorithm.
+
+    Constructor Arguments:
+        name (str): The name of the codec, recorded in compressed messages
+        compress (Callable): Function compressing bytes
+        decompress (Callable): Function decompressing bytes
+        decompress_bounded (Callable): Function called with (data, max_length) that
+            decompresses at most max_length bytes, and returns the decompressed bytes and
+            whether the data was fully decompressed. Without it, the output of decompress 
+            is checked once it is complete, which does not protect against decompression bombs.
+    """
+    def __init__(self, name: str, compress, decompress, decompress_bounded=None):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+        self.decompress_bounded = decompress_bounded
+
+
+def _zlib_bounded(wbits: int):
+    def decompress_bounded(data, max_length: int) -> tuple:
+        decompressor = zlib.decompressobj(wbits)
+        output = decompressor.decompress(data, max_length)
+        if not decompressor.eof and not decompressor.unconsumed_tail:
+            raise zlib.error("incomplete or truncated stream")
+        return output, decompressor.eof
+    return decompress_bounded
+
+
+def _zstd_codec() -> Codec:
+    import zstandard
+    decompressor = zstandard.ZstdDecompressor()
+
+    def decompress_bounded(data, max_length: int) -> tuple:
+        # The size recorded in the frame is not trusted: the output is read up to the limit
+        with decompressor.stream_reader(bytes(data)) as reader:
+            output = reader.read(max_length)
+            return output, len(output) < max_length or reader.read(1) == b''
+    return Codec('zstd', zstandard.ZstdCompressor().compress, decompressor.decompress, decompress_bounded)
+
+
+def _lz4_codec() -> Codec:
+    import lz4.frame
+
+    def decompress_bounded(data, max_length: int) -> tuple:
+        decompressor = lz4.frame.LZ4FrameDecompressor()
+        output = decompressor.decompress(data, max_length)
+        return output, decompressor.eof
+    return Codec('lz4', lz4.frame.compress, lz4.frame.decompress, decompress_bounded)
+
+
+_CODEC_FACTORIES = {
+    'zlib': lambda: Codec('zlib', zlib.compress, zlib.decompress, _zlib_bounded(zlib.MAX_WBITS)),
+    'gzip': lambda: Codec('gzip', lambda data: gzip.compress(data, mtime=0), gzip.decompress,
+                          _zlib_bounded(16 + zlib.MAX_WBITS)),
+    'zstd': _zstd_codec,
+    'lz4': _lz4_codec,
+}
+
+_codecs = dict()
+
+
+def get_codec(name: str) -> Codec:
+    """This function returns the codec with the given name.
+
+    Args:
+        name (str): zlib, gzip, zstd or lz4
+
+    Returns:
+        Codec: The codec
+    """
+    codec = _codecs.get(name)
+    if codec is None:
+        if name not in _CODEC_FACTORIES:
+            raise ValueError(f"Unknown codec {name}, expected one of {', '.join(_CODEC_FACTORIES)}")
+        try:
+            codec = _codecs[name] = _CODEC_FACTORIES[name]()
+        except ImportError as e:
+            raise RethrownException(f"Codec {name} is not available", e)
+    return codec
+
+
+def register_codec(codec: Codec):
+    """Makes a codec available under its name, replacing any codec with the same name"""
+    _CODEC_FACTORIES[codec.name] = lambda: codec
+    _codecs[codec.name] = codec
+
+
+def available_codecs() -> list:
+    """Returns the names of the codecs that can be used"""
+    names = list()
+    for name in _CODEC_FACTORIES:
+        try:
+            get_codec(name)
+        except RethrownException:
+            continue
+        names.append(name)
+    return names
+
+
+def _peer_codec(name: str) -> Codec:
+    """ Returns the codec named in data received from a peer """
+    try:
+        return get_codec(name)
+    except ValueError as e:
+        raise MalformedMessageError(f"unknown compression codec {name!r}") from e
+
+
+def _decode_message(data, wire: bool = False) -> NLIP_Message:
+    """ Decodes a message received from a peer, plain or decompressed """
+    try:
+        return NLIP_Message.from_bytes(data) if wire else NLIP_Message.from_json(data)
+    except (ValueError, TypeError) as e:
+        # ValueError covers the JSON and validation errors
+        raise MalformedMessageError(f"the message is not valid ({e})") from e
+
+
+def _decompress(codec: Codec, data: bytes, max_size: int) -> bytes:
+    try:
+        if codec.decompress_bounded is None:
+            output = codec.decompress(data)
+            complete = len(output) <= max_size
+        else:
+            # One byte more than allowed tells an output at the limit from a larger one
+            output, complete = codec.decompress_bounded(data, max_size + 1)
+    except Exception as e:
+        raise MalformedMessageError(f"{codec.name} compressed data is corrupted ({e})")
+    if not complete or len(output) > max_size:
+        raise MalformedMessageError(f"{codec.name} compressed data expands beyond {max_size} bytes")
+    return output
+
+
+def compress_message(msg: NLIP_Message, codec: str = 'zlib', wire: bool = False) -> bytes:
+    """This function compresses a whole message into an envelope naming the codec.
+
+    Args:
+        msg (NLIP_Message): The message to compress
+        codec (str): The name of the codec
+        wire (bool): If True, the compact binary encoding (to_bytes) is compressed instead of the JSON
+
+    Returns:
+        bytes: The compressed envelope
+    """
+    compressor = get_codec(codec)
+    encoded = msg.to_bytes() if wire else msg.to_json().encode('utf-8')
+    name = compressor.name.encode('ascii')
+    header = MAGIC + bytes((_WIRE_FLAG if wire else 0, len(name))) + name
+    return header + compressor.compress(encoded)
+
+
+def is_compressed(data: bytes) -> bool:
+    """ Checks if the data is a compressed message envelope """
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def decompress_message(data, max_size: int = DEFAULT_MAX_SIZE) -> NLIP_Message:
+    """This function decodes a message, decompressing it if needed.
+    The data may be a compressed envelope or the plain JSON of a message, and any
+    compressed submessages are decompressed as well.
+
+    Args:
+        data (bytes, str or NLIP_Message): The compressed envelope, the JSON, or a decoded message
+        max_size (int): The largest number of bytes the compressed data of the message, 
+            envelope and submessages together, may expand to
+
+    Returns:
+        NLIP_Message: The original message
+    """
+    if isinstance(data, NLIP_Message):
+        msg = data
+    elif isinstance(data, str) or not is_compressed(data):
+        msg = _decode_message(data)
+    else:
+        data = memoryview(data).cast('B')
+        start = len(MAGIC) + 2
+        if len(data) < start or len(data) < start + data[start - 1]:
+            raise MalformedMessageError("the compressed message header is truncated")
+        flags = data[start - 2]
+        end = start + data[start - 1]
+        try:
+            name = str(data[start:end], 'ascii')
+        except UnicodeDecodeError:
+            raise MalformedMessageError("the codec name of the compressed message is not ASCII")
+        encoded = _decompress(_peer_codec(name), data[end:], max_size)
+        max_size -= len(encoded)
+        msg = _decode_message(encoded, wire=bool(flags & _WIRE_FLAG))
+    return decompress_submessages(msg, max_size)
+
+
+def _may_exceed(content, threshold: int) -> bool:
+    """ Checks if the encoding of content may be larger than threshold bytes """
+    if isinstance(content, str):
+        # A character takes at least one byte in JSON
+        return len(content) > threshold
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        return memoryview(content).nbytes > threshold
+    return True
+
+
+def compress_submessages(msg: NLIP_Message, codec: str = 'zlib', threshold: int = 1024,
+                         formats: tuple = (AllowedFormats.text, AllowedFormats.structured)) -> NLIP_Message:
+    """This function compresses the large submessages of a message.
+    A submessage is compressed when its format is one of formats, its encoded size
+    is above the threshold, and compression makes it smaller.
+
+    Args:
+        msg (NLIP_Message): The message, which is left unchanged
+        codec (str): The name of the codec
+        threshold (int): The size in bytes above which a submessage is compressed
+        formats (tuple): The formats of the submessages that may be compressed
+
+    Returns:
+        NLIP_Message: A message sharing the submessages that were not compressed
+    """
+    if not msg.submessages:
+        return msg
+    compressor = get_codec(codec)
+    subformat = COMPRESSED_SUBFORMAT + compressor.name
+    submessages = list()
+    for submsg in msg.submessages:
+        if submsg.format in formats and _may_exceed(submsg.content, threshold):
+            unlabeled = NLIP_SubMessage(format=submsg.format, subformat=submsg.subformat, content=submsg.content)
+            encoded = encode_model(unlabeled)
+            if len(encoded) > threshold:
+                compressed = compressor.compress(encoded)
+                # Binary content grows by a third when the message is encoded in JSON
+                if len(compressed) * 4 // 3 < len(encoded):
+                    submsg = NLIP_SubMessage(format=AllowedFormats.binary, subformat=subformat,
+                                             content=compressed, label=submsg.label)
+        submessages.append(submsg)
+    return msg.model_copy(update={'submessages': submessages})
+
+
+def decompress_submessages(msg: NLIP_Message, max_size: int = DEFAULT_MAX_SIZE) -> NLIP_Message:
+    """This function restores the submessages compressed by compress_submessages.
+
+    Args:
+        msg (NLIP_Message): The message, which is left unchanged
+        max_size (int): The largest number of bytes the compressed submessages may expand to, together
+
+    Returns:
+        NLIP_Message: The message with the original submessages, or msg itself if none was compressed
+    """
+    if not msg.submessages:
+        return msg
+    submessages = list()
+    changed = False
+    for submsg in msg.submessages:
+        if submsg.format == AllowedFormats.binary and submsg.subformat.startswith(COMPRESSED_SUBFORMAT):
+            codec = _peer_codec(submsg.subformat[len(COMPRESSED_SUBFORMAT):])
+            content = submsg.content
+            if isinstance(content, str):
+                try:
+                    content = b64decode(content, validate=True)
+                except (Base64Error, ValueError) as e:
+                    raise MalformedMessageError(f"compressed submessage is not valid base64 ({e})")
+            encoded = _decompress(codec, content, max_size)
+            max_size -= len(encoded)
+            try:
+                fields = get_backend().loads(encoded)
+            except ValueError as e:
+                raise MalformedMessageError(f"compressed submessage is not valid JSON ({e})") from e
+            if not isinstance(fields, dict):
+                raise MalformedMessageError("compressed submessage must be a JSON object")
+            fields['label'] = submsg.label
+            try:
+                submsg = NLIP_SubMessage.model_validate(fields)
+            except ValueError as e:
+                raise MalformedMessageError(f"compressed submessage is not valid ({e})") from e
+            changed = True
+        submessages.append(submsg)
+    if not changed:
+        return msg
+    return msg.model_copy(update={'submessages': submessages})
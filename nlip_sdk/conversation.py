@@ -0,0 +1,449 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file contains a store associating state with the conversations carried by NLIP Messages.
+
+Conversations are identified by the token of format token and subformat conversation
+(see add_conversation_token). ConversationStore keeps the state of each conversation
+in a backend and evicts it when it has not been used for ttl seconds, or when the
+store holds more than max_entries conversations or max_bytes of state, starting with
+the least recently used conversations.
+
+MemoryBackend keeps the state in the process. SQLiteBackend keeps it, as JSON, in a
+SQLite database file, so that the worker processes of a server can share it.
+
+"""
+
+import asyncio
+import json
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from nlip_sdk.errors import UnImplementedError
+from nlip_sdk.nlip import NLIP_Message
+
+
+class ConversationBackend:
+    """
+    The storage used by a ConversationStore. Entries are kept in the order of their last use.
+    Every method is called with the lock of the store held.
+    """
+    # True if the methods block on I/O, so that the asyncio methods of the store run them in a thread
+    blocking = False
+
+    def get(self, token: str, now: float, expires: float):
+        """Returns the state of a conversation in a tuple, or None if it is unknown or has expired.
+        A conversation that is found is marked as used and its expiry time is set to expires."""
+        raise UnImplementedError('get', 'ConversationBackend')
+
+    def contains(self, token: str, now: float) -> bool:
+        """ Checks if a conversation is stored and has not expired, without marking it as used """
+        raise UnImplementedError('contains', 'ConversationBackend')
+
+    def put(self, token: str, state, expires: float, now: float):
+        """Stores the state of a conversation, marking it as used"""
+        raise UnImplementedError('put', 'ConversationBackend')
+
+    def delete(self, token: str) -> bool:
+        """Removes a conversation, returning True if it was stored"""
+        raise UnImplementedError('delete', 'ConversationBackend')
+
+    def evict(self, now: float, max_entries: int = None, max_bytes: int = None) -> int:
+        """This function removes the expired conversations, then the least recently used ones
+        until there are at most max_entries conversations holding at most max_bytes.
+
+        Returns:
+            int: The number of conversations removed
+        """
+        raise UnImplementedError('evict', 'ConversationBackend')
+
+    def size(self) -> tuple:
+        """Returns the number of conversations stored and the bytes they take"""
+        raise UnImplementedError('size', 'ConversationBackend')
+
+    def count(self) -> int:
+        """Returns the number of conversations stored"""
+        return self.size()[0]
+
+    def clear(self):
+        """Removes every conversation"""
+        raise UnImplementedError('clear', 'ConversationBackend')
+
+    def close(self):
+        """Releases the resources of the backend"""
+
+
+def _pickled_size(state) -> int:
+    return len(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+
+
+class MemoryBackend(ConversationBackend):
+    """
+    The backend keeping the state objects themselves in the process, in least recently used order.
+    The size of a state is only measured when it is needed: when the store limits the total
+    size of the state kept (max_bytes), or when the total size is requested.
+
+    Constructor Arguments:
+        sizer (Callable): The function giving the size in bytes of a state, the size of its pickle by default
+    """
+    def __init__(self, sizer=_pickled_size):
+        self.sizer = sizer
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # The conversations whose size has not been measured yet, stored with a size of None
+        self._unmeasured = set()
+
+    def _measure(self):
+        for token in list(self._unmeasured):
+            state, expires, _ = self._entries[token]
+            size = self.sizer(state)
+            self._entries[token] = (state, expires, size)
+            self._bytes += size
+            self._unmeasured.discard(token)
+
+    def _forget(self, token: str, entry: tuple):
+        if entry[2] is None:
+            self._unmeasured.discard(token)
+        else:
+            self._bytes -= entry[2]
+
+    def get(self, token: str, now: float, expires: float):
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            self.delete(token)
+            return None
+        self._entries[token] = (entry[0], expires, entry[2])
+        self._entries.move_to_end(token)
+        return (entry[0],)
+
+    def contains(self, token: str, now: float) -> bool:
+        entry = self._entries.get(token)
+        return entry is not None and entry[1] > now
+
+    def put(self, token: str, state, expires: float, now: float):
+        old = self._entries.pop(token, None)
+        if old is not None:
+            self._forget(token, old)
+        self._entries[token] = (state, expires, None)
+        self._unmeasured.add(token)
+
+    def delete(self, token: str) -> bool:
+        old = self._entries.pop(token, None)
+        if old is None:
+            return False
+        self._forget(token, old)
+        return True
+
+    def evict(self, now: float, max_entries: int = None, max_bytes: int = None) -> int:
+        if max_bytes is not None:
+            self._measure()
+        removed = 0
+        # With a fixed ttl, the least recently used conversations are the first to expire
+        while self._entries and (next(iter(self._entries.values()))[1] <= now
+                                 or (max_entries is not None and len(self._entries) > max_entries)
+                                 or (max_bytes is not None and self._bytes > max_bytes)):
+            self._forget(*self._entries.popitem(last=False))
+            removed += 1
+        return removed
+
+    def size(self) -> tuple:
+        self._measure()
+        return len(self._entries), self._bytes
+
+    def count(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self._unmeasured.clear()
+        self._bytes = 0
+
+
+# The UPDATE ... RETURNING statement needs SQLite 3.35
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Kinds of state stored by SQLiteBackend
+_MESSAGE_STATE, _JSON_STATE = 'message', 'json'
+
+
+def _encode_state(state) -> tuple:
+    if isinstance(state, NLIP_Message):
+        return _MESSAGE_STATE, state.to_json()
+    try:
+        return _JSON_STATE, json.dumps(state, separators=(',', ':'), ensure_ascii=False)
+    except (TypeError, ValueError) as e:
+        raise TypeError(f"the state of a conversation stored in SQLite must be a NLIP_Message "
+                        f"or a JSON compatible value ({e})") from e
+
+
+def _decode_state(kind: str, data: str):
+    return NLIP_Message.from_json(data) if kind == _MESSAGE_STATE else json.loads(data)
+
+
+class SQLiteBackend(ConversationBackend):
+    """
+    The backend keeping the state in a SQLite database, which may be shared by several processes.
+    The state is stored as JSON, rather than pickled, so that reading a database written by
+    another process can not run code: it must be a NLIP_Message or a JSON compatible value
+    (tuples are read back as lists).
+
+    The number of conversations and their total size are kept up to date by triggers, so
+    that eviction only scans the conversations it removes, through indexes on the time of
+    last use and the expiry time.
+
+    Constructor Arguments:
+        path (str): The database file, created if needed, or ':memory:' for a private database
+        timeout (float): The time in seconds to wait for another process holding the database
+    """
+    blocking = True
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        if path != ':memory:':
+            self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript("""
+            BEGIN;
+            CREATE TABLE IF NOT EXISTS conversations (token TEXT PRIMARY KEY, kind TEXT NOT NULL,
+                state TEXT NOT NULL, expires REAL NOT NULL, used REAL NOT NULL, size INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS conversations_used ON conversations (used);
+            CREATE INDEX IF NOT EXISTS conversations_expires ON conversations (expires);
+            CREATE TABLE IF NOT EXISTS conversation_totals (id INTEGER PRIMARY KEY CHECK (id = 0),
+                count INTEGER NOT NULL, bytes INTEGER NOT NULL);
+            INSERT OR IGNORE INTO conversation_totals
+                SELECT 0, COUNT(*), TOTAL(size) FROM conversations;
+            CREATE TRIGGER IF NOT EXISTS conversations_inserted AFTER INSERT ON conversations BEGIN
+                UPDATE conversation_totals SET count = count + 1, bytes = bytes + new.size;
+            END;
+            CREATE TRIGGER IF NOT EXISTS conversations_deleted AFTER DELETE ON conversations BEGIN
+                UPDATE conversation_totals SET count = count - 1, bytes = bytes - old.size;
+            END;
+            CREATE TRIGGER IF NOT EXISTS conversations_updated AFTER UPDATE OF size ON conversations BEGIN
+                UPDATE conversation_totals SET bytes = bytes - old.size + new.size;
+            END;
+            COMMIT;
+        """)
+
+    def get(self, token: str, now: float, expires: float):
+        if _HAS_RETURNING:
+            row = self._db.execute('UPDATE conversations SET used = ?, expires = ? WHERE token = ? AND expires > ? '
+                                   'RETURNING kind, state', (now, expires, token, now)).fetchone()
+        else:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute('SELECT kind, state FROM conversations WHERE token = ? AND expires > ?',
+                                       (token, now)).fetchone()
+                if row is not None:
+                    self._db.execute('UPDATE conversations SET used = ?, expires = ? WHERE token = ?',
+                                     (now, expires, token))
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        if row is None:
+            self._db.execute('DELETE FROM conversations WHERE token = ? AND expires <= ?', (token, now))
+            return None
+        return (_decode_state(*row),)
+
+    def contains(self, token: str, now: float) -> bool:
+        return self._db.execute('SELECT 1 FROM conversations WHERE token = ? AND expires > ?',
+                                (token, now)).fetchone() is not None
+
+    def put(self, token: str, state, expires: float, now: float):
+        kind, data = _encode_state(state)
+        # An upsert rather than INSERT OR REPLACE, whose deletions do not fire the triggers
+        self._db.execute('INSERT INTO conversations VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (token) DO UPDATE '
+                         'SET kind = excluded.kind, state = excluded.state, expires = excluded.expires, '
+                         'used = excluded.used, size = excluded.size',
+                         (token, kind, data, expires, now, len(data.encode('utf-8'))))
+
+    def delete(self, token: str) -> bool:
+        return self._db.execute('DELETE FROM conversations WHERE token = ?', (token,)).rowcount > 0
+
+    def evict(self, now: float, max_entries: int = None, max_bytes: int = None) -> int:
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            removed = 0
+            if self._db.execute('SELECT 1 FROM conversations WHERE expires <= ? LIMIT 1', (now,)).fetchone():
+                removed += self._db.execute('DELETE FROM conversations WHERE expires <= ?', (now,)).rowcount
+            count, total = self._totals()
+            if max_entries is not None and count > max_entries:
+                removed += self._db.execute(
+                    'DELETE FROM conversations WHERE token IN (SELECT token FROM conversations '
+                    'ORDER BY used LIMIT ?)', (count - max_entries,)).rowcount
+                count, total = self._totals()
+            if max_bytes is not None and total > max_bytes:
+                # Remove the least recently used conversations until the excess is covered
+                excess = total - max_bytes
+                tokens = list()
+                for token, size in self._db.execute('SELECT token, size FROM conversations ORDER BY used'):
+                    tokens.append((token,))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                self._db.executemany('DELETE FROM conversations WHERE token = ?', tokens)
+                removed += len(tokens)
+            self._db.execute('COMMIT')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        return removed
+
+    def _totals(self) -> tuple:
+        return self._db.execute('SELECT count, bytes FROM conversation_totals').fetchone()
+
+    def size(self) -> tuple:
+        count, total = self._totals()
+        return count, int(total)
+
+    def clear(self):
+        self._db.execute('DELETE FROM conversations')
+
+    def close(self):
+        self._db.close()
+
+
+class ConversationStore:
+    """
+    A store of the state of conversations, keyed by conversation token. It may be used from
+    several threads, and from asyncio code through the methods prefixed with a.
+
+    Constructor Arguments:
+        backend (ConversationBackend): The storage, a MemoryBackend if None
+        ttl (float): The time in seconds after its last use at which a conversation expires, None for never
+        max_entries (int): The largest number of conversations kept, None for no limit
+        max_bytes (int): The largest total size of the state kept, None for no limit
+        clock (Callable): The function giving the current time in seconds
+    """
+    def __init__(self, backend: ConversationBackend = None, ttl: float = 3600.0, max_entries: int = 10000,
+                 max_bytes: int = None, clock=time.time):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._lock = threading.RLock()
+
+    def _expires(self, now: float) -> float:
+        return now + self.ttl if self.ttl is not None else float('inf')
+
+    def get(self, token: str, default=None):
+        """This function returns the state of a conversation and renews its time to live.
+
+        Args:
+            token (str): The conversation token
+            default: The value returned if the conversation is unknown or expired
+
+        Returns:
+            The state of the conversation, or default
+        """
+        if token is None:
+            return default
+        with self._lock:
+            now = self.clock()
+            entry = self.backend.get(token, now, self._expires(now))
+            return entry[0] if entry is not None else default
+
+    def set(self, token: str, state):
+        """This function stores the state of a conversation, evicting others if the store is full.
+
+        Args:
+            token (str): The conversation token
+            state: The state, which must be a NLIP_Message or a JSON compatible value for
+                backends shared between processes (see SQLiteBackend)
+        """
+        if token is None:
+            raise ValueError("A conversation token is required")
+        with self._lock:
+            now = self.clock()
+            self.backend.put(token, state, self._expires(now), now)
+            self.backend.evict(now, self.max_entries, self.max_bytes)
+
+    def delete(self, token: str) -> bool:
+        """Forgets a conversation, returning True if it was stored"""
+        with self._lock:
+            return self.backend.delete(token)
+
+    def purge(self) -> int:
+        """Removes the expired conversations and returns the number of conversations removed"""
+        with self._lock:
+            return self.backend.evict(self.clock(), self.max_entries, self.max_bytes)
+
+    def clear(self):
+        with self._lock:
+            self.backend.clear()
+
+    def close(self):
+        with self._lock:
+            self.backend.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.backend.count()
+
+    @property
+    def total_bytes(self) -> int:
+        """ The total size of the state kept """
+        with self._lock:
+            return self.backend.size()[1]
+
+    def __contains__(self, token: str) -> bool:
+        """ Checks if a conversation is stored, without renewing its time to live """
+        if token is None:
+            return False
+        with self._lock:
+            return self.backend.contains(token, self.clock())
+
+    def get_for(self, msg: NLIP_Message, default=None):
+        """Returns the state of the conversation of a message, or default if it has no conversation token"""
+        return self.get(msg.extract_conversation_token(), default)
+
+    def set_for(self, msg: NLIP_Message, state):
+        """Stores the state of the conversation of a message, which must have a conversation token"""
+        self.set(msg.extract_conversation_token(), state)
+
+    async def _run(self, function, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    async def aget(self, token: str, default=None):
+        """ The asyncio version of get """
+        return await self._run(self.get, token, default)
+
+    async def aset(self, token: str, state):
+        """ The asyncio version of set """
+        await self._run(self.set, token, state)
+
+    async def adelete(self, token: str) -> bool:
+        """ The asyncio version of delete """
+        return await self._run(self.delete, token)
+
+    async def aget_for(self, msg: NLIP_Message, default=None):
+        """ The asyncio version of get_for """
+        return await self._run(self.get_for, msg, default)
+
+    async def aset_for(self, msg: NLIP_Message, state):
+        """ The asyncio version of set_for """
+        await self._run(self.set_for, msg, state)
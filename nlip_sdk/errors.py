@@ -48,6 +48,72 @@ class UnitializedConfigurationError(PrivateException):
         super().__init__(f"Configuration parameter {parameter} needs to be defined")
 
 
+class MalformedMessageError(PrivateException):
+    """
+    This Exception is raised when the encoding of a NLIP message can not be parsed.
+
+    Constructor Arguments:
+        reason (str): A description of what is wrong with the encoding
+    """
+    def __init__(self, reason:str):
+        super().__init__(f"Malformed NLIP message: {reason}")
+
+
+class TransportError(PrivateException):
+    """
+    This Exception is raised when a NLIP message can not be exchanged with a peer,
+    either because the connection failed or because the peer answered with an error status.
+
+    Constructor Arguments:
+        url (str): The URL of the peer 
+        reason (str): A description of the failure
+        status (int): The HTTP status returned by the peer, if any
+    """
+    def __init__(self, url:str, reason:str, status:int = None):
+        self.url = url
+        self.status = status
+        super().__init__(f"Exchange with {url} failed: {reason}")
+
+
+class AuthenticationError(PrivateException):
+    """
+    This Exception is raised when the authentication token of a NLIP message is missing or is not valid.
+
+    Constructor Arguments:
+        reason (str): A description of why the token was refused
+    """
+    def __init__(self, reason:str):
+        self.reason = reason
+        super().__init__(f"Authentication failed: {reason}")
+
+
+class NoRouteError(PrivateException):
+    """
+    This Exception is raised when no handler is registered for a NLIP message.
+
+    Constructor Arguments:
+        key (tuple): The (messagetype, format, subformat, label) of the message
+    """
+    def __init__(self, key:tuple):
+        self.key = key
+        super().__init__(f"No handler for messagetype={key[0]} format={key[1]} subformat={key[2]} label={key[3]}")
+
+
+class QuorumError(PrivateException):
+    """
+    This Exception is raised when too few peers replied to a NLIP message sent to several peers.
+
+    Constructor Arguments:
+        quorum (int): The number of successful replies that were needed
+        replies (list): The replies received, successful or not
+    """
+    def __init__(self, quorum:int, replies:list):
+        self.quorum = quorum
+        self.replies = replies
+        succeeded = sum(1 for reply in replies if reply.ok)
+        super().__init__(f"Quorum not reached: {succeeded} successful replies out of {quorum} needed")
+
+
 class RethrownException(PrivateException):
     """
     Sometimes it is convenient to rethrow an exception as a child of PrivateException
@@ -0,0 +1,276 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file contains the sending of one NLIP Message to many peers (scatter-gather).
+
+The message is encoded once and sent concurrently with NLIPClient, with a bound on
+the number of exchanges in progress. The replies are given as they arrive, in a
+Reply recording the peer, the reply message or the error, and the elapsed time.
+On top of this, FanOut offers the usual ways to gather them:
+    - as_completed: every reply, in the order they arrive,
+    - first: the first k successful replies,
+    - quorum: the first k successful replies, failing as soon as they can not be had,
+    - all: every reply received before the deadline.
+Each accepts a timeout, after which the exchanges still in progress are cancelled.
+merge_by_conversation groups the replies by the conversation token they carry.
+
+"""
+
+import asyncio
+import time
+
+from nlip_sdk.client import NLIPClient
+from nlip_sdk.errors import QuorumError
+from nlip_sdk.nlip import NLIP_Message
+
+
+class Reply:
+    """
+    The outcome of sending a message to a peer.
+
+    Attributes:
+        url (str): The URL of the peer
+        message (NLIP_Message): The reply, None if the exchange failed or the peer replied without a body
+        error (Exception): The reason the exchange failed, None if it succeeded
+        elapsed (float): The duration of the exchange in seconds
+    """
+    __slots__ = ('url', 'message', 'error', 'elapsed')
+
+    def __init__(self, url: str, message: NLIP_Message = None, error: Exception = None, elapsed: float = 0.0):
+        self.url = url
+        self.message = message
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        outcome = 'ok' if self.ok else f"error={self.error!r}"
+        return f"Reply(url={self.url!r}, {outcome}, elapsed={self.elapsed:.3f})"
+
+
+class Scatter:
+    """
+    The exchanges of one message with several peers, started when it is created.
+    It is an async iterator over the replies in the order they arrive, and an async
+    context manager cancelling the exchanges still in progress on exit.
+
+    Constructor Arguments:
+        client (NLIPClient): The client sending the message
+        body (bytes): The JSON encoding of the message
+        urls (list): The URLs of the peers
+        max_concurrency (int): The largest number of exchanges in progress at once
+        timeout (float): The time in seconds after which iteration stops and the
+            remaining exchanges are cancelled, None for no limit
+    """
+    def __init__(self, client: NLIPClient, body: bytes, urls: list, max_concurrency: int = 16,
+                 timeout: float = None):
+        loop = asyncio.get_running_loop()
+        self._client = client
+        self._body = body
+        self._limit = asyncio.Semaphore(max_concurrency)
+        self._done = asyncio.Queue()
+        self._deadline = loop.time() + timeout if timeout is not None else None
+        self._tasks = dict()
+        for url in urls:
+            task = loop.create_task(self._exchange(url))
+            task.add_done_callback(self._done.put_nowait)
+            self._tasks[task] = url
+        self._remaining = len(self._tasks)
+
+    async def _exchange(self, url: str) -> Reply:
+        async with self._limit:
+            start = time.perf_counter()
+            try:
+                message = await self._client.send_json(self._body, url)
+            except Exception as e:
+                return Reply(url, error=e, elapsed=time.perf_counter() - start)
+            return Reply(url, message, elapsed=time.perf_counter() - start)
+
+    @property
+    def pending(self) -> list:
+        """ The URLs of the peers whose exchange is still in progress """
+        return [url for task, url in self._tasks.items() if not task.done()]
+
+    def __aiter__(self) -> 'Scatter':
+        return self
+
+    async def __anext__(self) -> Reply:
+        if self._remaining == 0:
+            raise StopAsyncIteration
+        try:
+            if self._deadline is None:
+                task = await self._done.get()
+            else:
+                remaining = self._deadline - asyncio.get_running_loop().time()
+                task = await asyncio.wait_for(self._done.get(), max(0.0, remaining))
+        except asyncio.TimeoutError:
+            self.cancel()
+            raise StopAsyncIteration
+        self._remaining -= 1
+        if task.cancelled():
+            return Reply(self._tasks[task], error=asyncio.CancelledError())
+        return task.result()
+
+    def cancel(self):
+        """Cancels the exchanges still in progress and ends the iteration"""
+        for task in self._tasks:
+            task.cancel()
+        self._remaining = 0
+
+    async def __aenter__(self) -> 'Scatter':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.cancel()
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+
+
+class FanOut:
+    """
+    Sends NLIP messages to several peers at once and gathers their replies.
+
+    Constructor Arguments:
+        client (NLIPClient): The client sending the messages. Its connection limits also
+            apply, so max_connections_per_host should allow the concurrency wanted.
+        max_concurrency (int): The largest number of exchanges in progress at once, per message
+    """
+    def __init__(self, client: NLIPClient, max_concurrency: int = 16):
+        self.client = client
+        self.max_concurrency = max_concurrency
+
+    def scatter(self, msg: NLIP_Message, urls: list, timeout: float = None) -> Scatter:
+        """This function starts sending a message to peers. It must be called in a running event loop.
+
+        Args:
+            msg (NLIP_Message): The message, encoded once for all the peers
+            urls (list): The URLs of the peers
+            timeout (float): The time in seconds allowed for all the exchanges, None for no limit
+
+        Returns:
+            Scatter: The exchanges, to iterate over in an async with block
+        """
+        body = msg.to_json().encode('utf-8')
+        return Scatter(self.client, body, list(urls), self.max_concurrency, timeout)
+
+    async def as_completed(self, msg: NLIP_Message, urls: list, timeout: float = None):
+        """This function sends a message to peers and yields their replies in the order they arrive.
+        The exchanges still in progress are cancelled when the iteration is left, which 
+        for an early exit of an async for loop happens when the generator is closed, 
+        e.g. with contextlib.aclosing.
+
+        Args:
+            msg (NLIP_Message): The message
+            urls (list): The URLs of the peers
+            timeout (float): The time in seconds after which the iteration stops, None for no limit
+
+        Yields:
+            Reply: The reply of each peer, successful or not
+        """
+        async with self.scatter(msg, urls, timeout) as scatter:
+            async for reply in scatter:
+                yield reply
+
+    async def first(self, msg: NLIP_Message, urls: list, k: int = 1, timeout: float = None) -> list:
+        """This function sends a message to peers and returns the first k successful replies,
+        cancelling the other exchanges.
+
+        Args:
+            msg (NLIP_Message): The message
+            urls (list): The URLs of the peers
+            k (int): The number of successful replies wanted
+            timeout (float): The time in seconds to wait for them, None for no limit
+
+        Returns:
+            list: The successful replies, in the order they arrived. There are fewer than k
+            when too many peers failed or the timeout expired.
+        """
+        replies = list()
+        async with self.scatter(msg, urls, timeout) as scatter:
+            async for reply in scatter:
+                if reply.ok:
+                    replies.append(reply)
+                    if len(replies) >= k:
+                        break
+        return replies
+
+    async def quorum(self, msg: NLIP_Message, urls: list, quorum: int, timeout: float = None) -> list:
+        """This function sends a message to peers and waits for a quorum of successful replies.
+
+        Args:
+            msg (NLIP_Message): The message
+            urls (list): The URLs of the peers
+            quorum (int): The number of successful replies needed
+            timeout (float): The time in seconds to reach the quorum, None for no limit
+
+        Returns:
+            list: The first quorum successful replies, in the order they arrived
+
+        Raises:
+            QuorumError: As soon as so many peers failed that the quorum can not be reached,
+            or when the timeout expires
+        """
+        urls = list(urls)
+        received = list()
+        succeeded = 0
+        async with self.scatter(msg, urls, timeout) as scatter:
+            async for reply in scatter:
+                received.append(reply)
+                if reply.ok:
+                    succeeded += 1
+                    if succeeded >= quorum:
+                        return [reply for reply in received if reply.ok]
+                elif len(urls) - (len(received) - succeeded) < quorum:
+                    break
+        raise QuorumError(quorum, received)
+
+    async def all(self, msg: NLIP_Message, urls: list, timeout: float = None) -> list:
+        """This function sends a message to peers and returns the replies received before the deadline.
+
+        Args:
+            msg (NLIP_Message): The message
+            urls (list): The URLs of the peers
+            timeout (float): The time in seconds to wait, None to wait for every peer
+
+        Returns:
+            list: The replies, successful or not, in the order they arrived. The peers
+            missing did not reply in time.
+        """
+        async with self.scatter(msg, urls, timeout) as scatter:
+            return [reply async for reply in scatter]
+
+
+def merge_by_conversation(replies: list) -> dict:
+    """This function groups the successful replies by the conversation token they carry.
+
+    Args:
+        replies (list): The replies, as given by FanOut
+
+    Returns:
+        dict: The reply messages by conversation token (None for replies without one),
+        in the order of the replies
+    """
+    merged = dict()
+    for reply in replies:
+        if reply.ok and reply.message is not None:
+            merged.setdefault(reply.message.extract_conversation_token(), []).append(reply.message)
+    return merged
@@ -0,0 +1,229 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file selects the JSON library used to decode NLIP Messages.
+
+The fastest available library among orjson and msgspec is used, falling back to the
+json module of the standard library when neither is installed. The choice can be
+overridden with the NLIP_JSON_BACKEND environment variable or with set_backend.
+
+The backends only decode. Encoding, with encode_model and dumps, always uses the encoder
+built into pydantic-core. Its output is the reference JSON form of a message, and it is
+faster than the alternatives once their cost is counted in full: the models must first
+be converted to dictionaries for them, and their output differs from pydantic for floats
+(exponents are written differently by each library) and for integers beyond 64 bits,
+which would have to be detected and re-encoded. So the encoding of a message is byte for
+byte the same whichever backend is selected.
+
+"""
+
+import json
+import os
+
+from pydantic import BaseModel
+from pydantic_core import SchemaValidator, to_json
+
+from nlip_sdk.errors import RethrownException
+
+
+class JSONBackend:
+    """
+    A JSON library used to decode NLIP messages. This base class uses the json module
+    of the standard library. Subclasses wrap faster libraries.
+
+    Attributes:
+        name (str): The name used to select the backend
+        fast (bool): True if decoding with the library and validating the decoded value
+            is faster than the JSON decoder built into pydantic
+    """
+    name = 'stdlib'
+    fast = False
+
+    def loads(self, data):
+        """Decodes JSON from str or bytes"""
+        return json.loads(data)
+
+    def validate_json(self, validator: SchemaValidator, data):
+        """This function decodes JSON and validates it against a pydantic schema.
+
+        Args:
+            validator (SchemaValidator): The validator of a model (__pydantic_validator__) or a TypeAdapter
+            data (str or bytes): The JSON to be decoded
+
+        Returns:
+            The validated value
+        """
+        if self.fast:
+            return validator.validate_python(self.loads(data))
+        return validator.validate_json(data)
+
+
+# Decoded floats outside this range, bounds excluded, may be integers beyond 64 bits that were converted
+_INT64_MIN = -2.0 ** 63
+_UINT64_LIMIT = 2.0 ** 64
+
+
+# Returned by _FastBackend._fast_loads for JSON to be decoded by another decoder
+_FALLBACK = object()
+
+
+def _has_large_float(value) -> bool:
+    """ Checks if a decoded JSON value contains a float outside the range of 64-bit integers """
+    for item in (value.values() if type(value) is dict else value):
+        kind = type(item)
+        if kind is float:
+            if not _INT64_MIN < item < _UINT64_LIMIT:
+                return True
+        elif (kind is dict or kind is list) and _has_large_float(item):
+            return True
+    return False
+
+
+class _FastBackend(JSONBackend):
+    """
+    A backend wrapping a library faster than the standard library. Such libraries refuse
+    some valid JSON, or silently decode integers beyond 64 bits as floats: JSON that they
+    refuse, or whose decoding contains floats beyond the range of 64-bit integers, is
+    decoded again by the standard library. Checking the decoded value costs far less than
+    searching the encoding for long runs of digits.
+
+    Constructor Arguments:
+        decode (Callable): The decoding function of the library
+        errors (tuple): The exceptions it raises for JSON that it refuses
+    """
+    fast = True
+
+    def __init__(self, decode, errors: tuple = (ValueError,)):
+        self._decode = decode
+        self._errors = errors
+
+    def _fast_loads(self, data):
+        """Returns the decoded value, or _FALLBACK if the library could not decode it faithfully"""
+        try:
+            value = self._decode(data)
+        except self._errors:
+            return _FALLBACK
+        kind = type(value)
+        if kind is float:
+            large = not _INT64_MIN < value < _UINT64_LIMIT
+        else:
+            try:
+                large = (kind is dict or kind is list) and _has_large_float(value)
+            except RecursionError:
+                large = True
+        return _FALLBACK if large else value
+
+    def loads(self, data):
+        value = self._fast_loads(data)
+        return json.loads(data) if value is _FALLBACK else value
+
+    def validate_json(self, validator: SchemaValidator, data):
+        # The JSON the library can not decode is left to pydantic, so that exactly the
+        # same input is accepted as with the standard backend (e.g. not lone surrogates)
+        value = self._fast_loads(data)
+        if value is _FALLBACK:
+            return validator.validate_json(data)
+        return validator.validate_python(value)
+
+
+class OrjsonBackend(_FastBackend):
+    """ The backend using orjson """
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        super().__init__(orjson.loads)
+
+
+class MsgspecBackend(_FastBackend):
+    """ The backend using msgspec """
+    name = 'msgspec'
+
+    def __init__(self):
+        import msgspec
+        super().__init__(msgspec.json.Decoder().decode, (ValueError, msgspec.DecodeError))
+
+
+# The backends in order of preference when detecting the available libraries
+BACKENDS = {backend.name: backend for backend in (OrjsonBackend, MsgspecBackend, JSONBackend)}
+
+_backend = None
+
+
+def available_backends() -> list:
+    """Returns the names of the backends that can be used, in order of preference"""
+    names = list()
+    for name, backend in BACKENDS.items():
+        try:
+            backend()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def set_backend(name: str = 'auto') -> JSONBackend:
+    """This function selects the JSON library used by the SDK to decode messages.
+
+    Args:
+        name (str): orjson, msgspec or stdlib, or auto to use the fastest one installed
+
+    Returns:
+        JSONBackend: The selected backend
+    """
+    global _backend
+    if name == 'auto':
+        name = available_backends()[0]
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown JSON backend {name}, expected one of auto, {', '.join(BACKENDS)}")
+    try:
+        _backend = BACKENDS[name]()
+    except ImportError as e:
+        raise RethrownException(f"JSON backend {name} is not available", e)
+    return _backend
+
+
+def get_backend() -> JSONBackend:
+    """Returns the JSON backend in use, selecting it on first use"""
+    if _backend is None:
+        return set_backend(os.environ.get('NLIP_JSON_BACKEND', 'auto'))
+    return _backend
+
+
+def loads(data):
+    """Decodes JSON from str or bytes with the backend in use"""
+    return get_backend().loads(data)
+
+
+def dumps(value) -> bytes:
+    """Encodes a JSON compatible value as compact UTF-8 JSON, with pydantic_core.to_json whatever the backend"""
+    return to_json(value)
+
+
+def encode_model(model: BaseModel) -> bytes:
+    """This function encodes a message or submessage, leaving out the fields that are None.
+    It uses the encoder of pydantic-core whatever the backend.
+
+    Args:
+        model (BaseModel): The NLIP_Message or NLIP_SubMessage
+
+    Returns:
+        bytes: The same bytes as model.model_dump_json(exclude_none=True).encode()
+    """
+    return to_json(model, exclude_none=True)
@@ -0,0 +1,224 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file contains a NLIP Message whose submessages are validated on first access.
+
+NLIP_LazyMessage.from_json decodes the JSON of a message with the selected JSON backend
+and validates its top-level fields, but keeps each submessage as its decoded JSON object.
+A submessage is validated into a NLIP_SubMessage only when it is accessed: by position
+with submessage(), or through find_labeled_submessage and the extract_* methods, which
+validate only the submessages they return. Building the pydantic models is most of the
+cost of parsing a message, so routing or forwarding a message does not pay for the
+content it never inspects.
+
+to_json encodes the submessages that were not accessed from their JSON objects.
+to_message gives the equivalent NLIP_Message, validating every submessage.
+
+"""
+
+from typing import Union
+
+from pydantic_core import to_json
+
+from nlip_sdk.errors import MalformedMessageError
+from nlip_sdk.json_backend import encode_model, get_backend
+from nlip_sdk.nlip import NLIP_Message, NLIP_SubMessage, _SubMessageIndex, _SubMessageList
+from nlip_sdk.streaming import NLIP_StreamParser, _validate
+
+
+def _check_submessages(submessages) -> list:
+    if submessages is None:
+        return list()
+    if not isinstance(submessages, list):
+        raise MalformedMessageError("submessages must be a JSON array")
+    for submessage in submessages:
+        if not isinstance(submessage, dict):
+            raise MalformedMessageError("a submessage must be a JSON object")
+    return submessages
+
+
+def _key_value(value):
+    return value if isinstance(value, str) else None
+
+
+class _SubMessageKeys:
+    """ The format, subformat and label of a submessage that is not validated """
+    __slots__ = ('format', 'subformat', 'label')
+
+    def __init__(self, fields: dict):
+        self.format = _key_value(fields.get('format'))
+        self.subformat = _key_value(fields.get('subformat'))
+        self.label = _key_value(fields.get('label'))
+
+
+class NLIP_LazyMessage:
+    """A NLIP message whose submessages are kept as JSON objects until they are accessed.
+    It offers the accessors of NLIP_Message; use to_message for anything else.
+
+    Attributes:
+        messagetype (str), format (str), subformat (str), content, label (str): The validated
+        top-level fields, as in NLIP_Message.
+    """
+    __slots__ = ('messagetype', 'format', 'subformat', 'content', 'label', '_raw', '_decoded', '_index')
+
+    def __init__(self, top: NLIP_Message, raw: list):
+        self.messagetype = top.messagetype
+        self.format = top.format
+        self.subformat = top.subformat
+        self.content = top.content
+        self.label = top.label
+        self._raw = raw
+        self._decoded = [None] * len(raw)
+        self._index = None
+
+    @classmethod
+    def from_json(cls, data: Union[str, bytes]) -> 'NLIP_LazyMessage':
+        """This function parses a message, leaving its submessages unvalidated.
+
+        Args:
+            data (str or bytes): The JSON encoding of the message
+
+        Returns:
+            NLIP_LazyMessage: The message
+        """
+        try:
+            fields = get_backend().loads(data)
+        except ValueError as e:
+            raise MalformedMessageError(f"invalid JSON ({e})")
+        if not isinstance(fields, dict):
+            raise MalformedMessageError("a message must be a JSON object")
+        raw = _check_submessages(fields.pop('submessages', None))
+        return cls(_validate(NLIP_Message, fields), raw)
+
+    def __len__(self) -> int:
+        """ The number of submessages """
+        return len(self._raw)
+
+    def is_decoded(self, position: int) -> bool:
+        """ Checks if a submessage has been validated """
+        return self._decoded[position] is not None
+
+    def raw_submessage(self, position: int) -> dict:
+        """Returns the JSON object of a submessage as received, without validating it"""
+        return self._raw[position]
+
+    def submessage(self, position: int) -> NLIP_SubMessage:
+        """Returns a submessage, validating it on first access"""
+        submsg = self._decoded[position]
+        if submsg is None:
+            submsg = self._decoded[position] = NLIP_SubMessage.model_validate(self._raw[position])
+        return submsg
+
+    @property
+    def submessages(self) -> list:
+        """ All the submessages, which are validated if they were not yet """
+        if not self._raw:
+            return None
+        return [self.submessage(position) for position in range(len(self._raw))]
+
+    def submessage_index(self) -> _SubMessageIndex:
+        """Returns the index over the keys of the submessages, built on first use"""
+        if not self._raw:
+            return None
+        if self._index is None:
+            self._index = _SubMessageIndex(_SubMessageList(_SubMessageKeys(fields) for fields in self._raw))
+        return self._index
+
+    def extract_field_list(self, format:str, subformat:str = None, label:str=None) -> list:
+        """This function extracts all the fields of specified format from the message,
+        validating only the matching submessages. See NLIP_Message.extract_field_list.
+        """
+        field = self.extract_field(format, subformat, label)
+        field_list = list() if field is None else [field]
+        index = self.submessage_index()
+        if index is not None:
+            for position in index.find(format, subformat, label):
+                value = self.submessage(position).content
+                if value is not None:
+                    field_list.append(value)
+        return field_list
+
+    def find_labeled_submessage(self, label: str) -> NLIP_SubMessage:
+        """Returns the first submessage with the label, compared without case, or None"""
+        if label is None:
+            return None
+        index = self.submessage_index()
+        if index is not None:
+            positions = index.find_label(label)
+            if positions:
+                return self.submessage(positions[0])
+        return None
+
+    is_control_msg = NLIP_Message.is_control_msg
+    extract_field = NLIP_Message.extract_field
+    extract_text = NLIP_Message.extract_text
+    extract_token = NLIP_Message.extract_token
+    extract_conversation_token = NLIP_Message.extract_conversation_token
+    extract_authentication_token = NLIP_Message.extract_authentication_token
+
+    def _top(self) -> NLIP_Message:
+        return NLIP_Message.model_construct(messagetype=self.messagetype, format=self.format,
+                                            subformat=self.subformat, content=self.content, label=self.label)
+
+    def to_message(self) -> NLIP_Message:
+        """Returns the equivalent NLIP_Message, validating every submessage"""
+        msg = self._top()
+        msg.submessages = self.submessages
+        return msg
+
+    def to_json(self) -> str:
+        """This function encodes the message as JSON. The submessages that were not accessed
+        are encoded from their JSON objects; the others from the submessage, as it may have changed.
+
+        Returns:
+            str: The JSON encoding, the same as NLIP_Message.to_json for input produced by it
+        """
+        top = encode_model(self._top())
+        if not self._raw:
+            return top.decode('utf-8')
+        parts = [to_json(fields) if decoded is None else decoded.json_fragment()
+                 for fields, decoded in zip(self._raw, self._decoded)]
+        return b''.join((top[:-1], b',"submessages":[', b','.join(parts), b']}')).decode('utf-8')
+
+
+class NLIP_LazyStreamParser(NLIP_StreamParser):
+    """
+    Incremental parser that builds a NLIP_LazyMessage from chunks of its JSON encoding.
+    It behaves as NLIP_StreamParser, except that submessages are reported and kept as
+    their JSON objects (dict) instead of being validated.
+
+    Constructor Arguments:
+        on_field (Callable): Optional callback called with (name, value) for each top-level field
+        on_submessage (Callable): Optional callback called with (position, JSON object of the submessage)
+    """
+    def _add_element(self, encoded: bytes, events: list):
+        fields = self._loads(encoded)
+        if not isinstance(fields, dict):
+            raise MalformedMessageError("a submessage must be a JSON object")
+        self._add_submessage(fields, events)
+
+    def close(self) -> NLIP_LazyMessage:
+        """This function ends the parse and builds the message.
+
+        Returns:
+            NLIP_LazyMessage: The parsed message, with its top-level fields validated
+        """
+        if not self.is_complete():
+            raise MalformedMessageError("the encoding ended before the message was complete")
+        return NLIP_LazyMessage(_validate(NLIP_Message, self.fields), self.submessages)
@@ -0,0 +1,267 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file contains a lightweight representation of NLIP Message Structures.
+
+NLIP_LiteMessage and NLIP_LiteSubMessage are plain classes with __slots__ that offer
+the same accessors as NLIP_Message and NLIP_SubMessage. They are meant for hot paths
+that build messages from trusted code: construction does no validation at all.
+They convert to and from the pydantic models, with or without validation.
+
+"""
+
+from enum import Enum
+from typing import Union
+
+from pydantic_core import to_jsonable_python
+
+from nlip_sdk.json_backend import dumps
+
+from nlip_sdk.nlip import (AllowedFormats, BinaryContent, NLIP_Message, NLIP_SubMessage,
+                           ReservedTokens, encode_binary)
+
+
+def _plain_value(value):
+    """Converts content and enumerated values to the values used in the JSON form"""
+    if isinstance(value, str):
+        return value.value if isinstance(value, Enum) else value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return encode_binary(value)
+    return to_jsonable_python(value)
+
+
+class NLIP_LiteSubMessage:
+    """A lightweight, unvalidated equivalent of NLIP_SubMessage.
+
+    Unlike NLIP_SubMessage, reassigning the format, subformat or label of a lite sub-message
+    is not tracked by the submessage index of the message holding it: call reset_index 
+    on that message after doing so. 
+
+    Attributes:
+        format (AllowedFormats): The format of the sub-message.
+        subformat (str): The subformat of the sub-message.
+        content (Union[str, dict, BinaryContent]): The content of the sub-message.
+        label (str): The optional label of the sub-message.
+    """
+    __slots__ = ('format', 'subformat', 'content', 'label')
+
+    def __init__(self, format:AllowedFormats, subformat:str, content:Union[str, dict, BinaryContent], label:str=None):
+        self.format = format
+        self.subformat = subformat
+        self.content = content
+        self.label = label
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, NLIP_LiteSubMessage):
+            return NotImplemented
+        return (self.format == other.format and self.subformat == other.subformat
+                and self.content == other.content and self.label == other.label)
+
+    def __repr__(self) -> str:
+        return (f"NLIP_LiteSubMessage(format={self.format!r}, subformat={self.subformat!r}, "
+                f"content={self.content!r}, label={self.label!r})")
+
+    update_content = NLIP_SubMessage.update_content
+    extract_field = NLIP_SubMessage.extract_field
+
+    def to_dict(self) -> dict:
+        """Returns the sub-message as a dictionary of JSON compatible values, like NLIP_SubMessage.model_dump"""
+        result = {'format': _plain_value(self.format),
+                  'subformat': self.subformat,
+                  'content': _plain_value(self.content)}
+        if self.label is not None:
+            result['label'] = self.label
+        return result
+
+    @classmethod
+    def from_model(cls, submsg:NLIP_SubMessage) -> 'NLIP_LiteSubMessage':
+        """Creates the lightweight equivalent of a NLIP_SubMessage, sharing its content"""
+        return cls(submsg.format, submsg.subformat, submsg.content, submsg.label)
+
+    def to_model(self, validate:bool=True) -> NLIP_SubMessage:
+        """Creates the NLIP_SubMessage equivalent of this sub-message, sharing its content
+
+        Args:
+            validate (bool): If False, the sub-message is trusted and constructed without validation
+
+        Returns:
+            NLIP_SubMessage: The equivalent sub-message
+        """
+        if validate:
+            return NLIP_SubMessage(format=self.format, subformat=self.subformat,
+                                   content=self.content, label=self.label)
+        return NLIP_SubMessage.model_construct(format=self.format, subformat=self.subformat,
+                                               content=self.content, label=self.label)
+
+
+class NLIP_LiteMessage:
+    """A lightweight, unvalidated equivalent of NLIP_Message with the same accessors.
+
+    Attributes:
+        messagetype (str): The optional type of the message, e.g. control.
+        format (str): The format of the message.
+        subformat (str): The subformat of the message.
+        content (Union[str, dict, BinaryContent]): The content of the message.
+        label (str): The optional label of the message.
+        submessages (list[NLIP_LiteSubMessage]): The optional list of sub-messages.
+    """
+    __slots__ = ('messagetype', 'format', 'subformat', 'content', 'label', 'submessages', '_index')
+
+    def __init__(self, format:str, subformat:str, content:Union[str, dict, BinaryContent],
+                 messagetype:str=None, label:str=None, submessages:list=None):
+        self.messagetype = messagetype
+        self.format = format
+        self.subformat = subformat
+        self.content = content
+        self.label = label
+        self.submessages = submessages
+        self._index = None
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, NLIP_LiteMessage):
+            return NotImplemented
+        return (self.messagetype == other.messagetype and self.format == other.format
+                and self.subformat == other.subformat and self.content == other.content
+                and self.label == other.label and self.submessages == other.submessages)
+
+    def __repr__(self) -> str:
+        return (f"NLIP_LiteMessage(messagetype={self.messagetype!r}, format={self.format!r}, "
+                f"subformat={self.subformat!r}, content={self.content!r}, label={self.label!r}, "
+                f"submessages={self.submessages!r})")
+
+    # The accessors of NLIP_Message only depend on the attributes shared with this class
+    is_control_msg = NLIP_Message.is_control_msg
+    submessage_index = NLIP_Message.submessage_index
+    reset_index = NLIP_Message.reset_index
+    add_submessage = NLIP_Message.add_submessage
+    extract_field = NLIP_Message.extract_field
+    extract_field_list = NLIP_Message.extract_field_list
+    extract_text = NLIP_Message.extract_text
+    find_labeled_submessage = NLIP_Message.find_labeled_submessage
+    extract_token = NLIP_Message.extract_token
+    extract_conversation_token = NLIP_Message.extract_conversation_token
+    extract_authentication_token = NLIP_Message.extract_authentication_token
+
+    def add_conversation_token(self, conversation_token:str, force_change=False, label=None):
+        if self.extract_conversation_token(label) is None:
+            self.add_submessage(NLIP_LiteSubMessage(AllowedFormats.token, ReservedTokens.conv,
+                                                    conversation_token, label))
+        elif force_change:
+            for submsg in self.submessages:
+                if ReservedTokens.is_conv(submsg.subformat):
+                    submsg.update_content(conversation_token)
+
+    def add_authentication_token(self, token:str, label=None):
+        # If an authorization token already exists, don't add others
+        if self.extract_authentication_token(label) is None:
+            self.add_submessage(NLIP_LiteSubMessage(AllowedFormats.token, ReservedTokens.auth, token, label))
+
+    def add_text(self, content:str, language:str='english', label=None):
+        self.add_submessage(NLIP_LiteSubMessage(AllowedFormats.text, language, content, label))
+
+    def add_token(self, token:str, token_type:str, label:str=None):
+        if ReservedTokens.is_auth(token_type):
+            return self.add_authentication_token(token, label)
+        if ReservedTokens.is_conv(token_type):
+            return self.add_conversation_token(token, label=label)
+        self.add_submessage(NLIP_LiteSubMessage(AllowedFormats.token, token_type, token, label))
+
+    def add_json(self, json_dict:dict, label:str=None):
+        self.add_submessage(NLIP_LiteSubMessage(AllowedFormats.structured, "JSON", json_dict, label))
+
+    def add_structured_text(self, content:str, content_type:str, label:str=None):
+        self.add_submessage(NLIP_LiteSubMessage(AllowedFormats.structured, content_type, content, label))
+
+    def add_binary(self, content:Union[BinaryContent, str], binary_type:str, encoding:str, label:str=None):
+        self.add_submessage(NLIP_LiteSubMessage(AllowedFormats.binary, f"{binary_type}/{encoding}", content, label))
+
+    def add_image(self, content:Union[BinaryContent, str], encoding:str, label:str=None):
+        self.add_binary(content, "image", encoding, label)
+
+    def add_audio(self, content:Union[BinaryContent, str], encoding:str, label:str=None):
+        self.add_binary(content, "audio", encoding, label)
+
+    def add_video(self, content:Union[BinaryContent, str], encoding:str, label:str=None):
+        self.add_binary(content, "video", encoding, label)
+
+    def add_location_text(self, location:str, label:str=None):
+        self.add_submessage(NLIP_LiteSubMessage(AllowedFormats.location, "text", location, label))
+
+    def add_location_gps(self, location:str, label:str=None):
+        self.add_submessage(NLIP_LiteSubMessage(AllowedFormats.location, "gps", location, label))
+
+    def add_error_code(self, error_code:str, label:str=None):
+        self.add_submessage(NLIP_LiteSubMessage(AllowedFormats.error, "code", error_code, label))
+
+    def add_error_text(self, error_descr:str, label:str=None):
+        self.add_submessage(NLIP_LiteSubMessage(AllowedFormats.error, "text", error_descr, label))
+
+    def add_generic(self, content:str, subformat:str, label:str=None):
+        self.add_submessage(NLIP_LiteSubMessage(AllowedFormats.generic, subformat, content, label))
+
+    def to_dict(self) -> dict:
+        """This function exports the message as a dictionary of JSON compatible values.
+        The result is the same as NLIP_Message.to_dict of the equivalent message.
+
+        Returns:
+            dict: The message as a dictionary
+        """
+        result = dict()
+        if self.messagetype is not None:
+            result['messagetype'] = _plain_value(self.messagetype)
+        result['format'] = _plain_value(self.format)
+        result['subformat'] = self.subformat
+        result['content'] = _plain_value(self.content)
+        if self.label is not None:
+            result['label'] = self.label
+        if self.submessages is not None:
+            result['submessages'] = [submsg.to_dict() for submsg in self.submessages]
+        return result
+
+    def to_json(self) -> str:
+        """Returns the same JSON as NLIP_Message.to_json of the equivalent message"""
+        return dumps(self.to_dict()).decode('utf-8')
+
+    @classmethod
+    def from_model(cls, msg:NLIP_Message) -> 'NLIP_LiteMessage':
+        """Creates the lightweight equivalent of a NLIP_Message, sharing its content"""
+        submessages = msg.submessages
+        if submessages is not None:
+            submessages = [NLIP_LiteSubMessage.from_model(submsg) for submsg in submessages]
+        return cls(msg.format, msg.subformat, msg.content, msg.messagetype, msg.label, submessages)
+
+    def to_model(self, validate:bool=True) -> NLIP_Message:
+        """Creates the NLIP_Message equivalent of this message, sharing its content
+
+        Args:
+            validate (bool): If False, the message is trusted and constructed without validation
+
+        Returns:
+            NLIP_Message: The equivalent message
+        """
+        submessages = self.submessages
+        if submessages is not None:
+            submessages = [submsg.to_model(validate) for submsg in submessages]
+        fields = dict(format=self.format, subformat=self.subformat, content=self.content)
+        for name, value in (('messagetype', self.messagetype), ('label', self.label), ('submessages', submessages)):
+            if value is not None:
+                fields[name] = value
+        if validate:
+            return NLIP_Message(**fields)
+        return NLIP_Message.model_construct(**fields)
@@ -0,0 +1,275 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file provides opt-in instrumentation of the operations on NLIP Messages.
+
+When enabled, the construction of messages and submessages, their serialization
+(to_json, to_dict, to_bytes), parsing (from_json, from_bytes, load_many) and the
+extract_* lookups record their count, latency and, where it applies, the size in
+bytes of the encoding. The records are passed to sinks:
+    - MetricsRegistry keeps histograms in the process and can render them in the
+      Prometheus text exposition format,
+    - OpenTelemetrySink records a span per operation, when opentelemetry is installed.
+
+Instrumentation works by wrapping the methods of NLIP_Message and NLIP_SubMessage
+when enable is called, and restoring them when disable is called. So it costs
+nothing while disabled, which is the default.
+
+"""
+
+import threading
+import time
+from bisect import bisect_left
+
+from nlip_sdk.errors import RethrownException
+from nlip_sdk.nlip import NLIP_Message, NLIP_SubMessage
+
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1.0)
+
+# Upper bounds of the size histogram buckets, in bytes
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _length(value):
+    return len(value) if value is not None else None
+
+
+# The instrumented operations: (class, method name, operation name, function giving the size in
+# bytes from the arguments and the result, or None)
+_OPERATIONS = (
+    (NLIP_Message, '__init__', 'construct', None),
+    (NLIP_SubMessage, '__init__', 'construct_submessage', None),
+    (NLIP_Message, 'to_json', 'to_json', lambda args, result: len(result)),
+    (NLIP_Message, 'to_dict', 'to_dict', None),
+    (NLIP_Message, 'to_bytes', 'to_bytes', lambda args, result: len(result)),
+    (NLIP_Message, 'from_json', 'from_json', lambda args, result: _length(args[0])),
+    (NLIP_Message, 'from_bytes', 'from_bytes', lambda args, result: _length(args[0])),
+    (NLIP_Message, 'load_many', 'load_many', lambda args, result: _length(args[0])),
+    (NLIP_Message, 'extract_field', 'extract_field', None),
+    (NLIP_Message, 'extract_field_list', 'extract_field_list', None),
+    (NLIP_Message, 'extract_text', 'extract_text', None),
+    (NLIP_Message, 'extract_token', 'extract_token', None),
+    (NLIP_Message, 'find_labeled_submessage', 'find_labeled_submessage', None),
+)
+
+
+class MetricsSink:
+    """ The receiver of the records of instrumented operations """
+
+    def record(self, operation: str, seconds: float, size: int = None, error: bool = False):
+        """This function is called after each instrumented operation.
+
+        Args:
+            operation (str): The name of the operation, e.g. to_json
+            seconds (float): The duration of the operation
+            size (int): The size in bytes of the encoding produced or parsed, None if it does not apply
+            error (bool): True if the operation raised an exception
+        """
+
+
+class _Histogram:
+    __slots__ = ('bounds', 'counts', 'total')
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def snapshot(self) -> dict:
+        cumulative = list()
+        running = 0
+        for count in self.counts:
+            running += count
+            cumulative.append(running)
+        return {'count': running, 'sum': self.total,
+                'buckets': dict(zip((*self.bounds, float('inf')), cumulative))}
+
+
+class _OperationStats:
+    __slots__ = ('latency', 'size', 'errors')
+
+    def __init__(self):
+        self.latency = _Histogram(LATENCY_BUCKETS)
+        self.size = None
+        self.errors = 0
+
+
+def _format_bound(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+class MetricsRegistry(MetricsSink):
+    """ A sink keeping, per operation, histograms of the latencies and sizes and a count of errors """
+
+    def __init__(self):
+        self._operations = dict()
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, seconds: float, size: int = None, error: bool = False):
+        with self._lock:
+            stats = self._operations.get(operation)
+            if stats is None:
+                stats = self._operations[operation] = _OperationStats()
+            stats.latency.observe(seconds)
+            if size is not None:
+                if stats.size is None:
+                    stats.size = _Histogram(SIZE_BUCKETS)
+                stats.size.observe(size)
+            if error:
+                stats.errors += 1
+
+    def snapshot(self) -> dict:
+        """This function returns the recorded metrics.
+
+        Returns:
+            dict: For each operation, a dictionary with the latency histogram (count, sum and
+            cumulative count per bucket upper bound), the size histogram or None, and the errors
+        """
+        with self._lock:
+            return {operation: {'latency': stats.latency.snapshot(),
+                                'size': stats.size.snapshot() if stats.size is not None else None,
+                                'errors': stats.errors}
+                    for operation, stats in self._operations.items()}
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+
+    def to_prometheus(self, prefix: str = 'nlip') -> str:
+        """Returns the metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = list()
+        for metric, kind, unit in (('latency', 'histogram', 'seconds'), ('size', 'histogram', 'bytes')):
+            name = f"{prefix}_operation_{unit}"
+            lines.append(f"# HELP {name} The {metric} of the operations on NLIP messages in {unit}")
+            lines.append(f"# TYPE {name} {kind}")
+            for operation, stats in sorted(snapshot.items()):
+                histogram = stats[metric]
+                if histogram is None:
+                    continue
+                for bound, count in histogram['buckets'].items():
+                    lines.append(f'{name}_bucket{{operation="{operation}",le="{_format_bound(bound)}"}} {count}')
+                lines.append(f'{name}_sum{{operation="{operation}"}} {histogram["sum"]!r}')
+                lines.append(f'{name}_count{{operation="{operation}"}} {histogram["count"]}')
+        name = f"{prefix}_operation_errors_total"
+        lines.append(f"# HELP {name} The number of operations on NLIP messages that raised an exception")
+        lines.append(f"# TYPE {name} counter")
+        for operation, stats in sorted(snapshot.items()):
+            lines.append(f'{name}{{operation="{operation}"}} {stats["errors"]}')
+        return '\n'.join(lines) + '\n'
+
+
+class OpenTelemetrySink(MetricsSink):
+    """
+    A sink recording each operation as an OpenTelemetry span, child of the current span.
+
+    Constructor Arguments:
+        tracer (Tracer): The tracer creating the spans, the tracer of the nlip_sdk instrumentation if None
+    """
+    def __init__(self, tracer=None):
+        try:
+            from opentelemetry import trace
+        except ImportError as e:
+            raise RethrownException("OpenTelemetry is not available", e)
+        self._status_error = trace.Status(trace.StatusCode.ERROR)
+        self.tracer = tracer if tracer is not None else trace.get_tracer('nlip_sdk')
+
+    def record(self, operation: str, seconds: float, size: int = None, error: bool = False):
+        end = time.time_ns()
+        span = self.tracer.start_span(f"nlip.{operation}", start_time=end - int(seconds * 1e9))
+        if size is not None:
+            span.set_attribute('nlip.size', size)
+        if error:
+            span.set_status(self._status_error)
+        span.end(end_time=end)
+
+
+registry = MetricsRegistry()
+
+_sinks = ()
+_originals = list()
+_lock = threading.Lock()
+
+
+def _instrument(function, operation: str, size_of):
+    perf_counter = time.perf_counter
+
+    def instrumented(*args, **kwargs):
+        start = perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException:
+            elapsed = perf_counter() - start
+            for sink in _sinks:
+                sink.record(operation, elapsed, None, True)
+            raise
+        elapsed = perf_counter() - start
+        size = size_of(args[1:], result) if size_of is not None else None
+        for sink in _sinks:
+            sink.record(operation, elapsed, size)
+        return result
+    instrumented.__name__ = getattr(function, '__name__', operation)
+    instrumented.__doc__ = getattr(function, '__doc__', None)
+    instrumented.__wrapped__ = function
+    return instrumented
+
+
+def enable(*sinks: MetricsSink):
+    """This function starts recording the operations on NLIP messages.
+    Calling it again replaces the sinks.
+
+    Args:
+        sinks (MetricsSink): The receivers of the records, the module registry if none is given
+    """
+    global _sinks
+    with _lock:
+        _sinks = tuple(sinks) if sinks else (registry,)
+        if _originals:
+            return
+        for cls, name, operation, size_of in _OPERATIONS:
+            descriptor = cls.__dict__.get(name)
+            _originals.append((cls, name, descriptor))
+            if isinstance(descriptor, classmethod):
+                # Classmethods receive the class first, as methods receive the instance
+                setattr(cls, name, classmethod(_instrument(descriptor.__func__, operation, size_of)))
+            else:
+                setattr(cls, name, _instrument(getattr(cls, name), operation, size_of))
+
+
+def disable():
+    """Stops recording, restoring the methods of NLIP_Message and NLIP_SubMessage"""
+    global _sinks
+    with _lock:
+        while _originals:
+            cls, name, descriptor = _originals.pop()
+            if descriptor is None:
+                delattr(cls, name)
+            else:
+                setattr(cls, name, descriptor)
+        _sinks = ()
+
+
+def is_enabled() -> bool:
+    return bool(_originals)
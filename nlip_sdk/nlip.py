@@ -23,11 +23,57 @@ This file contains the definition of NLIP Message Structures.
 
 """
 
+import sys
+import weakref
 from enum import Enum
-from typing import Union, Optional
-from json import loads
+from heapq import merge
+from typing import Annotated, ClassVar, Union, Optional
+from binascii import b2a_base64
 
-from pydantic import BaseModel
+from pydantic import AfterValidator, BaseModel, ConfigDict, PlainSerializer, PlainValidator, PrivateAttr, TypeAdapter
+from pydantic_core import to_json as _encode_json
+
+from nlip_sdk.errors import MalformedMessageError
+from nlip_sdk.json_backend import encode_model, get_backend
+from nlip_sdk.utils import map_binary_file
+from nlip_sdk.wire import decode_message, encode_message
+
+# Largest number of distinct strings whose normalized form is remembered
+MAX_NORMALIZED = 65536
+
+# Longest string whose normalized form is remembered and interned. Longer values, which are
+# unlikely to be repeated keys, are lower-cased on each call.
+MAX_NORMALIZED_LENGTH = 64
+
+# The normalized form of the values seen in format, subformat, label and messagetype
+_normalized = dict()
+
+def normalize(value: str) -> str:
+    """
+    Returns the lower-cased form of a value of format, subformat, label or messagetype, as
+    used for the keys of lookup tables (the submessage index, the enum lookup, Router).
+    The form of a value is computed once and interned, so that the normalized forms of
+    equal values are usually the same object and compare by identity in dictionary lookups.
+    Values longer than MAX_NORMALIZED_LENGTH, and new values once MAX_NORMALIZED values are
+    remembered, are neither remembered nor interned, so that the memory taken by values
+    received from peers stays bounded.
+
+    Parameters:
+        value (str): The value, which may be None
+
+    Returns:
+        str: The lower-cased value, or None
+    """
+    if value is None:
+        return None
+    try:
+        return _normalized[value]
+    except KeyError:
+        pass
+    if len(value) > MAX_NORMALIZED_LENGTH or len(_normalized) >= MAX_NORMALIZED:
+        return value.lower()
+    normal = _normalized[value] = sys.intern(value.lower())
+    return normal
 
 def nlip_compare_string(value1: str, value2:str, matchNone:bool=False) -> bool: 
     """
@@ -59,11 +105,14 @@ class CaseInsensitiveEnum(str, Enum):
     """ A custom implementation of an enumerated class that is case-insensitive"""
     @classmethod
     def _missing_(cls, value):
-        value = value.lower()
-        for member in cls:
-            if member.lower() == value:
-                return member
-        return None
+        if not isinstance(value, str):
+            return None
+        # Members by normalized value, built on the first lookup that is not an exact match
+        members = cls.__dict__.get('_members_by_normalized')
+        if members is None:
+            members = {normalize(member.value): member for member in cls}
+            cls._members_by_normalized = members
+        return members.get(normalize(value))
 
 
 class AllowedFormats(CaseInsensitiveEnum):
@@ -92,19 +141,19 @@ class ReservedTokens(CaseInsensitiveEnum):
 
     @classmethod
     def is_reserved(cls, field:str):
-        return field is not None and field.lower().startswith((cls.auth, cls.conv))
+        return field is not None and field.lower().startswith(_RESERVED_PREFIXES)
 
     @classmethod
     def is_auth(cls, field:str):
-        return field is not None and field.lower().startswith(cls.auth)
+        return field is not None and field.lower().startswith(_AUTH)
     
     @classmethod
     def is_conv(cls, field:str):
-        return field is not None and field.lower().startswith(cls.conv)
+        return field is not None and field.lower().startswith(_CONV)
     
     @classmethod
     def is_control(cls, field:str):
-        return nlip_compare_string(cls.control, field)
+        return field is not None and field.lower() == _CONTROL
 
     @classmethod
     def get_suffix(cls, field:str, seperator='') -> str:
@@ -116,22 +165,243 @@ class ReservedTokens(CaseInsensitiveEnum):
             return field
 
 
+# Plain normalized strings of the reserved tokens, so that comparisons do not go through the enum
+_AUTH = normalize(ReservedTokens.auth.value)
+_CONV = normalize(ReservedTokens.conv.value)
+_CONTROL = normalize(ReservedTokens.control.value)
+_RESERVED_PREFIXES = (_AUTH, _CONV)
+
+for _member in (*AllowedFormats, *ReservedTokens):
+    normalize(_member)
+
+
+def _validate_binary(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return value
+    raise ValueError(f"binary content must be bytes, bytearray or memoryview, not {type(value).__name__}")
+
+def encode_binary(value: Union[bytes, bytearray, memoryview]) -> str:
+    """
+    Encodes binary content as the base64 string carried in the JSON form of a message.
+
+    Args:
+        value (bytes, bytearray or memoryview): The binary content
+
+    Returns:
+        str: The standard base64 encoding of the content
+    """
+    return b2a_base64(value, newline=False).decode('ascii')
+
+# Raw binary content of a message or submessage. The buffer passed in is stored as is, 
+# without copying, and is base64 encoded only when the message is serialized to JSON.
+# A memoryview is copied to bytes when the message is pickled or deep copied.
+BinaryContent = Annotated[Union[bytes, bytearray, memoryview], 
+                          PlainValidator(_validate_binary),
+                          PlainSerializer(encode_binary, return_type=str, when_used='json')]
+
+
+# Default size in bytes of the chunks produced by the streaming JSON encoder
+JSON_CHUNK_SIZE = 64 * 1024
+
+def _iter_binary_json(value, chunk_size: int):
+    """Yields the base64 encoding of binary content in pieces of about chunk_size bytes. 
+    Each piece encodes a multiple of 3 bytes, so the pieces concatenate to the full encoding."""
+    view = memoryview(value).cast('B')
+    step = max(3, (chunk_size // 4) * 3)
+    for start in range(0, len(view), step):
+        yield b2a_base64(view[start:start+step], newline=False)
+
+def _iter_text_json(value: str, chunk_size: int):
+    """Yields the JSON string escape of text in pieces of about chunk_size characters. 
+    JSON escaping is done character by character, so the pieces concatenate to the full escape."""
+    for start in range(0, len(value), chunk_size):
+        yield _encode_json(value[start:start+chunk_size])[1:-1]
+
+def _iter_model_json(model: BaseModel, chunk_size: int):
+    """Yields the pieces of the JSON encoding of a NLIP_Message or NLIP_SubMessage. 
+    The pieces concatenate to the same bytes as model_dump_json(exclude_none=True)."""
+    separator = b'{'
+    for name in type(model).model_fields:
+        value = getattr(model, name)
+        if value is None:
+            continue
+        yield separator + b'"' + name.encode('ascii') + b'":'
+        separator = b','
+        if name == 'submessages':
+            yield b'['
+            for position, submsg in enumerate(value):
+                if position > 0:
+                    yield b','
+                try:
+                    cached = _read_cached_json(submsg)
+                except AttributeError:
+                    cached = None
+                if cached is None:
+                    yield from _iter_model_json(submsg, chunk_size)
+                    continue
+                for start in range(0, len(cached), chunk_size):
+                    yield cached[start:start+chunk_size]
+            yield b']'
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            yield b'"'
+            yield from _iter_binary_json(value, chunk_size)
+            yield b'"'
+        elif isinstance(value, str) and len(value) > chunk_size:
+            yield b'"'
+            yield from _iter_text_json(value, chunk_size)
+            yield b'"'
+        else:
+            yield _encode_json(value)
+    yield b'}'
+
+
+_INDEXED_FIELDS = frozenset(('format', 'subformat', 'label'))
+
+_SUBMESSAGES = frozenset(('submessages',))
+
+def _refuse_change(container, *args, **kwargs):
+    raise TypeError("the content of a submessage shared by a NLIP_Template can not be changed in place, "
+                    "see NLIP_Message.writable_submessage")
+
+
+class _FrozenDict(dict):
+    """ A dictionary that can not be changed, the content of a submessage shared by a NLIP_Template """
+    __slots__ = ()
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _refuse_change
+
+    def __reduce_ex__(self, protocol):
+        # Pickling a dictionary subclass would set its items one by one
+        return type(self), (dict(self),)
+
+
+class _FrozenList(list):
+    """ A list that can not be changed, found in the content of a submessage shared by a NLIP_Template """
+    __slots__ = ()
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _refuse_change
+    append = extend = insert = pop = remove = clear = sort = reverse = _refuse_change
+
+    def __reduce_ex__(self, protocol):
+        return type(self), (list(self),)
+
+
+def _freeze(value):
+    """Returns a copy of JSON compatible content in which dictionaries and lists can not be changed"""
+    if isinstance(value, dict):
+        return _FrozenDict({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return _FrozenList([_freeze(item) for item in value])
+    if isinstance(value, tuple):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    """Returns a copy of content frozen by _freeze, made of plain dictionaries and lists"""
+    if isinstance(value, dict):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_thaw(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_thaw(item) for item in value)
+    return value
+
+
+# Types of the content whose JSON encoding may be cached, as they can not be changed in place
+_IMMUTABLE_CONTENT = (str, bytes, _FrozenDict)
+
+# Largest JSON encoding of a submessage kept by its cache, so that large binary content 
+# is not held twice in memory
+MAX_CACHED_JSON = 4 * 1024 * 1024
+
+_object_setattr = object.__setattr__
+
+# Key component used in the submessage index for a subformat or label that was not specified
+_ANY = object()
+
+# Owner of a submessage held by several lists of submessages, see _SubMessageList
+_SHARED = object()
+
+
+def _getstate_with_bytes(model: BaseModel) -> dict:
+    """The pickled state of a message or submessage. A memoryview can not be pickled, 
+    so memoryview content is pickled as a copy in bytes."""
+    state = BaseModel.__getstate__(model)
+    content = state['__dict__'].get('content')
+    if isinstance(content, memoryview):
+        state['__dict__'] = dict(state['__dict__'], content=content.tobytes())
+    return state
+
+
+def _deepcopy_with_bytes(model: BaseModel, memo: dict = None) -> BaseModel:
+    """A deep copy of a message or submessage, in which memoryview content is copied to bytes"""
+    memo = {} if memo is None else memo
+    content = model.content
+    if isinstance(content, memoryview) and id(content) not in memo:
+        memo[id(content)] = content.tobytes()
+    return BaseModel.__deepcopy__(model, memo)
+
 class NLIP_SubMessage(BaseModel):
     """Represents a sub-message in the context of the NLIP protocol.
 
     Attributes:
         format (AllowedFormats): The format of the sub-message.
         subformat (str): The subformat of the sub-message.
-        content (Union[str, dict]): The content of the message. Can be a string or a dictionary. 
-        If a dictionary, the content would be encoded as a nested JSON. 
+        content (Union[str, dict, BinaryContent]): The content of the message. Can be a string, a dictionary
+        or raw binary content. If a dictionary, the content would be encoded as a nested JSON. 
+        Binary content (bytes, bytearray or memoryview) is encoded as a base64 string in JSON. 
     """
+    # The cached JSON encoding of the submessage, see json_fragment, and a weak reference 
+    # to the _SubMessageList holding it. They are slots rather than private attributes, 
+    # which pydantic makes slow to read.
+    __slots__ = ('_json', '_owner')
+
     format: AllowedFormats
     subformat: str
-    content: Union[str, dict]
+    content: Union[str, dict, BinaryContent]
     label: Optional[str] = None
 
-    def update_content(self, content:Union[str, dict]):
+    # Bumped whenever format, subformat or label is reassigned in a submessage held by 
+    # several lists, so that the submessage index of every NLIP_Message is rebuilt. 
+    # The other submessages only change the version of the list holding them.
+    key_generation: ClassVar[int] = 0
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        _object_setattr(self, '_json', None)
+        if name in _INDEXED_FIELDS:
+            _key_changed(self)
+
+    def __eq__(self, other) -> bool:
+        # Submessages shared by templates compare equal to the same plain submessages
+        if not isinstance(other, NLIP_SubMessage):
+            return NotImplemented
+        return self.__dict__ == other.__dict__
+
+    __getstate__ = _getstate_with_bytes
+    __deepcopy__ = _deepcopy_with_bytes
+
+    def update_content(self, content:Union[str, dict, BinaryContent]):
         self.content = content 
+
+    def json_fragment(self) -> bytes:
+        """This function returns the JSON encoding of the submessage, the same as 
+        model_dump_json(exclude_none=True). The encoding is cached until a field is assigned, 
+        when it is at most MAX_CACHED_JSON bytes and the content can not be changed in place 
+        (str or bytes). Submessages with a dict, bytearray or memoryview content are encoded 
+        every time.
+
+        Returns:
+            bytes: The UTF-8 encoded JSON
+        """
+        try:
+            encoded = _read_cached_json(self)
+        except AttributeError:
+            encoded = None
+        if encoded is None:
+            encoded = encode_model(self)
+            if len(encoded) <= MAX_CACHED_JSON and type(self.content) in _IMMUTABLE_CONTENT:
+                _object_setattr(self, '_json', encoded)
+        return encoded
     
     def extract_field(self,format:str, subformat:str = None, label:str=None) -> Union[str, dict]: 
         if nlip_compare_string(self.format, format):
@@ -141,28 +411,299 @@ class NLIP_SubMessage(BaseModel):
 
 
 
+# Read the slots of a submessage. Reading an unset slot as an attribute would fall 
+# back to BaseModel.__getattr__, which is slow to fail.
+_read_cached_json = NLIP_SubMessage.__dict__['_json'].__get__
+_read_owner = NLIP_SubMessage.__dict__['_owner'].__get__
+
+
+def _key_changed(submsg: NLIP_SubMessage):
+    """Invalidates the submessage indexes over a submessage whose format, subformat or label changed"""
+    try:
+        owner = _read_owner(submsg)
+    except AttributeError:
+        # Held by no _SubMessageList, so by no index
+        return
+    if owner is _SHARED:
+        NLIP_SubMessage.key_generation += 1
+        return
+    submessages = owner()
+    if submessages is not None:
+        submessages.version += 1
+
+
+class _SubMessageList(list):
+    """
+    The list of submessages of a NLIP_Message. Its version counts the changes that invalidate 
+    the submessage index of the message: entries inserted, removed, replaced or reordered, 
+    and format, subformat or label reassigned in one of its submessages. Appending does not 
+    change the version, as the index is extended incrementally.
+
+    Each submessage records the list holding it as its owner, so that a change of its key 
+    fields only changes the version of that list. A submessage held by several lists changes 
+    the key_generation of NLIP_SubMessage instead.
+
+    Constructor Arguments:
+        submessages (Iterable): The submessages
+    """
+    def __init__(self, submessages=()):
+        super().__init__(submessages)
+        self.version = 0
+        self._ref = weakref.ref(self)
+        self._own(self)
+
+    def _own(self, submessages):
+        ref = self._ref
+        for submsg in submessages:
+            if not isinstance(submsg, NLIP_SubMessage):
+                continue
+            try:
+                owner = _read_owner(submsg)
+            except AttributeError:
+                owner = None
+            if owner is ref or owner is _SHARED:
+                continue
+            _object_setattr(submsg, '_owner', ref if owner is None or owner() is None else _SHARED)
+
+    def __reduce_ex__(self, protocol):
+        # The weak reference can not be pickled or copied, the copy is a list of its own
+        return type(self), (list(self),)
+
+    def append(self, submsg):
+        super().append(submsg)
+        self._own((submsg,))
+
+    def extend(self, submessages):
+        submessages = list(submessages)
+        super().extend(submessages)
+        self._own(submessages)
+
+    def __iadd__(self, submessages):
+        self.extend(submessages)
+        return self
+
+    def insert(self, position, submsg):
+        super().insert(position, submsg)
+        self._own((submsg,))
+        self.version += 1
+
+    def __setitem__(self, position, value):
+        if isinstance(position, slice):
+            value = list(value)
+            super().__setitem__(position, value)
+            self._own(value)
+        else:
+            super().__setitem__(position, value)
+            self._own((value,))
+        self.version += 1
+
+    def __delitem__(self, position):
+        super().__delitem__(position)
+        self.version += 1
+
+    def __imul__(self, times):
+        super().__imul__(times)
+        self.version += 1
+        return self
+
+    def pop(self, position=-1):
+        submsg = super().pop(position)
+        self.version += 1
+        return submsg
+
+    def remove(self, submsg):
+        super().remove(submsg)
+        self.version += 1
+
+    def clear(self):
+        super().clear()
+        self.version += 1
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.version += 1
+
+    def reverse(self):
+        super().reverse()
+        self.version += 1
+
+
+class _SharedSubMessage(NLIP_SubMessage):
+    """
+    A submessage shared by the messages derived from a NLIP_Template. It is frozen, so that 
+    changing it in one message can not change the others (see NLIP_Message.writable_submessage), 
+    and its cached JSON encoding is reused by all of them. Its content is frozen as well: 
+    a dict content is a copy whose dictionaries and lists raise TypeError when changed, 
+    and a bytearray or writable memoryview content is copied to bytes.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    @classmethod
+    def share(cls, submsg: NLIP_SubMessage) -> '_SharedSubMessage':
+        """Returns a shared submessage with the fields of submsg, which is not validated again"""
+        if isinstance(submsg, cls):
+            return submsg
+        content = submsg.content
+        if isinstance(content, dict):
+            content = _freeze(content)
+        elif isinstance(content, bytearray) or (isinstance(content, memoryview) and not content.readonly):
+            content = bytes(content)
+        return cls.model_construct(format=submsg.format, subformat=submsg.subformat, 
+                                   content=content, label=submsg.label)
+
+
+
+class _SubMessageIndex:
+    """
+    An index over the submessages of a NLIP_Message keyed by the lower-cased 
+    (format, subformat, label) of each submessage. Every submessage is entered 
+    under its exact key as well as under the keys where the subformat and/or the 
+    label are left unspecified, so that each of the lookups done by extract_field_list 
+    and find_labeled_submessage is a single dictionary access. 
+
+    The index keeps the positions of submessages in the list it was built from. It remains 
+    valid as long as that same list is used and its version is unchanged (see _SubMessageList), 
+    which is checked in constant time. Submessages appended to the list are indexed incrementally.
+
+    Constructor Arguments:
+        submessages (_SubMessageList): The list of submessages to be indexed
+    """
+    __slots__ = ('submessages', 'size', 'version', 'generation', 'keys')
+
+    def __init__(self, submessages: _SubMessageList):
+        self.submessages = submessages
+        self.size = 0
+        self.version = submessages.version
+        self.generation = NLIP_SubMessage.key_generation
+        self.keys = dict()
+        self.update()
+
+    def is_valid(self, submessages: _SubMessageList) -> bool:
+        return (submessages is self.submessages 
+                and submessages.version == self.version 
+                and self.generation == NLIP_SubMessage.key_generation)
+
+    def update(self):
+        """Indexes all the submessages appended to the list since the last update"""
+        keys = self.keys
+        for position in range(self.size, len(self.submessages)):
+            submsg = self.submessages[position]
+            format = normalize(submsg.format)
+            subformat = normalize(submsg.subformat)
+            label = normalize(submsg.label)
+            for key in ((format, subformat, label), (format, subformat, _ANY), 
+                        (format, _ANY, label), (format, _ANY, _ANY)):
+                keys.setdefault(key, []).append(position)
+            if label is not None:
+                keys.setdefault((_ANY, _ANY, label), []).append(position)
+        self.size = len(self.submessages)
+
+    def find(self, format: str, subformat: str = None, label: str = None) -> list:
+        """Returns the positions of submessages that match, following nlip_compare_string.
+        As in extract_field, a submessage without a label matches every requested label.
+
+        Args:
+            format (str): The format to be matched. 
+            subformat (str): The subformat to be matched - None matches any subformat
+            label (str): The label to be matched - None matches any label 
+
+        Returns:
+            list: The positions of the matching submessages in increasing order
+        """
+        format = normalize(format)
+        subformat = _ANY if subformat is None else normalize(subformat)
+        if label is None:
+            return self.keys.get((format, subformat, _ANY), [])
+        labeled = self.keys.get((format, subformat, normalize(label)), [])
+        unlabeled = self.keys.get((format, subformat, None), [])
+        if not unlabeled:
+            return labeled
+        if not labeled:
+            return unlabeled
+        return list(merge(labeled, unlabeled))
+
+    def find_label(self, label: str) -> list:
+        """Returns the positions of the submessages with the label (compared without case)"""
+        return self.keys.get((_ANY, _ANY, normalize(label)), [])
+
+
 class NLIP_Message(BaseModel):
     messagetype: Optional[str] = None
     format: str
     subformat: str
-    content: Union[str, dict]
+    content: Union[str, dict, BinaryContent]
     label: Optional[str] = None
-    submessages: Optional[list[NLIP_SubMessage]] = None
+    submessages: Optional[Annotated[list[NLIP_SubMessage], AfterValidator(_SubMessageList)]] = None
+
+    _index: Optional[_SubMessageIndex] = PrivateAttr(default=None)
+
+    def __eq__(self, other) -> bool:
+        # The submessage index is derived state and is left out of the comparison
+        if not isinstance(other, BaseModel):
+            return NotImplemented
+        return type(self) is type(other) and self.__dict__ == other.__dict__
+
+    __getstate__ = _getstate_with_bytes
+    __deepcopy__ = _deepcopy_with_bytes
 
     def is_control_msg(self) -> bool: 
         """ Checks is the message is a control message """
         return self.messagetype is not None and  ReservedTokens.is_control(self.messagetype)
 
+    def submessage_index(self) -> Optional[_SubMessageIndex]:
+        """Returns the index over the submessages, building or refreshing it when needed.
+        The index is built lazily on the first lookup and is rebuilt when the submessages 
+        list is replaced or changed other than by appending, or when a submessage key 
+        field is reassigned. A plain list assigned to submessages, e.g. by model_copy, 
+        is first replaced by a _SubMessageList with the same submessages.
 
+        Returns:
+            _SubMessageIndex: The index, or None if there are no submessages
+        """
+        submessages = self.submessages
+        if not submessages:
+            return None
+        if not isinstance(submessages, _SubMessageList):
+            submessages = self.submessages = _SubMessageList(submessages)
+        index = self._index
+        if index is None or not index.is_valid(submessages):
+            index = self._index = _SubMessageIndex(submessages)
+        elif index.size != len(submessages):
+            index.update()
+        return index
+
+    def reset_index(self):
+        """Discards the submessage index, so it is rebuilt on the next lookup"""
+        self._index = None
 
     def add_submessage(self, submsg:NLIP_SubMessage): 
         if hasattr(self, 'submessages'):
             if self.submessages is None:
-                self.submessages = [submsg]
+                self.submessages = _SubMessageList((submsg,))
             else:
                 self.submessages.append(submsg)
+                index = self._index
+                if index is not None and index.is_valid(self.submessages):
+                    index.update()
         else: 
-            self.submessages = [submsg]
+            self.submessages = _SubMessageList((submsg,))
+
+    def writable_submessage(self, position:int) -> NLIP_SubMessage:
+        """This function returns a submessage that can be changed in place. A submessage 
+        shared with a NLIP_Template, and so with other messages, is first replaced in this 
+        message by a copy of its own (copy on write), with a dict content that can be changed.
+
+        Args:
+            position (int): The position of the submessage
+
+        Returns:
+            NLIP_SubMessage: The submessage at that position
+        """
+        submsg = self.submessages[position]
+        if isinstance(submsg, _SharedSubMessage):
+            submsg = self.submessages[position] = NLIP_SubMessage.model_construct(
+                format=submsg.format, subformat=submsg.subformat, content=_thaw(submsg.content), label=submsg.label)
+        return submsg
 
     def add_conversation_token(self, conversation_token:str, force_change=False, label=None):
         existing_token = self.extract_conversation_token(label)
@@ -176,7 +717,7 @@ class NLIP_Message(BaseModel):
         elif force_change:
             for i, submsg in enumerate(self.submessages):
                 if ReservedTokens.is_conv(submsg.subformat):
-                    self.submessages[i].update_content(conversation_token)
+                    self.writable_submessage(i).update_content(conversation_token)
 
 
     def add_authentication_token(self, token:str, label=None):
@@ -225,12 +766,13 @@ class NLIP_Message(BaseModel):
         """
         field = self.extract_field(format, subformat,label)
         field_list = list() if field is None else [field]
-        if hasattr(self, 'submessages'):
-            if (self.submessages is not None):
-                for submsg in self.submessages:
-                    value = submsg.extract_field(format, subformat,label)
-                    if value is not None: 
-                        field_list = field_list + [value]
+        index = self.submessage_index()
+        if index is not None:
+            submessages = self.submessages
+            for position in index.find(format, subformat, label):
+                value = submessages[position].content
+                if value is not None: 
+                    field_list.append(value)
         
         return field_list
     
@@ -270,9 +812,11 @@ class NLIP_Message(BaseModel):
         
         if label is None:
             return None
-        for submsg in self.submessages:
-            if nlip_compare_string(submsg.label, label):
-                return submsg
+        index = self.submessage_index()
+        if index is not None:
+            positions = index.find_label(label)
+            if positions:
+                return self.submessages[positions[0]]
         
         return None
 
@@ -291,13 +835,161 @@ class NLIP_Message(BaseModel):
 
 
     def to_json(self) -> str:
-        return self.model_dump_json(exclude_none=True)
+        """This function encodes the message as JSON with the encoder of pydantic-core. 
+        The result is always the same as model_dump_json(exclude_none=True). 
+        The first time, the message is encoded at once, which is the fastest. From the second 
+        time, as when a message is sent to several peers, the encoding of each submessage with 
+        a str or bytes content is cached by the submessage (see NLIP_SubMessage.json_fragment), 
+        so only the top-level fields and the other submessages are encoded again.
+
+        Returns:
+            str: The JSON encoding of the message
+        """
+        submessages = self.submessages
+        if not submessages:
+            return encode_model(self).decode('utf-8')
+        try:
+            _read_cached_json(submessages[0])
+        except AttributeError:
+            # Never encoded: the submessages are marked to cache their encoding the next time
+            for submsg in submessages:
+                _object_setattr(submsg, '_json', None)
+            return encode_model(self).decode('utf-8')
+        # The cached encodings of the submessages are spliced after the top-level fields
+        top = _encode_json(self, exclude=_SUBMESSAGES, exclude_none=True)
+        parts = [submsg.json_fragment() for submsg in submessages]
+        return b''.join((top[:-1], b',"submessages":[', b','.join(parts), b']}')).decode('utf-8')
+
+    @classmethod
+    def from_json(cls, data:Union[str, bytes]) -> 'NLIP_Message':
+        """This function decodes and validates a message with the selected JSON backend.
+
+        Args:
+            data (str or bytes): The JSON encoding of the message
+        
+        Returns:
+            NLIP_Message: The decoded message
+        """
+        return get_backend().validate_json(cls.__pydantic_validator__, data)
+
+    def iter_json(self, chunk_size:int=JSON_CHUNK_SIZE):
+        """This function encodes the message as JSON incrementally, submessage by submessage. 
+        Binary content is base64 encoded and long text is escaped a piece at a time, 
+        so the full JSON is never held in memory. The chunks concatenate to to_json().encode().
+
+        Args:
+            chunk_size (int): The approximate size in bytes of the chunks produced
+        
+        Yields:
+            bytes: The successive chunks of the UTF-8 encoded JSON
+        """
+        buffer = bytearray()
+        for piece in _iter_model_json(self, chunk_size):
+            if len(piece) >= chunk_size:
+                if buffer:
+                    yield bytes(buffer)
+                    buffer.clear()
+                yield piece
+                continue
+            buffer += piece
+            if len(buffer) >= chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+
+    def write_json(self, fp, chunk_size:int=JSON_CHUNK_SIZE) -> int:
+        """This function writes the JSON encoding of the message to a binary file-like object 
+        as it is produced by iter_json. 
+
+        Args:
+            fp: The binary file-like object (anything with a write method accepting bytes)
+            chunk_size (int): The approximate size in bytes of each write
+        
+        Returns:
+            int: The number of bytes written
+        """
+        written = 0
+        for chunk in self.iter_json(chunk_size):
+            fp.write(chunk)
+            written += len(chunk)
+        return written
 
     def to_dict(self) -> dict: 
-        str_version =  self.to_json()
-        dict_version = loads(str_version)
-        return dict_version
+        """This function exports the message as a dictionary of JSON compatible values. 
+        The result is the same as parsing to_json() - None fields are left out, enumerated 
+        values are plain strings and binary content is base64 encoded - but it is produced 
+        directly, without encoding the message as a JSON string first. 
+
+        Returns:
+            dict: The message as a dictionary
+        """
+        return self.model_dump(mode='json', exclude_none=True)
     
+    def to_bytes(self) -> bytes:
+        """This function encodes the message in the compact binary encoding defined in wire.py. 
+        Binary content is carried as raw bytes and common values are interned. 
+
+        Returns:
+            bytes: The binary encoding of the message
+        """
+        return encode_message(self.model_dump(exclude_none=True))
+
+    @classmethod
+    def from_bytes(cls, data:Union[bytes, bytearray, memoryview]) -> 'NLIP_Message':
+        """This function decodes and validates a message in the compact binary encoding.
+        Binary content is decoded as bytes, so to_json of the decoded message is the same 
+        as to_json of the encoded message.
+
+        Args:
+            data (bytes): The binary encoding of the message
+        
+        Returns:
+            NLIP_Message: The decoded message
+
+        Raises:
+            MalformedMessageError: If the data is not a valid message
+        """
+        fields = decode_message(data)
+        try:
+            return cls.model_validate(fields)
+        except ValueError as e:
+            raise MalformedMessageError(f"invalid message fields ({e})") from e
+
+    @classmethod
+    def dump_many(cls, messages:list, ndjson:bool=False) -> str:
+        """This function encodes a list of messages in one pass. 
+
+        Args:
+            messages (list[NLIP_Message]): The messages to be encoded
+            ndjson (bool): If True, the messages are encoded as newline delimited JSON 
+                (one message per line, each line ending with a newline) instead of a JSON array
+        
+        Returns:
+            str: The JSON array, or the newline delimited JSON, of the messages
+        """
+        if ndjson:
+            return b''.join([encode_model(msg) + b'\n' for msg in messages]).decode('utf-8')
+        return _message_list_adapter.dump_json(messages, exclude_none=True).decode('utf-8')
+
+    @classmethod
+    def load_many(cls, data:Union[str, bytes], ndjson:bool=False) -> list:
+        """This function decodes and validates a list of messages in one pass. 
+
+        Args:
+            data (str or bytes): A JSON array of messages, or newline delimited JSON if ndjson is True
+            ndjson (bool): If True, data holds one message per line. Blank lines are ignored. 
+        
+        Returns:
+            list[NLIP_Message]: The decoded messages
+        """
+        if ndjson:
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            lines = [line for line in data.splitlines() if line.strip()]
+            data = b'[' + b','.join(lines) + b']'
+        return get_backend().validate_json(_message_list_adapter.validator, data)
+
     def add_text(self, content:str, language:str='english', label=None):
         submsg = NLIP_SubMessage(format=AllowedFormats.text, subformat=language, content=content, label=label)
         self.add_submessage(submsg)
@@ -306,13 +998,13 @@ class NLIP_Message(BaseModel):
         if ReservedTokens.is_auth(token_type):
             return self.add_authentication_token(token,label)
         if ReservedTokens.is_conv(token_type):
-            return self.add_conversation_token(token,label)
+            return self.add_conversation_token(token,label=label)
         
         submsg = NLIP_SubMessage(format=AllowedFormats.token,
                             subformat=token_type, 
                             content=token,
                             label=label)
-        return self.add_submessage(self,submsg)
+        return self.add_submessage(submsg)
     
     def add_json(self, json_dict:dict, label:str=None):
         submsg = NLIP_SubMessage(format=AllowedFormats.structured,
@@ -328,7 +1020,7 @@ class NLIP_Message(BaseModel):
                             label=label)
         return self.add_submessage(submsg)
     
-    def add_binary(self, content:bytearray,binary_type:str, encoding:str, label:str=None):
+    def add_binary(self, content:Union[BinaryContent, str],binary_type:str, encoding:str, label:str=None):
         submsg = NLIP_SubMessage(format=AllowedFormats.binary,
                             subformat = f"{binary_type}/{encoding}",
                             content=content, 
@@ -336,13 +1028,26 @@ class NLIP_Message(BaseModel):
         return self.add_submessage(submsg)
         
     
-    def add_image(self, content:bytearray, encoding:str, label:str=None):
+    def add_binary_file(self, filename:str, binary_type:str, encoding:str, label:str=None):
+        """This function adds a submessage with the content of a binary file, mapped in memory 
+        instead of read. It is base64 encoded a chunk at a time by iter_json and write_json, 
+        so that large files, e.g. videos, are sent without holding them in memory. 
+
+        Args:
+            filename (str): The path of the file
+            binary_type (str): The type of the content, e.g. image, audio or video
+            encoding (str): The encoding of the content, e.g. mp4
+            label (str): The label of the submessage
+        """
+        return self.add_binary(map_binary_file(filename), binary_type, encoding, label)
+
+    def add_image(self, content:Union[BinaryContent, str], encoding:str, label:str=None):
           return self.add_binary(content, "image",encoding,label)
     
-    def add_audio(self, content:bytearray, encoding:str, label:str=None):
+    def add_audio(self, content:Union[BinaryContent, str], encoding:str, label:str=None):
         return self.add_binary(content, "audio",encoding,label)
     
-    def add_video(self, content:bytearray, encoding:str, label:str=None):
+    def add_video(self, content:Union[BinaryContent, str], encoding:str, label:str=None):
            return self.add_binary(content, "video",encoding,label)
 
     def add_location_text(self, location:str, label:str=None):
@@ -366,7 +1071,7 @@ class NLIP_Message(BaseModel):
                             label=label)
         return self.add_submessage(submsg)
     
-    def add_error_code(self, error_descr:str, label:str=None):
+    def add_error_text(self, error_descr:str, label:str=None):
         submsg = NLIP_SubMessage(format=AllowedFormats.error,
                             subformat = "text",
                             content=error_descr, 
@@ -381,6 +1086,9 @@ class NLIP_Message(BaseModel):
         return self.add_submessage(submsg)
 
 
+_message_list_adapter = TypeAdapter(list[NLIP_Message])
+
+
 # Below provide convenience routines to create a basic NLIP_Message
 # The convenience routines allow creation of NLIP_Messages in various ways
 
@@ -426,7 +1134,7 @@ class NLIP_Factory:
                             label=label)
     
     @classmethod 
-    def create_binary(cls, content:bytearray,binary_type:str, encoding:str, messagetype:str=None, label:str=None)->NLIP_Message:
+    def create_binary(cls, content:Union[BinaryContent, str],binary_type:str, encoding:str, messagetype:str=None, label:str=None)->NLIP_Message:
         return NLIP_Message(messagetype=messagetype,
                             format=AllowedFormats.binary,
                             subformat = f"{binary_type}/{encoding}",
@@ -434,15 +1142,15 @@ class NLIP_Factory:
                             label=label)
     
     @classmethod 
-    def create_image(cls, content:bytearray, encoding:str, messagetype:str=None, label:str=None)->NLIP_Message:
+    def create_image(cls, content:Union[BinaryContent, str], encoding:str, messagetype:str=None, label:str=None)->NLIP_Message:
           return cls.create_binary(content, "image",encoding,messagetype,label)
     
     @classmethod 
-    def create_audio(cls, content:bytearray, encoding:str, messagetype:str=None, label:str=None)->NLIP_Message:
+    def create_audio(cls, content:Union[BinaryContent, str], encoding:str, messagetype:str=None, label:str=None)->NLIP_Message:
         return cls.create_binary(content, "audio",encoding,messagetype,label)
     
     @classmethod 
-    def create_video(cls, content:bytearray, encoding:str, messagetype:str=None, label:str=None)->NLIP_Message:
+    def create_video(cls, content:Union[BinaryContent, str], encoding:str, messagetype:str=None, label:str=None)->NLIP_Message:
            return cls.create_binary(content, "video",encoding,messagetype,label)
 
     @classmethod 
@@ -467,7 +1175,7 @@ class NLIP_Factory:
                             content=error_code, 
                             label=label)
     @classmethod 
-    def create_error_code(cls, error_descr:str, messagetype:str=None, label:str=None)->NLIP_Message:
+    def create_error_text(cls, error_descr:str, messagetype:str=None, label:str=None)->NLIP_Message:
            return NLIP_Message(messagetype=messagetype,
                             format=AllowedFormats.error,
                             subformat = "text",
@@ -0,0 +1,170 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file contains a router dispatching NLIP Messages to handlers by messagetype, format, subformat and label.
+
+Handlers are registered against patterns. Each part of a pattern is either None, which
+matches any value, a value compared without case, or a value ending with '*', which
+matches any value starting with it without case (e.g. 'authorization*', as in
+ReservedTokens.is_auth). When several patterns match a message, the most specific wins:
+the one with the most exact parts, then the longest prefixes, then the first registered.
+
+Patterns are compiled into a dispatch table keyed by the lower-cased
+(messagetype, format, subformat, label) of messages. Exact patterns are entered in the
+table when registered; the handler for any other key is resolved once, by going through
+the patterns, and then entered in the table, so that routing a message is a single
+dictionary lookup.
+
+"""
+
+import inspect
+
+from nlip_sdk.errors import NoRouteError
+from nlip_sdk.nlip import NLIP_Message, normalize
+
+# The number of resolved keys kept in the dispatch table, beyond the exact patterns
+MAX_RESOLVED_KEYS = 4096
+
+
+class _Route:
+    """ A compiled pattern: for each field, None, (True, value) to match exactly or (False, prefix) """
+    __slots__ = ('parts', 'handler', 'rank')
+
+    def __init__(self, pattern: tuple, handler, order: int):
+        parts = list()
+        exact = prefix_length = 0
+        for value in pattern:
+            if value is None:
+                parts.append(None)
+            elif value.endswith('*'):
+                parts.append((False, value[:-1].lower()))
+                prefix_length += len(value) - 1
+            else:
+                parts.append((True, normalize(value)))
+                exact += 1
+        self.parts = tuple(parts)
+        self.handler = handler
+        # Sorting by rank puts the most specific routes first
+        self.rank = (-exact, -prefix_length, order)
+
+    def is_exact(self) -> bool:
+        return all(part is not None and part[0] for part in self.parts)
+
+    def matches(self, key: tuple) -> bool:
+        for part, value in zip(self.parts, key):
+            if part is None:
+                continue
+            if value is None:
+                return False
+            if part[0]:
+                if value != part[1]:
+                    return False
+            elif not value.startswith(part[1]):
+                return False
+        return True
+
+
+class Router:
+    """
+    A table of handlers of NLIP messages. The router is itself a handler, so it can be
+    given to NLIPServer: calling it with a message calls the handler of the message.
+
+    Constructor Arguments:
+        default (Callable): The handler of the messages that match no pattern, None to raise NoRouteError
+    """
+    def __init__(self, default=None):
+        self.default = default
+        self._routes = list()
+        self._exact = dict()
+        self._table = dict()
+
+    def add(self, handler, messagetype:str=None, format:str=None, subformat:str=None, label:str=None):
+        """This function registers a handler for the messages matching a pattern.
+
+        Args:
+            handler (Callable): The handler, called with the message
+            messagetype (str): The messagetype to match, None for any, or a prefix ending with '*'
+            format (str): The format to match, None for any, or a prefix ending with '*'
+            subformat (str): The subformat to match, None for any, or a prefix ending with '*'
+            label (str): The label to match, None for any, or a prefix ending with '*'
+        """
+        route = _Route((messagetype, format, subformat, label), handler, len(self._routes))
+        self._routes.append(route)
+        self._routes.sort(key=lambda route: route.rank)
+        if route.is_exact():
+            self._exact.setdefault(tuple(part[1] for part in route.parts), handler)
+        # Resolved keys may now have a more specific route
+        self._table = dict(self._exact)
+
+    def route(self, messagetype:str=None, format:str=None, subformat:str=None, label:str=None):
+        """ A decorator registering the decorated function as a handler, see add """
+        def register(handler):
+            self.add(handler, messagetype, format, subformat, label)
+            return handler
+        return register
+
+    @staticmethod
+    def key(msg: NLIP_Message) -> tuple:
+        """Returns the key of a message in the dispatch table"""
+        return (normalize(msg.messagetype), normalize(msg.format), normalize(msg.subformat), normalize(msg.label))
+
+    def _resolve(self, key: tuple):
+        for route in self._routes:
+            if route.matches(key):
+                handler = route.handler
+                break
+        else:
+            handler = None
+        if len(self._table) - len(self._exact) >= MAX_RESOLVED_KEYS:
+            self._table = dict(self._exact)
+        self._table[key] = handler
+        return handler
+
+    def resolve(self, msg: NLIP_Message):
+        """This function selects the handler of a message.
+
+        Args:
+            msg (NLIP_Message): The message
+
+        Returns:
+            Callable: The handler of the most specific matching pattern, or the default handler
+        """
+        key = self.key(msg)
+        try:
+            handler = self._table[key]
+        except KeyError:
+            handler = self._resolve(key)
+        if handler is None:
+            if self.default is None:
+                raise NoRouteError(key)
+            return self.default
+        return handler
+
+    def dispatch(self, msg: NLIP_Message):
+        """Calls the handler of a message and returns its result, which is awaitable for coroutine handlers"""
+        return self.resolve(msg)(msg)
+
+    __call__ = dispatch
+
+    async def adispatch(self, msg: NLIP_Message):
+        """Calls the handler of a message, awaiting its result if needed"""
+        result = self.resolve(msg)(msg)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
@@ -0,0 +1,318 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file contains an asyncio server that receives NLIP Messages and dispatches them to handlers.
+
+Each connection is read by its own task, which may read several pipelined requests
+ahead of the replies. Requests are queued for a bounded pool of workers that call the
+handler, and the replies are written back in the order of the requests.
+
+Load is controlled at three levels:
+    - a connection reads at most max_pipeline requests ahead of its replies; beyond
+      that it stops reading, so that TCP flow control slows the peer down,
+    - at most queue_size data messages wait for a worker; beyond that new data
+      messages are refused at once with 503 Service Unavailable and Retry-After,
+    - control messages (is_control_msg) are taken by the workers ahead of any waiting
+      data message, and have a queue of their own of control_queue_size messages, so
+      that they are still accepted when data messages are refused. Beyond that they are
+      refused as well, so that marking messages as control does not escape load shedding.
+
+"""
+
+import asyncio
+import inspect
+from collections import deque
+
+from nlip_sdk.errors import MalformedMessageError
+from nlip_sdk.nlip import NLIP_Factory, NLIP_Message
+from nlip_sdk.streaming import NLIP_StreamParser
+from nlip_sdk.transport import JSON_CONTENT_TYPE, format_head, iter_body, read_head
+
+
+_REASONS = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 413: 'Content Too Large',
+            500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class _Job:
+    """ A request waiting for a worker, and the future receiving its reply """
+    __slots__ = ('msg', 'handler', 'reply')
+
+    def __init__(self, msg: NLIP_Message, handler, reply: asyncio.Future):
+        self.msg = msg
+        self.handler = handler
+        self.reply = reply
+
+
+class NLIPServer:
+    """
+    An asyncio server receiving NLIP messages over HTTP/1.1 and replying with the result of a handler.
+    The handler is called with the received NLIP_Message, may be a function or a coroutine
+    function, and returns the reply NLIP_Message, or None to reply without a body.
+
+    Constructor Arguments:
+        handler (Callable): The handler of the messages
+        control_handler (Callable): The handler of the control messages, handler if None
+        path (str): The path at which messages are accepted, every path if None
+        workers (int): The number of messages handled at once
+        queue_size (int): The largest number of data messages waiting for a worker
+        control_queue_size (int): The largest number of control messages waiting for a worker
+        max_pipeline (int): The largest number of requests of a connection waiting for their reply
+        max_body_size (int): The largest accepted request body in bytes
+        handler_timeout (float): The time in seconds allowed to a handler, None for no limit
+        retry_after (int): The delay in seconds suggested to peers whose message was refused
+    """
+    def __init__(self, handler, control_handler=None, path:str='/nlip/', workers:int=64,
+                 queue_size:int=1024, max_pipeline:int=16, max_body_size:int=16 * 1024 * 1024,
+                 handler_timeout:float=None, retry_after:int=1, control_queue_size:int=64):
+        self.handler = handler
+        self.control_handler = control_handler or handler
+        self.path = path
+        self.workers = workers
+        self.queue_size = queue_size
+        self.control_queue_size = control_queue_size
+        self.max_pipeline = max_pipeline
+        self.max_body_size = max_body_size
+        self.handler_timeout = handler_timeout
+        self.retry_after = retry_after
+        self._control_jobs = deque()
+        self._data_jobs = deque()
+        self._pending = None
+        self._worker_tasks = list()
+        self._connections = set()
+        self._server = None
+
+    @property
+    def queued(self) -> int:
+        """ The number of messages waiting for a worker """
+        return len(self._control_jobs) + len(self._data_jobs)
+
+    async def start(self, host:str='127.0.0.1', port:int=8010, **kwargs) -> asyncio.AbstractServer:
+        """This function starts the workers and listens for connections.
+
+        Args:
+            host (str): The address to listen on
+            port (int): The port to listen on, 0 to pick a free port
+            kwargs: Additional arguments of asyncio.start_server, e.g. ssl
+
+        Returns:
+            asyncio.Server: The listening server
+        """
+        self._pending = asyncio.Semaphore(0)
+        self._worker_tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._server = await asyncio.start_server(self._serve_connection, host, port, **kwargs)
+        return self._server
+
+    async def serve_forever(self, host:str='127.0.0.1', port:int=8010, **kwargs):
+        """Starts the server and serves until cancelled"""
+        server = await self.start(host, port, **kwargs)
+        try:
+            await server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        """Stops listening, closes the connections and stops the workers"""
+        if self._server is not None:
+            self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._connections, *self._worker_tasks, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+            self._server = None
+        self._worker_tasks = list()
+        for job in (*self._control_jobs, *self._data_jobs):
+            job.reply.cancel()
+        self._control_jobs.clear()
+        self._data_jobs.clear()
+
+    async def __aenter__(self) -> 'NLIPServer':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def submit(self, msg: NLIP_Message) -> asyncio.Future:
+        """This function queues a message for the workers.
+
+        Args:
+            msg (NLIP_Message): The message
+
+        Returns:
+            asyncio.Future: The future receiving the reply, or None if the message was refused
+                because too many messages of its kind are waiting
+        """
+        if msg.is_control_msg():
+            jobs, limit, handler = self._control_jobs, self.control_queue_size, self.control_handler
+        else:
+            jobs, limit, handler = self._data_jobs, self.queue_size, self.handler
+        if len(jobs) >= limit:
+            return None
+        reply = asyncio.get_running_loop().create_future()
+        jobs.append(_Job(msg, handler, reply))
+        self._pending.release()
+        return reply
+
+    async def _work(self):
+        while True:
+            await self._pending.acquire()
+            job = self._control_jobs.popleft() if self._control_jobs else self._data_jobs.popleft()
+            if job.reply.cancelled():
+                continue
+            try:
+                result = job.handler(job.msg)
+                if inspect.isawaitable(result):
+                    if self.handler_timeout is None:
+                        result = await result
+                    else:
+                        result = await asyncio.wait_for(result, self.handler_timeout)
+            except asyncio.CancelledError:
+                job.reply.cancel()
+                raise
+            except Exception as e:
+                if not job.reply.done():
+                    job.reply.set_exception(e)
+                continue
+            if not job.reply.done():
+                job.reply.set_result(result)
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        replies = asyncio.Queue(self.max_pipeline)
+        sender = asyncio.create_task(self._send_replies(replies, writer))
+        try:
+            while True:
+                reply, keep_alive = await self._read_request(reader)
+                if reply is None:
+                    break
+                # Blocks once max_pipeline replies are waiting, which stops reading the connection
+                if not await self._enqueue(replies, (reply, keep_alive), sender):
+                    if isinstance(reply, asyncio.Future):
+                        reply.cancel()
+                    break
+                if not keep_alive:
+                    break
+            await self._enqueue(replies, None, sender)
+            await sender
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            sender.cancel()
+            while not replies.empty():
+                item = replies.get_nowait()
+                if item is not None and isinstance(item[0], asyncio.Future):
+                    item[0].cancel()
+            self._connections.discard(task)
+            writer.close()
+
+    async def _enqueue(self, replies: asyncio.Queue, item, sender: asyncio.Task) -> bool:
+        """Puts an item in the queue of replies, waiting while the queue is full.
+        Returns False, without queuing the item, if the sender stopped first, e.g.
+        because the peer reset the connection."""
+        if not replies.full():
+            replies.put_nowait(item)
+            return True
+        put = asyncio.ensure_future(replies.put(item))
+        try:
+            await asyncio.wait((put, sender), return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            put.cancel()
+            raise
+        if put.done():
+            return True
+        put.cancel()
+        return False
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> tuple:
+        """Reads the next request and returns its reply, and whether the connection stays open after it.
+        The reply is a (status, NLIP_Message) tuple, or the future receiving the reply of the handler.
+        It is None when the connection was closed."""
+        try:
+            head = await read_head(reader)
+        except MalformedMessageError as e:
+            # The end of an invalid head can not be found, so the connection is closed after the reply
+            return (400, NLIP_Factory.create_error_text(str(e))), False
+        if head is None:
+            return None, False
+        keep_alive = head.keep_alive()
+        if self.path is not None and head.first_line[1].split('?', 1)[0] != self.path:
+            refused = (404, NLIP_Factory.create_error_text(f"no NLIP endpoint at {head.first_line[1]}"))
+        elif head.first_line[0] != 'POST':
+            refused = (405, NLIP_Factory.create_error_text("NLIP messages must be sent with POST"))
+        else:
+            refused = None
+        if refused is not None:
+            try:
+                await self._skip_body(reader, head)
+            except MalformedMessageError as e:
+                # The end of the body can not be found, so the connection is closed after the reply
+                return (400, NLIP_Factory.create_error_text(str(e))), False
+            return refused, keep_alive
+        parser = NLIP_StreamParser()
+        received = 0
+        try:
+            async for piece in iter_body(reader, head):
+                received += len(piece)
+                if received > self.max_body_size:
+                    # The rest of the body can not be told from the next request
+                    reason = f"the message is larger than {self.max_body_size} bytes"
+                    return (413, NLIP_Factory.create_error_text(reason)), False
+                parser.feed(piece)
+            msg = parser.close()
+        except (MalformedMessageError, ValueError) as e:
+            # ValueError covers a JSON or validation error a parser would let through
+            return (400, NLIP_Factory.create_error_text(str(e))), False
+        reply = self.submit(msg)
+        if reply is None:
+            return (503, NLIP_Factory.create_error_text("the server is overloaded")), keep_alive
+        return reply, keep_alive
+
+    async def _skip_body(self, reader: asyncio.StreamReader, head):
+        async for _ in iter_body(reader, head):
+            pass
+
+    async def _send_replies(self, replies: asyncio.Queue, writer: asyncio.StreamWriter):
+        while (item := await replies.get()) is not None:
+            reply, keep_alive = item
+            if isinstance(reply, asyncio.Future):
+                try:
+                    result = await reply
+                    reply = (200, result) if result is not None else (204, None)
+                except asyncio.TimeoutError:
+                    reply = (503, NLIP_Factory.create_error_text("the handler timed out"))
+                except Exception as e:
+                    reply = (500, NLIP_Factory.create_error_text(f"the handler failed: {e}"))
+            status, msg = reply
+            headers = dict()
+            if status == 503:
+                headers['Retry-After'] = str(self.retry_after)
+            if not keep_alive:
+                headers['Connection'] = 'close'
+            if msg is None:
+                writer.write(format_head(f"HTTP/1.1 {status} {_REASONS[status]}", headers))
+            else:
+                body = msg.to_json().encode('utf-8')
+                headers['Content-Type'] = JSON_CONTENT_TYPE
+                headers['Content-Length'] = str(len(body))
+                writer.write(format_head(f"HTTP/1.1 {status} {_REASONS[status]}", headers) + body)
+            await writer.drain()
@@ -0,0 +1,379 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file contains an incremental parser for the JSON encoding of a NLIP Message.
+
+The parser consumes the encoding in chunks as they arrive (e.g. from an HTTP body)
+and reports each top-level field and each submessage as soon as it is complete,
+so that a message can be routed on its messagetype or conversation token before
+the large submessages have been received.
+
+"""
+
+import re
+from inspect import isawaitable
+from typing import AsyncIterable, Callable, Iterable, Union
+
+from nlip_sdk.errors import MalformedMessageError
+from nlip_sdk.json_backend import get_backend
+from nlip_sdk.nlip import NLIP_Message, NLIP_SubMessage
+
+
+_WHITESPACE = b' \t\r\n'
+_STRING_SPECIAL = re.compile(rb'["\\]')
+_STRUCTURE_SPECIAL = re.compile(rb'["{}\[\]]')
+_SCALAR_END = re.compile(rb'[,}\]\s]')
+
+# Events reported by NLIP_StreamParser.feed
+FIELD_EVENT = 'field'
+SUBMESSAGE_EVENT = 'submessage'
+
+# States of NLIP_StreamParser
+_START, _KEY, _COLON, _VALUE, _ARRAY, _ELEMENT, _ELEMENT_END, _NEXT, _DONE = range(9)
+
+
+def _validate(model: type, fields: dict):
+    """Validates the decoded fields of a message, raising MalformedMessageError if they are not valid"""
+    try:
+        return model.model_validate(fields)
+    except ValueError as e:
+        raise MalformedMessageError(f"invalid {model.__name__} ({e})") from e
+
+
+class _ValueScanner:
+    """
+    Finds the end of a JSON value in a growing buffer. The scan resumes where it
+    stopped when more data arrives, so that every byte of a value is examined once.
+    """
+    __slots__ = ('start', 'pos', 'depth', 'in_string', 'escape', 'scalar')
+
+    def __init__(self, start: int):
+        self.start = start
+        self.pos = start
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.scalar = None
+
+    def shift(self, offset: int):
+        self.start -= offset
+        self.pos -= offset
+
+    def scan(self, buffer: bytearray) -> int:
+        """Returns the position just past the end of the value, or None if more data is needed"""
+        i = self.pos
+        if self.scalar is None:
+            first = buffer[i]
+            self.scalar = first not in b'{["'
+            if first == ord('"'):
+                self.in_string = True
+            elif not self.scalar:
+                self.depth = 1
+            i += 1
+        if self.scalar:
+            match = _SCALAR_END.search(buffer, i)
+            if match is None:
+                self.pos = len(buffer)
+                return None
+            return match.start()
+        while True:
+            if self.in_string:
+                if self.escape:
+                    if i >= len(buffer):
+                        break
+                    self.escape = False
+                    i += 1
+                match = _STRING_SPECIAL.search(buffer, i)
+                if match is None:
+                    i = len(buffer)
+                    break
+                i = match.end()
+                if buffer[match.start()] == ord('\\'):
+                    self.escape = True
+                    continue
+                self.in_string = False
+                if self.depth == 0:
+                    return i
+            else:
+                match = _STRUCTURE_SPECIAL.search(buffer, i)
+                if match is None:
+                    i = len(buffer)
+                    break
+                i = match.end()
+                special = buffer[match.start()]
+                if special == ord('"'):
+                    self.in_string = True
+                elif special in b'{[':
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        return i
+        self.pos = i
+        return None
+
+
+class NLIP_StreamParser:
+    """
+    Incremental parser that builds a NLIP_Message from chunks of its JSON encoding.
+
+    Each call to feed returns the events completed by that chunk:
+    (FIELD_EVENT, name, value) for a top-level field and
+    (SUBMESSAGE_EVENT, position, NLIP_SubMessage) for a submessage.
+    The fields and submessages received so far are available at any time
+    in the fields and submessages attributes. An encoding that is not valid JSON,
+    or not a valid NLIP message, raises MalformedMessageError from feed or close.
+
+    Constructor Arguments:
+        on_field (Callable): Optional callback called with (name, value) for each top-level field
+        on_submessage (Callable): Optional callback called with (position, submessage) for each submessage
+    """
+    def __init__(self, on_field:Callable=None, on_submessage:Callable=None):
+        self.on_field = on_field
+        self.on_submessage = on_submessage
+        self.fields = dict()
+        self.submessages = list()
+        self._buffer = bytearray()
+        self._pos = 0
+        self._state = _START
+        self._key = None
+        self._scanner = None
+        self._has_submessages = False
+        self._backend = get_backend()
+
+    def is_complete(self) -> bool:
+        """ Checks if the whole message has been parsed """
+        return self._state == _DONE
+
+    def feed(self, chunk: Union[bytes, bytearray, memoryview, str]) -> list:
+        """This function parses the next chunk of the encoding.
+
+        Args:
+            chunk (bytes): The next chunk of the UTF-8 encoded JSON
+
+        Returns:
+            list: The events completed by this chunk, in order
+        """
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        self._buffer += chunk
+        events = list()
+        self._parse(events)
+        if self._pos > 0:
+            del self._buffer[:self._pos]
+            if self._scanner is not None:
+                self._scanner.shift(self._pos)
+            self._pos = 0
+        return events
+
+    def close(self) -> NLIP_Message:
+        """This function ends the parse and builds the message.
+
+        Returns:
+            NLIP_Message: The parsed message
+        """
+        if self._state != _DONE:
+            raise MalformedMessageError("the encoding ended before the message was complete")
+        fields = self.fields
+        if self._has_submessages:
+            fields = dict(fields, submessages=self.submessages)
+        return _validate(NLIP_Message, fields)
+
+    def _loads(self, encoded: bytes):
+        try:
+            return self._backend.loads(encoded)
+        except ValueError as e:
+            raise MalformedMessageError(f"invalid JSON value {encoded[:40].decode(errors='replace')} ({e})") from e
+
+    def _skip_whitespace(self) -> bool:
+        buffer = self._buffer
+        pos = self._pos
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        self._pos = pos
+        return pos < len(buffer)
+
+    def _expect(self, expected: bytes):
+        found = bytes(self._buffer[self._pos:self._pos+1])
+        if found not in expected:
+            raise MalformedMessageError(f"expected one of {expected.decode()} but found {found.decode(errors='replace')}")
+        self._pos += 1
+        return found
+
+    def _scan_value(self):
+        if self._scanner is None:
+            self._scanner = _ValueScanner(self._pos)
+        end = self._scanner.scan(self._buffer)
+        if end is None:
+            return None
+        start = self._scanner.start
+        self._scanner = None
+        self._pos = end
+        return bytes(self._buffer[start:end])
+
+    def _parse(self, events: list):
+        while self._skip_whitespace():
+            state = self._state
+            if state == _START:
+                self._expect(b'{')
+                self._state = _KEY
+            elif state == _KEY:
+                if self._buffer[self._pos] == ord('}') and len(self.fields) == 0:
+                    self._pos += 1
+                    self._state = _DONE
+                    continue
+                encoded = self._scan_value()
+                if encoded is None:
+                    return
+                if not encoded.startswith(b'"'):
+                    raise MalformedMessageError(f"expected a field name but found {encoded.decode(errors='replace')}")
+                self._key = self._loads(encoded)
+                self._state = _COLON
+            elif state == _COLON:
+                self._expect(b':')
+                self._state = _ARRAY if self._key == 'submessages' else _VALUE
+            elif state == _VALUE:
+                encoded = self._scan_value()
+                if encoded is None:
+                    return
+                self._add_field(self._key, self._loads(encoded), events)
+                self._state = _NEXT
+            elif state == _ARRAY:
+                if self._buffer[self._pos] == ord('['):
+                    self._pos += 1
+                    self._has_submessages = True
+                    self._state = _ELEMENT
+                else:
+                    self._state = _VALUE
+            elif state == _ELEMENT:
+                if self._buffer[self._pos] == ord(']'):
+                    self._pos += 1
+                    self._state = _NEXT
+                    continue
+                encoded = self._scan_value()
+                if encoded is None:
+                    return
+                self._add_element(encoded, events)
+                self._state = _ELEMENT_END
+            elif state == _ELEMENT_END:
+                if self._expect(b',]') == b',':
+                    self._state = _ELEMENT
+                else:
+                    self._state = _NEXT
+            elif state == _NEXT:
+                if self._expect(b',}') == b',':
+                    self._state = _KEY
+                else:
+                    self._state = _DONE
+            else:
+                raise MalformedMessageError("unexpected data after the end of the message")
+
+    def _add_field(self, name: str, value, events: list):
+        self.fields[name] = value
+        events.append((FIELD_EVENT, name, value))
+        if self.on_field is not None:
+            self.on_field(name, value)
+
+    def _add_element(self, encoded: bytes, events: list):
+        """Handles the JSON encoding of the next element of the submessages array"""
+        try:
+            submsg = self._backend.validate_json(NLIP_SubMessage.__pydantic_validator__, encoded)
+        except ValueError as e:
+            raise MalformedMessageError(f"invalid submessage {len(self.submessages)} ({e})") from e
+        self._add_submessage(submsg, events)
+
+    def _add_submessage(self, submsg: NLIP_SubMessage, events: list):
+        position = len(self.submessages)
+        self.submessages.append(submsg)
+        events.append((SUBMESSAGE_EVENT, position, submsg))
+        if self.on_submessage is not None:
+            self.on_submessage(position, submsg)
+
+
+def iter_events(chunks: Iterable[bytes]):
+    """This function parses a message from an iterable of chunks and yields the events
+    as they are completed (see NLIP_StreamParser).
+
+    Args:
+        chunks (Iterable): The chunks of the UTF-8 encoded JSON
+
+    Yields:
+        tuple: The (FIELD_EVENT, name, value) and (SUBMESSAGE_EVENT, position, submessage) events
+    """
+    parser = NLIP_StreamParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    parser.close()
+
+
+async def aiter_events(chunks: AsyncIterable[bytes]):
+    """This function is the asynchronous version of iter_events.
+
+    Args:
+        chunks (AsyncIterable): The chunks of the UTF-8 encoded JSON
+
+    Yields:
+        tuple: The (FIELD_EVENT, name, value) and (SUBMESSAGE_EVENT, position, submessage) events
+    """
+    parser = NLIP_StreamParser()
+    async for chunk in chunks:
+        for event in parser.feed(chunk):
+            yield event
+    parser.close()
+
+
+def parse_stream(chunks: Iterable[bytes], on_field:Callable=None, on_submessage:Callable=None) -> NLIP_Message:
+    """This function builds a NLIP_Message from an iterable of chunks of its JSON encoding.
+    The callbacks are called as soon as each field or submessage is complete.
+
+    Args:
+        chunks (Iterable): The chunks of the UTF-8 encoded JSON
+        on_field (Callable): Optional callback called with (name, value) for each top-level field
+        on_submessage (Callable): Optional callback called with (position, submessage) for each submessage
+
+    Returns:
+        NLIP_Message: The parsed message
+    """
+    parser = NLIP_StreamParser(on_field, on_submessage)
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
+
+
+async def aparse_stream(chunks: AsyncIterable[bytes], on_field:Callable=None, on_submessage:Callable=None) -> NLIP_Message:
+    """This function is the asynchronous version of parse_stream.
+    The callbacks may be coroutine functions, in which case they are awaited in order.
+
+    Args:
+        chunks (AsyncIterable): The chunks of the UTF-8 encoded JSON
+        on_field (Callable): Optional callback called with (name, value) for each top-level field
+        on_submessage (Callable): Optional callback called with (position, submessage) for each submessage
+
+    Returns:
+        NLIP_Message: The parsed message
+    """
+    parser = NLIP_StreamParser()
+    async for chunk in chunks:
+        for kind, key, value in parser.feed(chunk):
+            callback = on_field if kind == FIELD_EVENT else on_submessage
+            if callback is not None:
+                result = callback(key, value)
+                if isawaitable(result):
+                    await result
+    return parser.close()
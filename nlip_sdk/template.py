@@ -0,0 +1,107 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file contains immutable templates of NLIP Messages.
+
+Replies often carry the same submessages - authentication and conversation tokens,
+a system prompt - and differ in one text part. A NLIP_Template holds those submessages
+once; each message derived from it with message() shares them instead of building and
+validating them again, and gets its own list of submessages, so that adding to it leaves
+the template and the other messages unchanged.
+
+The shared submessages are frozen, and so is their content: a dict content is copied
+into dictionaries and lists that raise TypeError when changed in place, and binary content
+that could be changed in place is copied to bytes. To change one in a derived message,
+get a copy of its own with NLIP_Message.writable_submessage (copy on write). Their JSON
+encoding is computed once and reused by NLIP_Message.to_json of every derived message.
+
+Templates are never changed: add_submessage and update_content return a new template
+that shares the unchanged submessages with the original.
+
+"""
+
+from typing import Union
+
+from nlip_sdk.nlip import BinaryContent, NLIP_Message, NLIP_SubMessage, _SharedSubMessage, nlip_compare_string
+
+_TOP_FIELDS = ('messagetype', 'format', 'subformat', 'content', 'label')
+
+
+class NLIP_Template:
+    """
+    An immutable message from which messages sharing its submessages are derived.
+
+    Constructor Arguments:
+        msg (NLIP_Message): The message giving the fields and submessages of the template.
+            It is left unchanged, its submessages are not validated again.
+    """
+    __slots__ = ('_fields', '_submessages')
+
+    def __init__(self, msg: NLIP_Message):
+        self._fields = {name: getattr(msg, name) for name in _TOP_FIELDS}
+        self._submessages = tuple(_SharedSubMessage.share(submsg) for submsg in msg.submessages or ())
+
+    @classmethod
+    def _derive(cls, fields: dict, submessages: tuple) -> 'NLIP_Template':
+        template = cls.__new__(cls)
+        template._fields = fields
+        template._submessages = submessages
+        return template
+
+    @property
+    def submessages(self) -> tuple:
+        """ The shared submessages """
+        return self._submessages
+
+    def message(self, **fields) -> NLIP_Message:
+        """This function derives a message from the template. The top-level fields given
+        replace those of the template and are validated; the submessages are shared.
+
+        Args:
+            fields: Values of messagetype, format, subformat, content or label
+
+        Returns:
+            NLIP_Message: A new message, with a list of submessages of its own
+        """
+        values = dict(self._fields)
+        values.update(fields)
+        if self._submessages:
+            values['submessages'] = list(self._submessages)
+        return NLIP_Message(**values)
+
+    def add_submessage(self, submsg: NLIP_SubMessage) -> 'NLIP_Template':
+        """Returns a template with the submessage added after those of this template"""
+        return self._derive(self._fields, self._submessages + (_SharedSubMessage.share(submsg),))
+
+    def update_content(self, label: str, content: Union[str, dict, BinaryContent]) -> 'NLIP_Template':
+        """This function replaces the content of the submessages with a label.
+
+        Args:
+            label (str): The label of the submessages to change, compared without case
+            content: The new content
+
+        Returns:
+            NLIP_Template: A template sharing the other submessages with this one
+        """
+        submessages = list(self._submessages)
+        for position, submsg in enumerate(submessages):
+            if submsg.label is not None and nlip_compare_string(submsg.label, label):
+                submessages[position] = _SharedSubMessage.share(NLIP_SubMessage(
+                    format=submsg.format, subformat=submsg.subformat, content=content, label=submsg.label))
+        return self._derive(self._fields, tuple(submessages))
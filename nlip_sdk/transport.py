@@ -0,0 +1,164 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file contains the HTTP/1.1 framing shared by the NLIP client and server.
+
+Only what is needed to exchange NLIP messages is implemented: a request or status
+line with headers, and a body delimited by Content-Length, chunked encoding or, for
+a response, the closing of the connection.
+Bodies are read in pieces, so that they can be fed to NLIP_StreamParser as they arrive.
+
+"""
+
+import asyncio
+
+from nlip_sdk.errors import MalformedMessageError
+
+
+# Size of the pieces in which bodies are read
+READ_SIZE = 64 * 1024
+
+# Largest accepted size of the request or status line and headers
+MAX_HEAD_SIZE = 64 * 1024
+
+JSON_CONTENT_TYPE = 'application/json'
+
+
+class HTTPHead:
+    """
+    The first line and the headers of an HTTP request or response.
+
+    Attributes:
+        first_line (list): The words of the request or status line
+        headers (dict): The headers, with lower-cased names
+    """
+    def __init__(self, first_line: list, headers: dict):
+        self.first_line = first_line
+        self.headers = headers
+
+    def keep_alive(self) -> bool:
+        """ Checks if the connection may be reused after this exchange """
+        connection = self.headers.get('connection', '').lower()
+        if self.first_line[0] == 'HTTP/1.0' or self.first_line[-1] == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def has_body(self) -> bool:
+        return 'content-length' in self.headers or 'transfer-encoding' in self.headers
+
+    def body_until_close(self) -> bool:
+        """ Checks if the body of this response is delimited by the closing of the connection """
+        if self.has_body():
+            return False
+        status = self.first_line[1]
+        return not (status.startswith('1') or status in ('204', '304'))
+
+
+async def read_head(reader: asyncio.StreamReader) -> HTTPHead:
+    """This function reads the first line and the headers of a request or response.
+
+    Args:
+        reader (StreamReader): The connection
+
+    Returns:
+        HTTPHead: The head, or None if the connection was closed before any byte was received
+    """
+    try:
+        data = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise
+    except asyncio.LimitOverrunError:
+        raise MalformedMessageError("the HTTP headers are too large")
+    lines = data[:-4].decode('latin-1').split('\r\n')
+    first_line = lines[0].split(' ', 2)
+    if len(first_line) < 2:
+        raise MalformedMessageError(f"invalid HTTP first line {lines[0]}")
+    headers = dict()
+    for line in lines[1:]:
+        name, separator, value = line.partition(':')
+        if not separator:
+            raise MalformedMessageError(f"invalid HTTP header {line}")
+        headers[name.strip().lower()] = value.strip()
+    return HTTPHead(first_line, headers)
+
+
+async def iter_body(reader: asyncio.StreamReader, head: HTTPHead, limit: int = None, until_close: bool = False):
+    """This function reads the body following a head, in pieces.
+
+    Args:
+        reader (StreamReader): The connection
+        head (HTTPHead): The head preceding the body
+        limit (int): The largest accepted body size, None for no limit
+        until_close (bool): If True, a body with neither Content-Length nor Transfer-Encoding 
+            is read until the connection is closed (see HTTPHead.body_until_close)
+
+    Yields:
+        bytes: The successive pieces of the body
+    """
+    received = 0
+    if 'chunked' in head.headers.get('transfer-encoding', '').lower():
+        while True:
+            size_line = await reader.readline()
+            try:
+                size = int(size_line.split(b';', 1)[0], 16)
+            except ValueError:
+                raise MalformedMessageError("invalid chunk size in HTTP body")
+            if size == 0:
+                # Skip any trailers up to the empty line ending the body
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return
+            received += size
+            if limit is not None and received > limit:
+                raise MalformedMessageError(f"the HTTP body is larger than {limit} bytes")
+            while size > 0:
+                piece = await reader.read(min(size, READ_SIZE))
+                if not piece:
+                    raise asyncio.IncompleteReadError(b'', size)
+                size -= len(piece)
+                yield piece
+            await reader.readexactly(2)
+        return
+    if until_close and 'content-length' not in head.headers:
+        while piece := await reader.read(READ_SIZE):
+            received += len(piece)
+            if limit is not None and received > limit:
+                raise MalformedMessageError(f"the HTTP body is larger than {limit} bytes")
+            yield piece
+        return
+    try:
+        remaining = int(head.headers.get('content-length', '0'))
+    except ValueError:
+        raise MalformedMessageError("invalid Content-Length")
+    if limit is not None and remaining > limit:
+        raise MalformedMessageError(f"the HTTP body is larger than {limit} bytes")
+    while remaining > 0:
+        piece = await reader.read(min(remaining, READ_SIZE))
+        if not piece:
+            raise asyncio.IncompleteReadError(b'', remaining)
+        remaining -= len(piece)
+        yield piece
+
+
+def format_head(first_line: str, headers: dict) -> bytes:
+    """Returns the encoding of a request or status line followed by headers"""
+    lines = [first_line] + [f"{name}: {value}" for name, value in headers.items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
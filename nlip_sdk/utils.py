@@ -26,10 +26,14 @@ across many other modules and solutions using NLIP.
 
 """
 
+import mmap
 import os
 from pathlib import Path
 from base64 import b64encode
+from binascii import b2a_base64
 
+# Default size in bytes of the chunks produced by the chunked file readers
+FILE_CHUNK_SIZE = 64 * 1024
 
 
 def get_resolved_path(file_path: str) -> str:
@@ -138,6 +142,61 @@ def read_binary_file(filename) -> str:
         file_content = file.read()
         return b64encode(file_content).decode("utf-8")
 
+def read_file_chunks(filename, chunk_size: int = FILE_CHUNK_SIZE):
+    """
+    Reads a file a chunk at a time, so that the whole file is never held in memory.
+
+    Args:
+        filename (str): The path of the file to be read.
+        chunk_size (int): The size in bytes of the chunks, the last one may be shorter.
+
+    Yields:
+        bytes: The successive chunks of the content of the file.
+    """
+    with open(filename, "rb") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def read_binary_file_chunks(filename, chunk_size: int = FILE_CHUNK_SIZE):
+    """
+    Reads a binary file a chunk at a time and base64 encodes each chunk. Each chunk 
+    encodes a multiple of 3 bytes, so the chunks concatenate to read_binary_file(filename).
+
+    Args:
+        filename (str): The path of the binary file to be read.
+        chunk_size (int): The approximate size in bytes of the encoded chunks.
+
+    Yields:
+        str: The successive pieces of the base64 encoded content of the file.
+    """
+    step = max(3, (chunk_size // 4) * 3)
+    for chunk in read_file_chunks(filename, step):
+        yield b2a_base64(chunk, newline=False).decode("ascii")
+
+def map_binary_file(filename) -> memoryview:
+    """
+    Maps a binary file in memory, read only. The content is read from the file by the 
+    operating system as it is accessed, and is not copied: passed as the content of a 
+    submessage, it is base64 encoded a chunk at a time by NLIP_Message.iter_json and 
+    write_json, so that large files can be sent without holding them in memory.
+    The file must not be truncated while the mapping is in use.
+
+    Args:
+        filename (str): The path of the binary file to be mapped.
+
+    Returns:
+        memoryview: A read only view of the content of the file.
+    """
+    with open(filename, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            # Empty files can not be mapped
+            return memoryview(b"")
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped)
+
 def read_text_file(filename):
     """
     Reads the contents of a text file and returns it as a string.
@@ -0,0 +1,290 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file defines a compact binary encoding of NLIP Messages based on MessagePack.
+
+Compared to JSON, binary content is carried as raw bytes instead of base64, field
+names are replaced by small integers and the common values of format, subformat and
+messagetype (those of AllowedFormats and ReservedTokens among others) are replaced by
+their position in a table of interned values. Decoding gives back the same fields, so
+converting to the binary encoding and back is lossless with respect to the JSON form.
+
+A message is encoded as a map from field numbers to values:
+    0 messagetype, 1 format, 2 subformat, 3 content, 4 label, 5 submessages
+Fields that are None are left out. Submessages are maps with the same numbering.
+
+The msgpack package is used when installed; otherwise the MessagePack subset needed
+here (nil, bool, int, float, str, bin, array, map) is encoded in python.
+
+"""
+
+from struct import error as StructError, pack, unpack_from
+
+from nlip_sdk.errors import MalformedMessageError
+
+
+FIELDS = ('messagetype', 'format', 'subformat', 'content', 'label', 'submessages')
+_FIELD_NUMBERS = {name: number for number, name in enumerate(FIELDS)}
+
+# Values of messagetype, format and subformat that are encoded as an integer.
+# New values may only ever be appended to this table.
+INTERNED_VALUES = ('text', 'token', 'structured', 'binary', 'location', 'error', 'generic',
+                   'authorization', 'conversation', 'control', 'english', 'JSON')
+_INTERNED_NUMBERS = {value: number for number, value in enumerate(INTERNED_VALUES)}
+_INTERNED_FIELDS = frozenset((0, 1, 2))
+
+
+def _pack_value(value, out: bytearray):
+    if value is None:
+        out.append(0xc0)
+    elif value is True:
+        out.append(0xc3)
+    elif value is False:
+        out.append(0xc2)
+    elif isinstance(value, int):
+        if value >= 0:
+            if value < 0x80:
+                out.append(value)
+            elif value <= 0xff:
+                out += pack('>BB', 0xcc, value)
+            elif value <= 0xffff:
+                out += pack('>BH', 0xcd, value)
+            elif value <= 0xffffffff:
+                out += pack('>BI', 0xce, value)
+            elif value <= 0xffffffffffffffff:
+                out += pack('>BQ', 0xcf, value)
+            else:
+                raise ValueError(f"integer {value} does not fit in 64 bits")
+        elif value >= -32:
+            out.append(value & 0xff)
+        elif value >= -0x80:
+            out += pack('>Bb', 0xd0, value)
+        elif value >= -0x8000:
+            out += pack('>Bh', 0xd1, value)
+        elif value >= -0x80000000:
+            out += pack('>Bi', 0xd2, value)
+        elif value >= -0x8000000000000000:
+            out += pack('>Bq', 0xd3, value)
+        else:
+            raise ValueError(f"integer {value} does not fit in 64 bits")
+    elif isinstance(value, float):
+        out += pack('>Bd', 0xcb, value)
+    elif isinstance(value, str):
+        encoded = value.encode('utf-8')
+        size = len(encoded)
+        if size < 32:
+            out.append(0xa0 | size)
+        elif size <= 0xff:
+            out += pack('>BB', 0xd9, size)
+        elif size <= 0xffff:
+            out += pack('>BH', 0xda, size)
+        else:
+            out += pack('>BI', 0xdb, size)
+        out += encoded
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        view = memoryview(value).cast('B')
+        size = len(view)
+        if size <= 0xff:
+            out += pack('>BB', 0xc4, size)
+        elif size <= 0xffff:
+            out += pack('>BH', 0xc5, size)
+        else:
+            out += pack('>BI', 0xc6, size)
+        out += view
+    elif isinstance(value, (list, tuple)):
+        size = len(value)
+        if size < 16:
+            out.append(0x90 | size)
+        elif size <= 0xffff:
+            out += pack('>BH', 0xdc, size)
+        else:
+            out += pack('>BI', 0xdd, size)
+        for item in value:
+            _pack_value(item, out)
+    elif isinstance(value, dict):
+        size = len(value)
+        if size < 16:
+            out.append(0x80 | size)
+        elif size <= 0xffff:
+            out += pack('>BH', 0xde, size)
+        else:
+            out += pack('>BI', 0xdf, size)
+        for key, item in value.items():
+            _pack_value(key, out)
+            _pack_value(item, out)
+    else:
+        raise TypeError(f"can not encode {type(value).__name__} in a NLIP message")
+
+
+# Formats of the sized MessagePack types: (struct format of the size, kind)
+_SIZED = {0xd9: ('>B', 'str'), 0xda: ('>H', 'str'), 0xdb: ('>I', 'str'),
+          0xc4: ('>B', 'bin'), 0xc5: ('>H', 'bin'), 0xc6: ('>I', 'bin'),
+          0xdc: ('>H', 'array'), 0xdd: ('>I', 'array'),
+          0xde: ('>H', 'map'), 0xdf: ('>I', 'map')}
+_FIXED = {0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+          0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q', 0xca: '>f', 0xcb: '>d'}
+_FIXED_SIZES = {'>B': 1, '>H': 2, '>I': 4, '>Q': 8, '>b': 1, '>h': 2, '>i': 4, '>q': 8, '>f': 4, '>d': 8}
+
+# Largest nesting of arrays and maps decoded in python, well below the recursion limit
+MAX_DEPTH = 256
+
+
+def _unpack_value(data: memoryview, pos: int, depth: int = 0):
+    """Returns the value starting at pos and the position following it"""
+    code = data[pos]
+    pos += 1
+    if code < 0x80:
+        return code, pos
+    if code >= 0xe0:
+        return code - 0x100, pos
+    if 0xa0 <= code <= 0xbf:
+        kind, size = 'str', code & 0x1f
+    elif 0x90 <= code <= 0x9f:
+        kind, size = 'array', code & 0x0f
+    elif 0x80 <= code <= 0x8f:
+        kind, size = 'map', code & 0x0f
+    elif code == 0xc0:
+        return None, pos
+    elif code == 0xc2:
+        return False, pos
+    elif code == 0xc3:
+        return True, pos
+    elif code in _FIXED:
+        form = _FIXED[code]
+        return unpack_from(form, data, pos)[0], pos + _FIXED_SIZES[form]
+    elif code in _SIZED:
+        form, kind = _SIZED[code]
+        size = unpack_from(form, data, pos)[0]
+        pos += _FIXED_SIZES[form]
+    else:
+        raise MalformedMessageError(f"unsupported MessagePack type 0x{code:02x}")
+    if kind in ('str', 'bin'):
+        end = pos + size
+        if end > len(data):
+            raise MalformedMessageError("the encoding ended before the message was complete")
+        if kind == 'str':
+            return str(data[pos:end], 'utf-8'), end
+        return bytes(data[pos:end]), end
+    depth += 1
+    if depth > MAX_DEPTH:
+        raise MalformedMessageError(f"arrays and maps are nested more than {MAX_DEPTH} levels deep")
+    if kind == 'array':
+        items = list()
+        for _ in range(size):
+            item, pos = _unpack_value(data, pos, depth)
+            items.append(item)
+        return items, pos
+    result = dict()
+    for _ in range(size):
+        key, pos = _unpack_value(data, pos, depth)
+        result[key], pos = _unpack_value(data, pos, depth)
+    return result, pos
+
+
+try:
+    import msgpack
+
+    def packb(value) -> bytes:
+        """Encodes a value in MessagePack"""
+        return msgpack.packb(value, use_bin_type=True)
+
+    def unpackb(data):
+        """Decodes a MessagePack value"""
+        try:
+            return msgpack.unpackb(data, raw=False, strict_map_key=False)
+        except (ValueError, msgpack.UnpackException) as e:
+            raise MalformedMessageError(f"invalid MessagePack encoding ({e})")
+
+except ImportError:
+
+    def packb(value) -> bytes:
+        """Encodes a value in MessagePack"""
+        out = bytearray()
+        _pack_value(value, out)
+        return bytes(out)
+
+    def unpackb(data):
+        """Decodes a MessagePack value"""
+        view = memoryview(data).cast('B')
+        try:
+            value, end = _unpack_value(view, 0)
+        except (IndexError, StructError, UnicodeDecodeError, ValueError) as e:
+            raise MalformedMessageError(f"invalid MessagePack encoding ({e})")
+        if end != len(view):
+            raise MalformedMessageError("unexpected data after the end of the message")
+        return value
+
+
+def _fields_to_wire(fields: dict) -> dict:
+    wire = dict()
+    for name, value in fields.items():
+        if value is None:
+            continue
+        number = _FIELD_NUMBERS[name]
+        if number in _INTERNED_FIELDS:
+            # Enumerated values are interned by their value, other strings only on an exact match
+            value = _INTERNED_NUMBERS.get(getattr(value, 'value', value), value)
+        elif number == 5:
+            value = [_fields_to_wire(submsg) for submsg in value]
+        wire[number] = value
+    return wire
+
+
+def _fields_from_wire(wire: dict, submessage: bool = False) -> dict:
+    if not isinstance(wire, dict):
+        raise MalformedMessageError("a message must be encoded as a map")
+    fields = dict()
+    for number, value in wire.items():
+        if not isinstance(number, int) or not 0 <= number < len(FIELDS) or (submessage and number == 5):
+            raise MalformedMessageError(f"unknown field number {number}")
+        if number in _INTERNED_FIELDS and isinstance(value, int):
+            if not 0 <= value < len(INTERNED_VALUES):
+                raise MalformedMessageError(f"unknown interned value {value}")
+            value = INTERNED_VALUES[value]
+        elif number == 5:
+            if not isinstance(value, list):
+                raise MalformedMessageError("the submessages must be encoded as an array")
+            value = [_fields_from_wire(submsg, True) for submsg in value]
+        fields[FIELDS[number]] = value
+    return fields
+
+
+def encode_message(fields: dict) -> bytes:
+    """This function encodes the fields of a message in the compact binary encoding.
+
+    Args:
+        fields (dict): The fields of the message, with submessages as lists of field dictionaries
+            and content as str, dict or binary (e.g. model_dump() of a NLIP_Message)
+
+    Returns:
+        bytes: The MessagePack encoding
+    """
+    return packb(_fields_to_wire(fields))
+
+
+def decode_message(data) -> dict:
+    """This function decodes a message from the compact binary encoding.
+
+    Args:
+        data (bytes): The MessagePack encoding
+
+    Returns:
+        dict: The fields of the message, ready to be validated as a NLIP_Message
+    """
+    return _fields_from_wire(unpackb(data))
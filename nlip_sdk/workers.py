@@ -0,0 +1,331 @@
+"""
+ *******************************************************************************
+ *
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *******************************************************************************/
+"""
+
+"""
+This file contains a pool of worker processes encoding and decoding large NLIP Messages.
+
+Encoding a message to JSON (including the base64 encoding of its binary content) and
+decoding and validating JSON hold the GIL, so a process encodes or decodes one message
+at a time. WorkerPool hands the messages whose encoding is larger than a threshold to
+worker processes, so that several are encoded or decoded in parallel, and, through
+encode_async and decode_async, without blocking the event loop. Smaller messages are
+encoded and decoded in the calling process, where it costs less than a hand-off.
+
+Binary content and the JSON to decode are passed to the workers through shared memory,
+copied once, instead of being pickled through a pipe. The encoding produced by a worker,
+or the decoded message, is sent back as the result of the task.
+
+"""
+
+import asyncio
+from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Union
+
+from nlip_sdk.json_backend import encode_model
+from nlip_sdk.nlip import NLIP_Message
+
+# Size in bytes of the encoding above which a message is encoded or decoded by a worker
+DEFAULT_THRESHOLD = 1024 * 1024
+
+_BINARY = (bytes, bytearray, memoryview)
+
+# Stands, in the fields passed to a worker, for binary content copied in the shared memory
+_SharedSlice = namedtuple('_SharedSlice', ('offset', 'length'))
+
+
+def _encoded_size(content) -> int:
+    if isinstance(content, str):
+        return len(content)
+    if isinstance(content, _BINARY):
+        # Binary content grows by a third when it is base64 encoded
+        return memoryview(content).nbytes * 4 // 3
+    return 0
+
+
+def estimate_size(msg: NLIP_Message) -> int:
+    """This function estimates the size of the JSON encoding of a message from its text and
+    binary content, without encoding it. The content of JSON submessages is not counted.
+
+    Args:
+        msg (NLIP_Message): The message
+
+    Returns:
+        int: The estimated size in bytes
+    """
+    size = _encoded_size(msg.content)
+    if msg.submessages:
+        for submsg in msg.submessages:
+            size += _encoded_size(submsg.content)
+    return size
+
+
+def _fields(model) -> dict:
+    fields = dict()
+    for name in type(model).model_fields:
+        value = getattr(model, name)
+        if value is not None:
+            fields[name] = value
+    return fields
+
+
+def _share(msg: NLIP_Message):
+    """Returns the fields of a message, with its binary content moved to shared memory, and the shared memory"""
+    fields = _fields(msg)
+    contents = [fields]
+    if msg.submessages:
+        fields['submessages'] = [_fields(submsg) for submsg in msg.submessages]
+        contents.extend(fields['submessages'])
+    binaries = [entry for entry in contents if isinstance(entry['content'], _BINARY)]
+    if not binaries:
+        return fields, None
+    views = [memoryview(entry['content']).cast('B') for entry in binaries]
+    shm = SharedMemory(create=True, size=max(1, sum(len(view) for view in views)))
+    offset = 0
+    for entry, view in zip(binaries, views):
+        shm.buf[offset:offset + len(view)] = view
+        entry['content'] = _SharedSlice(offset, len(view))
+        offset += len(view)
+    return fields, shm
+
+
+def _share_bytes(data: Union[str, bytes]):
+    """Returns shared memory holding the data, and the size of the data in bytes"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    shm = SharedMemory(create=True, size=max(1, len(data)))
+    shm.buf[:len(data)] = data
+    return shm, len(data)
+
+
+def _attach(name: str) -> SharedMemory:
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before python 3.13, attaching registers the segment with the resource tracker.
+        # The workers share the tracker of the pool process (see WorkerPool), in which
+        # the segment is already registered, and unregistered when it is unlinked.
+        return SharedMemory(name=name)
+
+
+def _release(shm: SharedMemory):
+    shm.close()
+    shm.unlink()
+
+
+def _encode_in_worker(fields: dict, name: str) -> bytes:
+    if name is None:
+        return encode_model(NLIP_Message.model_validate(fields))
+    shm = _attach(name)
+    views = list()
+    try:
+        for entry in (fields, *fields.get('submessages', ())):
+            shared = entry['content']
+            if isinstance(shared, _SharedSlice):
+                view = shm.buf[shared.offset:shared.offset + shared.length]
+                views.append(view)
+                entry['content'] = view
+        return encode_model(NLIP_Message.model_validate(fields))
+    finally:
+        # The views must be released before the shared memory is closed
+        for view in views:
+            view.release()
+        shm.close()
+
+
+def _decode_in_worker(name: str, size: int) -> NLIP_Message:
+    shm = _attach(name)
+    try:
+        data = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+    return NLIP_Message.from_json(data)
+
+
+class WorkerPool:
+    """
+    A pool of worker processes encoding and decoding the NLIP messages above a size threshold.
+
+    Constructor Arguments:
+        max_workers (int): The number of worker processes, the number of processors if None
+        threshold (int): The size in bytes of the encoding above which a message is handed to a worker
+        mp_context: The multiprocessing context starting the workers, the default one if None.
+            Prefer a 'spawn' or 'forkserver' context in processes running threads.
+    """
+    def __init__(self, max_workers: int = None, threshold: int = DEFAULT_THRESHOLD, mp_context=None):
+        # The workers must inherit the resource tracker of this process, see _attach
+        resource_tracker.ensure_running()
+        self.threshold = threshold
+        self._executor = ProcessPoolExecutor(max_workers, mp_context=mp_context)
+
+    def __enter__(self) -> 'WorkerPool':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self, wait: bool = True):
+        """Stops the workers, after the submitted tasks if wait is True"""
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _submit_encode(self, msg: NLIP_Message) -> tuple:
+        """ Submits the encoding of a message, and returns its future and the shared memory to release """
+        fields, shm = _share(msg)
+        try:
+            future = self._executor.submit(_encode_in_worker, fields, shm.name if shm is not None else None)
+        except BaseException:
+            if shm is not None:
+                _release(shm)
+            raise
+        return future, shm
+
+    def _submit_decode(self, data: Union[str, bytes]) -> tuple:
+        """ Submits the decoding of a message, and returns its future and the shared memory to release """
+        shm, size = _share_bytes(data)
+        try:
+            future = self._executor.submit(_decode_in_worker, shm.name, size)
+        except BaseException:
+            _release(shm)
+            raise
+        return future, shm
+
+    def submit_encode(self, msg: NLIP_Message) -> Future:
+        """This function hands the encoding of a message to a worker, whatever its size.
+        The message must not be changed until the encoding is done. The shared memory
+        is released by a callback of the future, which may run after its result is available.
+
+        Args:
+            msg (NLIP_Message): The message
+
+        Returns:
+            Future: The future of the JSON encoding, as bytes
+        """
+        future, shm = self._submit_encode(msg)
+        if shm is not None:
+            future.add_done_callback(lambda _: _release(shm))
+        return future
+
+    def submit_decode(self, data: Union[str, bytes]) -> Future:
+        """This function hands the decoding of a message to a worker, whatever its size.
+        The shared memory is released by a callback of the future, which may run after
+        its result is available.
+
+        Args:
+            data (str or bytes): The JSON encoding of the message
+
+        Returns:
+            Future: The future of the decoded NLIP_Message
+        """
+        future, shm = self._submit_decode(data)
+        future.add_done_callback(lambda _: _release(shm))
+        return future
+
+    def encode(self, msg: NLIP_Message) -> bytes:
+        """This function encodes a message as JSON, in a worker if it is larger than the threshold.
+
+        Args:
+            msg (NLIP_Message): The message
+
+        Returns:
+            bytes: The same bytes as msg.to_json().encode()
+        """
+        if estimate_size(msg) <= self.threshold:
+            return encode_model(msg)
+        future, shm = self._submit_encode(msg)
+        try:
+            return future.result()
+        finally:
+            if shm is not None:
+                _release(shm)
+
+    def decode(self, data: Union[str, bytes]) -> NLIP_Message:
+        """This function decodes a message, in a worker if its encoding is larger than the threshold.
+
+        Args:
+            data (str or bytes): The JSON encoding of the message
+
+        Returns:
+            NLIP_Message: The decoded message, as NLIP_Message.from_json
+        """
+        if len(data) <= self.threshold:
+            return NLIP_Message.from_json(data)
+        future, shm = self._submit_decode(data)
+        try:
+            return future.result()
+        finally:
+            _release(shm)
+
+    async def encode_async(self, msg: NLIP_Message) -> bytes:
+        """ As encode, awaiting the worker without blocking the event loop """
+        if estimate_size(msg) <= self.threshold:
+            return encode_model(msg)
+        future, shm = self._submit_encode(msg)
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            if shm is not None:
+                _release(shm)
+
+    async def decode_async(self, data: Union[str, bytes]) -> NLIP_Message:
+        """ As decode, awaiting the worker without blocking the event loop """
+        if len(data) <= self.threshold:
+            return NLIP_Message.from_json(data)
+        future, shm = self._submit_decode(data)
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            _release(shm)
+
+
+_default_pool = None
+
+
+def get_default_pool() -> WorkerPool:
+    """Returns the pool used by encode_async and decode_async, started on first use"""
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = WorkerPool()
+    return _default_pool
+
+
+async def encode_async(msg: NLIP_Message, pool: WorkerPool = None) -> bytes:
+    """This function encodes a message as JSON, in a worker of the pool if it is large.
+
+    Args:
+        msg (NLIP_Message): The message
+        pool (WorkerPool): The pool of workers, the default pool if None
+
+    Returns:
+        bytes: The same bytes as msg.to_json().encode()
+    """
+    return await (pool if pool is not None else get_default_pool()).encode_async(msg)
+
+
+async def decode_async(data: Union[str, bytes], pool: WorkerPool = None) -> NLIP_Message:
+    """This function decodes a message, in a worker of the pool if it is large.
+
+    Args:
+        data (str or bytes): The JSON encoding of the message
+        pool (WorkerPool): The pool of workers, the default pool if None
+
+    Returns:
+        NLIP_Message: The decoded message
+    """
+    return await (pool if pool is not None else get_default_pool()).decode_async(data)
@@ -0,0 +1,143 @@
+import asyncio
+import threading
+import time
+import unittest
+from nlip_sdk.auth import TokenVerifier
+from nlip_sdk.errors import AuthenticationError
+from nlip_sdk.nlip import NLIP_Factory
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def verify(token):
+    if token.startswith('good'):
+        return {'sub': token[4:]}
+    if token.startswith('expiring'):
+        return {'sub': 'x', 'exp': 1005.0}
+    return None
+
+
+class TestTokenVerifier(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_positive_cache(self):
+        verifier = TokenVerifier(verify, ttl=60, clock=self.clock)
+        self.assertEqual(verifier.check('good-alice'), {'sub': '-alice'})
+        self.assertEqual(verifier.check('good-alice'), {'sub': '-alice'})
+        self.assertEqual(verifier.verifications, 1)
+        self.clock.now += 61
+        verifier.check('good-alice')
+        self.assertEqual(verifier.verifications, 2)
+
+    def test_negative_cache(self):
+        verifier = TokenVerifier(verify, negative_ttl=10, clock=self.clock)
+        for _ in range(3):
+            with self.assertRaises(AuthenticationError):
+                verifier.check('bad')
+        self.assertEqual(verifier.verifications, 1)
+        self.clock.now += 11
+        with self.assertRaises(AuthenticationError):
+            verifier.check('bad')
+        self.assertEqual(verifier.verifications, 2)
+
+    def test_token_expiry_caps_ttl(self):
+        verifier = TokenVerifier(verify, ttl=60, clock=self.clock)
+        verifier.check('expiring')
+        self.clock.now += 6
+        with self.assertRaises(AuthenticationError):
+            verifier.check('expiring')
+        self.assertEqual(verifier.verifications, 2)
+
+    def test_raw_token_not_kept(self):
+        verifier = TokenVerifier(verify, clock=self.clock)
+        verifier.check('good-secret')
+        for key, (claims, _) in verifier._entries.items():
+            self.assertNotIn(b'good-secret', key)
+        self.assertTrue(verifier.invalidate('good-secret'))
+        self.assertEqual(len(verifier), 0)
+
+    def test_bounded(self):
+        verifier = TokenVerifier(verify, max_entries=3, clock=self.clock)
+        for i in range(10):
+            verifier.check(f"good{i}")
+        self.assertEqual(len(verifier), 3)
+
+    def test_transient_errors_not_cached(self):
+        calls = []
+
+        def flaky(token):
+            calls.append(token)
+            if len(calls) == 1:
+                raise ConnectionError("introspection endpoint down")
+            return {'sub': 'a'}
+        verifier = TokenVerifier(flaky, clock=self.clock)
+        with self.assertRaises(ConnectionError):
+            verifier.check('token')
+        self.assertEqual(verifier.check('token'), {'sub': 'a'})
+
+    def test_single_flight_threads(self):
+        def slow(token):
+            time.sleep(0.05)
+            return {'sub': token}
+        verifier = TokenVerifier(slow)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(verifier.check('t'))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [{'sub': 't'}] * 8)
+        self.assertEqual(verifier.verifications, 1)
+
+    def test_single_flight_asyncio(self):
+        async def slow(token):
+            await asyncio.sleep(0.01)
+            return {'sub': token} if token != 'bad' else None
+        verifier = TokenVerifier(slow)
+
+        async def scenario():
+            good = await asyncio.gather(*[verifier.acheck('t') for _ in range(20)])
+            bad = await asyncio.gather(*[verifier.acheck('bad') for _ in range(5)], return_exceptions=True)
+            return good, bad
+        good, bad = asyncio.run(scenario())
+        self.assertEqual(good, [{'sub': 't'}] * 20)
+        self.assertTrue(all(isinstance(e, AuthenticationError) for e in bad))
+        self.assertEqual(verifier.verifications, 2)
+
+    def test_first_caller_cancelled(self):
+        async def slow(token):
+            await asyncio.sleep(0.02)
+            return {'sub': token}
+        verifier = TokenVerifier(slow)
+
+        async def scenario():
+            first = asyncio.ensure_future(verifier.acheck('t'))
+            await asyncio.sleep(0)
+            waiters = [asyncio.ensure_future(verifier.acheck('t')) for _ in range(3)]
+            await asyncio.sleep(0)
+            first.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await first
+            return await asyncio.gather(*waiters)
+        self.assertEqual(asyncio.run(scenario()), [{'sub': 't'}] * 3)
+        self.assertEqual(verifier.verifications, 1)
+
+    def test_message(self):
+        verifier = TokenVerifier(verify, clock=self.clock)
+        msg = NLIP_Factory.create_text('hello')
+        with self.assertRaises(AuthenticationError):
+            verifier.check_message(msg)
+        msg.add_authentication_token('good-bob')
+        self.assertEqual(verifier.check_message(msg), {'sub': '-bob'})
+        self.assertEqual(asyncio.run(verifier.acheck_message(msg)), {'sub': '-bob'})
+
+
+if __name__ == "__main__":
+    unittest.main()
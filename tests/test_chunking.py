@@ -0,0 +1,174 @@
+import os
+import random
+import tempfile
+import unittest
+
+from nlip_sdk.chunking import (ChunkReassembler, ChunkedTransfer, REFERENCE_SUBFORMAT, is_chunk,
+                               split_message)
+from nlip_sdk.errors import MalformedMessageError
+from nlip_sdk.nlip import AllowedFormats, NLIP_Factory, NLIP_Message
+from nlip_sdk.template import NLIP_Template
+
+
+class TestChunking(unittest.TestCase):
+    def setUp(self):
+        self.spool = tempfile.TemporaryDirectory()
+        self.addCleanup(self.spool.cleanup)
+        self.data = bytes(random.Random(7).randrange(256) for _ in range(10000))
+
+    def over_json(self, msg: NLIP_Message) -> NLIP_Message:
+        return NLIP_Message.from_json(msg.to_json())
+
+    def test_chunks(self):
+        transfer = ChunkedTransfer(self.data, AllowedFormats.binary, "image/png", label="photo", chunk_size=4096)
+        self.assertEqual(transfer.count, 3)
+        messages = list(transfer.messages())
+        self.assertEqual(len(messages), 3)
+        description, payload = messages[2].submessages
+        self.assertTrue(is_chunk(description) and is_chunk(payload))
+        self.assertEqual(description.content['offset'], 8192)
+        self.assertEqual(description.content['length'], 10000 - 8192)
+        self.assertIn('sha256', description.content)
+        self.assertNotIn('sha256', messages[0].submessages[0].content)
+        self.assertEqual(bytes(payload.content), self.data[8192:])
+
+    def test_reassemble_out_of_order(self):
+        transfer = ChunkedTransfer(self.data, AllowedFormats.binary, "image/png", label="photo", chunk_size=1000)
+        messages = [self.over_json(msg) for msg in transfer.messages()]
+        random.Random(3).shuffle(messages)
+        reassembler = ChunkReassembler(self.spool.name)
+        completed = list()
+        for msg in messages:
+            completed.extend(reassembler.add_message(msg))
+        self.assertEqual(len(completed), 1)
+        submsg = completed[0].to_submessage()
+        self.assertEqual(bytes(submsg.content), self.data)
+        self.assertEqual(submsg.subformat, "image/png")
+        self.assertEqual(submsg.label, "photo")
+
+    def test_resume(self):
+        transfer = ChunkedTransfer(self.data, AllowedFormats.binary, "raw", chunk_size=1000)
+        reassembler = ChunkReassembler(self.spool.name)
+        for msg in transfer.messages(indices=[0, 4, 9, 4]):
+            self.assertEqual(reassembler.add_message(self.over_json(msg)), [])
+        # A new receiver, as after a restart, finds the chunks received so far
+        resumed = ChunkReassembler(self.spool.name)
+        missing = resumed.missing(transfer.transfer_id)
+        self.assertEqual(missing, [1, 2, 3, 5, 6, 7, 8])
+        completed = list()
+        for msg in transfer.messages(indices=missing):
+            completed.extend(resumed.add_message(self.over_json(msg)))
+        with open(completed[0].path, 'rb') as fp:
+            self.assertEqual(fp.read(), self.data)
+        self.assertIsNone(resumed.missing("unknown"))
+
+    def test_text_and_json(self):
+        reassembler = ChunkReassembler(self.spool.name)
+        text = "naïve " * 1000
+        for content, format in ((text, AllowedFormats.text), ({'items': list(range(500))}, AllowedFormats.structured)):
+            transfer = ChunkedTransfer(content, format, "english", chunk_size=700)
+            completed = list()
+            for msg in transfer.messages():
+                completed.extend(reassembler.add_message(self.over_json(msg)))
+            self.assertEqual(completed[0].to_submessage().content, content)
+
+    def test_base_message(self):
+        base = NLIP_Factory.create_text("upload")
+        base.add_conversation_token("conv0123")
+        transfer = ChunkedTransfer(self.data, AllowedFormats.binary, "raw", chunk_size=5000)
+        for msg in transfer.messages(base=NLIP_Template(base)):
+            self.assertEqual(msg.extract_conversation_token(), "conv0123")
+            self.assertEqual(len(msg.submessages), 3)
+        self.assertEqual(len(base.submessages), 1)
+
+    def test_file(self):
+        filename = os.path.join(self.spool.name, "input.bin")
+        with open(filename, 'wb') as fp:
+            fp.write(self.data)
+        transfer = ChunkedTransfer.from_file(filename, AllowedFormats.binary, "raw", chunk_size=3000)
+        reassembler = ChunkReassembler(os.path.join(self.spool.name, "spool"))
+        completed = list()
+        for msg in transfer.messages():
+            completed.extend(reassembler.add_message(msg))
+        self.assertEqual(bytes(completed[0].to_submessage().content), self.data)
+
+    def test_split_and_restore(self):
+        msg = NLIP_Factory.create_text("Describe this image")
+        msg.add_binary(self.data, "image", "png", label="photo")
+        msg.add_text("small", label="note")
+        reduced, transfers = split_message(msg, threshold=1000, chunk_size=4000)
+        self.assertEqual(len(transfers), 1)
+        self.assertEqual(reduced.submessages[0].subformat, REFERENCE_SUBFORMAT)
+        self.assertEqual(reduced.submessages[1], msg.submessages[1])
+        self.assertIs(msg.submessages[0].content, self.data)
+        reassembler = ChunkReassembler(self.spool.name)
+        for chunk in transfers[0].messages():
+            reassembler.add_message(self.over_json(chunk))
+        restored = reassembler.restore(self.over_json(reduced))
+        self.assertEqual(bytes(restored.submessages[0].content), self.data)
+        self.assertEqual(restored.submessages[0].label, "photo")
+        self.assertEqual(split_message(NLIP_Factory.create_text("x"))[1], [])
+
+    def test_corrupted(self):
+        transfer = ChunkedTransfer(self.data, AllowedFormats.binary, "raw", chunk_size=5000)
+        messages = list(transfer.messages())
+        messages[1].submessages[0].content['sha256'] = '0' * 64
+        reassembler = ChunkReassembler(self.spool.name)
+        reassembler.add_message(messages[0])
+        with self.assertRaises(MalformedMessageError):
+            reassembler.add_message(messages[1])
+        self.assertIsNone(reassembler.missing(transfer.transfer_id))
+        self.assertEqual(os.listdir(self.spool.name), [])
+
+    def test_malformed(self):
+        transfer = ChunkedTransfer(self.data, AllowedFormats.binary, "raw", chunk_size=5000)
+        description, payload = transfer.chunk(0)
+        reassembler = ChunkReassembler(self.spool.name)
+        with self.assertRaises(MalformedMessageError):
+            reassembler.add_chunk(description.content, payload.content[:10])
+        with self.assertRaises(MalformedMessageError):
+            reassembler.add_chunk(dict(description.content, transfer="../escape"), payload.content)
+        with self.assertRaises(MalformedMessageError):
+            reassembler.add_chunk({'transfer': 'abc'}, payload.content)
+        with self.assertRaises(MalformedMessageError):
+            reassembler.add_chunk(description.content, "not base64!")
+        with self.assertRaises(IndexError):
+            transfer.chunk(2)
+
+    def test_refused_description_leaves_no_transfer(self):
+        transfer = ChunkedTransfer(self.data, AllowedFormats.binary, "raw", chunk_size=5000)
+        chunks = [transfer.chunk(index) for index in range(2)]
+        reassembler = ChunkReassembler(self.spool.name)
+        for field, value in [('count', "2"), ('count', 3), ('size', True), ('received', [0, 1])]:
+            with self.subTest(field=field):
+                description = dict(chunks[0][0].content, **{field: value})
+                if field == 'received':
+                    reassembler.add_chunk(description, chunks[0][1].content)
+                    self.assertEqual(reassembler.missing(transfer.transfer_id), [1])
+                    reassembler.discard(transfer.transfer_id)
+                    continue
+                with self.assertRaises(MalformedMessageError):
+                    reassembler.add_chunk(description, chunks[0][1].content)
+                self.assertIsNone(reassembler.missing(transfer.transfer_id))
+                self.assertEqual(os.listdir(self.spool.name), [])
+        completed = [reassembler.add_chunk(description.content, payload.content) for description, payload in chunks]
+        self.assertIsNotNone(completed[1])
+
+    def test_overlapping_chunks_refused(self):
+        data = b'ABCDWXYZ'
+        transfer = ChunkedTransfer(data, AllowedFormats.binary, "raw", chunk_size=4)
+        first, last = transfer.chunk(0), transfer.chunk(1)
+        reassembler = ChunkReassembler(self.spool.name)
+        reassembler.add_chunk(first[0].content, first[1].content)
+        with self.assertRaises(MalformedMessageError):
+            reassembler.add_chunk(dict(last[0].content, offset=0), last[1].content)
+        with self.assertRaises(MalformedMessageError):
+            reassembler.add_chunk(dict(last[0].content, length=3), last[1].content[:3])
+        without_digest = dict(last[0].content)
+        del without_digest['sha256']
+        with self.assertRaises(MalformedMessageError):
+            reassembler.add_chunk(without_digest, last[1].content)
+        with self.assertRaises(MalformedMessageError):
+            reassembler.add_chunk(dict(first[0].content, sha256='0' * 64), first[1].content)
+        completed = reassembler.add_chunk(last[0].content, last[1].content)
+        self.assertEqual(bytes(completed.to_submessage().content), data)
@@ -0,0 +1,166 @@
+import asyncio
+import unittest
+from nlip_sdk.client import NLIPClient
+from nlip_sdk.errors import TransportError
+from nlip_sdk.nlip import NLIP_Message, NLIP_Factory
+from nlip_sdk.transport import format_head, iter_body, read_head
+
+
+class StandInServer:
+    """A local peer replying to each message with its text in upper case"""
+    def __init__(self, statuses=(), delay=0.0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/nlip/"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while (head := await read_head(reader)) is not None:
+                body = b''.join([piece async for piece in iter_body(reader, head)])
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+                await asyncio.sleep(self.delay)
+                self.active -= 1
+                if self.statuses:
+                    status = self.statuses.pop(0)
+                    writer.write(format_head(f"HTTP/1.1 {status} Failed", {'Content-Length': '0'}))
+                else:
+                    reply = NLIP_Factory.create_text(NLIP_Message.from_json(body).extract_text().upper())
+                    data = reply.to_json().encode()
+                    writer.write(format_head("HTTP/1.1 200 OK", {'Content-Type': 'application/json',
+                                                                 'Content-Length': str(len(data))}) + data)
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class TestNLIPClient(unittest.TestCase):
+    def test_send_and_reuse(self):
+        async def scenario():
+            server = StandInServer()
+            url = await server.start()
+            async with NLIPClient(url) as client:
+                for word in ['one', 'two', 'three']:
+                    reply = await client.send(NLIP_Factory.create_text(word))
+                    self.assertEqual(reply.extract_text(), word.upper())
+            await server.stop()
+            return server.connections
+        self.assertEqual(run(scenario()), 1)
+
+    def test_concurrency_limit(self):
+        async def scenario():
+            server = StandInServer(delay=0.02)
+            url = await server.start()
+            async with NLIPClient(url, max_connections_per_host=3) as client:
+                replies = await asyncio.gather(*[client.send(NLIP_Factory.create_text(f"m{i}")) for i in range(12)])
+            await server.stop()
+            self.assertEqual([reply.extract_text() for reply in replies], [f"M{i}" for i in range(12)])
+            return server.max_active, server.connections
+        max_active, connections = run(scenario())
+        self.assertLessEqual(max_active, 3)
+        self.assertLessEqual(connections, 3)
+
+    def test_retry_overloaded(self):
+        async def scenario():
+            server = StandInServer(statuses=[503, 503])
+            url = await server.start()
+            async with NLIPClient(url, retries=2, backoff=0.001) as client:
+                reply = await client.send(NLIP_Factory.create_text('retry'))
+            await server.stop()
+            return reply
+        self.assertEqual(run(scenario()).extract_text(), 'RETRY')
+
+    def test_error_status(self):
+        async def scenario():
+            server = StandInServer(statuses=[404])
+            url = await server.start()
+            try:
+                async with NLIPClient(url, backoff=0.001) as client:
+                    await client.send(NLIP_Factory.create_text('missing'))
+            finally:
+                await server.stop()
+        with self.assertRaises(TransportError) as context:
+            run(scenario())
+        self.assertEqual(context.exception.status, 404)
+
+    def test_timeout(self):
+        async def scenario():
+            server = StandInServer(delay=1.0)
+            url = await server.start()
+            try:
+                async with NLIPClient(url, timeout=0.05) as client:
+                    await client.send(NLIP_Factory.create_text('slow'))
+            finally:
+                await server.stop()
+        with self.assertRaises(TransportError):
+            run(scenario())
+
+    def test_body_until_close(self):
+        connections = []
+
+        async def handle(reader, writer):
+            connections.append(writer)
+            head = await read_head(reader)
+            body = b''.join([piece async for piece in iter_body(reader, head)])
+            text = NLIP_Message.from_json(body).extract_text()
+            writer.write(format_head("HTTP/1.1 200 OK", {'Content-Type': 'application/json'}))
+            writer.write(NLIP_Factory.create_text(text.upper()).to_json().encode())
+            await writer.drain()
+            writer.close()
+
+        async def scenario():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/nlip/"
+            async with NLIPClient(url, retries=0) as client:
+                replies = [await client.send(NLIP_Factory.create_text(word)) for word in ['one', 'two']]
+            server.close()
+            await server.wait_closed()
+            return [reply.extract_text() for reply in replies]
+        self.assertEqual(run(scenario()), ['ONE', 'TWO'])
+        self.assertEqual(len(connections), 2)
+
+    def test_busy_host_does_not_starve_others(self):
+        async def scenario():
+            slow, fast = StandInServer(delay=0.3), StandInServer()
+            slow_url, fast_url = await slow.start(), await fast.start()
+            async with NLIPClient(max_connections=2, max_connections_per_host=1) as client:
+                pending = [asyncio.ensure_future(client.send(NLIP_Factory.create_text(f"s{i}"), slow_url))
+                           for i in range(3)]
+                await asyncio.sleep(0.05)
+                start = asyncio.get_running_loop().time()
+                reply = await client.send(NLIP_Factory.create_text('quick'), fast_url)
+                elapsed = asyncio.get_running_loop().time() - start
+                await asyncio.gather(*pending)
+            await slow.stop()
+            await fast.stop()
+            return reply.extract_text(), elapsed
+        text, elapsed = run(scenario())
+        self.assertEqual(text, 'QUICK')
+        self.assertLess(elapsed, 0.2)
+
+    def test_connection_refused(self):
+        async def scenario():
+            async with NLIPClient('http://127.0.0.1:9/nlip/', retries=0) as client:
+                await client.send(NLIP_Factory.create_text('nobody'))
+        with self.assertRaises(TransportError):
+            run(scenario())
+
+
+if __name__ == "__main__":
+    unittest.main()
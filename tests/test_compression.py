@@ -0,0 +1,96 @@
+import unittest
+import zlib
+from nlip_sdk import compression
+from nlip_sdk.errors import MalformedMessageError
+from nlip_sdk.nlip import NLIP_Message, NLIP_Factory, AllowedFormats
+
+
+def make_message() -> NLIP_Message:
+    msg = NLIP_Factory.create_text('Summarize the transcript', messagetype='request')
+    msg.add_conversation_token('conv0123')
+    msg.add_text('The speaker repeats the same sentence again and again. ' * 200, label='transcript')
+    msg.add_json({'rows': [{'id': i, 'name': f'row {i}', 'valid': True} for i in range(200)]}, label='table')
+    msg.add_text('short text', label='short')
+    msg.add_image(bytes(range(256)) * 20, 'png')
+    return msg
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.msg = make_message()
+
+    def test_stdlib_codecs(self):
+        self.assertTrue({'zlib', 'gzip'} <= set(compression.available_codecs()))
+
+    def test_whole_message(self):
+        for codec in compression.available_codecs():
+            for wire in [False, True]:
+                with self.subTest(codec=codec, wire=wire):
+                    data = compression.compress_message(self.msg, codec, wire)
+                    self.assertTrue(compression.is_compressed(data))
+                    self.assertLess(len(data), len(self.msg.to_json()) // 2)
+                    decoded = compression.decompress_message(data)
+                    self.assertEqual(decoded.to_json(), self.msg.to_json())
+
+    def test_plain_message_passes_through(self):
+        self.assertEqual(compression.decompress_message(self.msg.to_json()).to_json(), self.msg.to_json())
+
+    def test_selected_submessages(self):
+        compressed = compression.compress_submessages(self.msg, 'gzip', threshold=1024)
+        subformats = [submsg.subformat for submsg in compressed.submessages]
+        self.assertEqual(subformats, ['conversation', 'compressed/gzip', 'compressed/gzip', 'english', 'image/png'])
+        self.assertIs(compressed.submessages[0], self.msg.submessages[0])
+        self.assertEqual(compressed.find_labeled_submessage('table').format, AllowedFormats.binary)
+        self.assertLess(len(compressed.to_json()), len(self.msg.to_json()) // 2)
+        self.assertEqual(self.msg.submessages[1].format, AllowedFormats.text)
+
+    def test_selected_submessages_round_trip(self):
+        compressed = compression.compress_submessages(self.msg, threshold=1024)
+        self.assertEqual(compression.decompress_message(compressed.to_json()), 
+                         NLIP_Message.from_json(self.msg.to_json()))
+        self.assertEqual(compression.decompress_message(compressed).extract_text(), self.msg.extract_text())
+
+    def test_corrupted(self):
+        data = compression.compress_message(self.msg)
+        with self.assertRaises(MalformedMessageError):
+            compression.decompress_message(data[:-20])
+
+    def test_decompression_limit(self):
+        size = len(self.msg.to_json())
+        for codec in compression.available_codecs():
+            with self.subTest(codec=codec):
+                data = compression.compress_message(self.msg, codec)
+                self.assertEqual(compression.decompress_message(data, max_size=size).to_json(), self.msg.to_json())
+                with self.assertRaises(MalformedMessageError):
+                    compression.decompress_message(data, max_size=size - 1)
+        bomb = compression.compress_submessages(self.msg, threshold=1024)
+        with self.assertRaises(MalformedMessageError):
+            compression.decompress_submessages(bomb, max_size=5000)
+
+    def test_compressed_submessage_not_object(self):
+        msg = NLIP_Factory.create_text('Hello')
+        msg.add_binary(zlib.compress(b'[1, 2, 3]'), 'compressed', 'zlib')
+        with self.assertRaises(MalformedMessageError):
+            compression.decompress_message(msg.to_json())
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            compression.compress_message(self.msg, 'brotli')
+
+    def test_invalid_peer_data(self):
+        unknown_submessage = NLIP_Factory.create_text('Hello')
+        unknown_submessage.add_binary(b'data', 'compressed', 'brotli')
+        invalid = zlib.compress(b'{"format": "text"}')
+        cases = {'unknown codec': compression.MAGIC + b'\x00\x06brotli' + b'data',
+                 'unknown submessage codec': unknown_submessage.to_json(),
+                 'invalid message': compression.MAGIC + b'\x00\x04zlib' + invalid,
+                 'invalid wire message': compression.MAGIC + b'\x01\x04zlib' + zlib.compress(b'\x81\x05\x05'),
+                 'invalid plain message': '{"format": "text", "content": 1}'}
+        for case, data in cases.items():
+            with self.subTest(case=case):
+                with self.assertRaises(MalformedMessageError):
+                    compression.decompress_message(data)
+
+
+if __name__ == "__main__":
+    unittest.main()
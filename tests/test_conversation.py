@@ -0,0 +1,199 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from nlip_sdk.conversation import ConversationStore, MemoryBackend, SQLiteBackend
+from nlip_sdk.nlip import NLIP_Factory
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class StoreTests:
+    """Tests run against every backend"""
+    def make_backend(self):
+        raise NotImplementedError
+
+    def make_store(self, **kwargs):
+        self.clock = Clock()
+        store = ConversationStore(self.make_backend(), clock=self.clock, **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def test_get_set_delete(self):
+        store = self.make_store()
+        store.set('c1', {'turns': 1})
+        self.assertEqual(store.get('c1'), {'turns': 1})
+        self.assertIn('c1', store)
+        self.assertIsNone(store.get('c2'))
+        self.assertEqual(store.get('c2', 'default'), 'default')
+        self.assertTrue(store.delete('c1'))
+        self.assertFalse(store.delete('c1'))
+        self.assertEqual(len(store), 0)
+
+    def test_ttl_renewed_on_use(self):
+        store = self.make_store(ttl=10)
+        store.set('c1', 'state')
+        self.clock.now += 8
+        self.assertEqual(store.get('c1'), 'state')
+        self.clock.now += 8
+        self.assertEqual(store.get('c1'), 'state')
+        self.clock.now += 11
+        self.assertIsNone(store.get('c1'))
+        self.assertEqual(len(store), 0)
+
+    def test_contains_does_not_renew(self):
+        store = self.make_store(ttl=10)
+        store.set('c1', 'state')
+        self.clock.now += 8
+        self.assertIn('c1', store)
+        self.clock.now += 3
+        self.assertNotIn('c1', store)
+        self.assertNotIn(None, store)
+
+    def test_purge(self):
+        store = self.make_store(ttl=10)
+        store.set('c1', 'old')
+        self.clock.now += 5
+        store.set('c2', 'new')
+        self.clock.now += 6
+        self.assertEqual(store.purge(), 1)
+        self.assertEqual(store.get('c2'), 'new')
+
+    def test_lru_max_entries(self):
+        store = self.make_store(max_entries=2)
+        store.set('c1', 1)
+        self.clock.now += 1
+        store.set('c2', 2)
+        self.clock.now += 1
+        store.get('c1')
+        self.clock.now += 1
+        store.set('c3', 3)
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get('c2'))
+        self.assertEqual(store.get('c1'), 1)
+        self.assertEqual(store.get('c3'), 3)
+
+    def test_max_bytes(self):
+        store = self.make_store(max_entries=None, max_bytes=3000)
+        for i in range(5):
+            self.clock.now += 1
+            store.set(f"c{i}", 'x' * 1000)
+        self.assertLessEqual(store.total_bytes, 3000)
+        self.assertEqual(len(store), 2)
+        self.assertIsNotNone(store.get('c4'))
+        self.assertIsNone(store.get('c0'))
+
+    def test_message_helpers(self):
+        store = self.make_store()
+        msg = NLIP_Factory.create_text('hello')
+        msg.add_conversation_token('conv-42')
+        store.set_for(msg, ['hello'])
+        self.assertEqual(store.get('conv-42'), ['hello'])
+        self.assertEqual(store.get_for(msg), ['hello'])
+        self.assertIsNone(store.get_for(NLIP_Factory.create_text('no token')))
+
+    def test_asyncio(self):
+        store = self.make_store()
+
+        async def scenario():
+            await asyncio.gather(*[store.aset(f"c{i}", i) for i in range(20)])
+            return await asyncio.gather(*[store.aget(f"c{i}") for i in range(20)])
+        self.assertEqual(asyncio.run(scenario()), list(range(20)))
+
+    def test_threads(self):
+        store = self.make_store(max_entries=50)
+
+        def work(n):
+            for i in range(100):
+                store.set(f"t{n}-{i}", i)
+                store.get(f"t{n}-{i // 2}")
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(store), 50)
+
+
+class TestMemoryBackend(StoreTests, unittest.TestCase):
+    def make_backend(self):
+        return MemoryBackend()
+
+    def test_state_not_copied(self):
+        store = self.make_store()
+        state = {'turns': []}
+        store.set('c1', state)
+        self.assertIs(store.get('c1'), state)
+
+    def test_sized_only_with_max_bytes(self):
+        store = self.make_store()
+        store.set('c1', {'lock': threading.Lock()})
+        self.assertEqual(len(store), 1)
+        self.assertIn('c1', store)
+        sizes = list()
+        store = ConversationStore(MemoryBackend(sizer=lambda state: sizes.append(state) or 10),
+                                  max_bytes=25)
+        for i in range(3):
+            store.set(f"c{i}", i)
+        self.assertEqual(sizes, [0, 1, 2])
+        self.assertEqual((len(store), store.total_bytes), (2, 20))
+        store.set('c1', 5)
+        self.assertEqual(sizes, [0, 1, 2, 5])
+        self.assertEqual(store.total_bytes, 20)
+
+
+class TestSQLiteBackend(StoreTests, unittest.TestCase):
+    def make_backend(self):
+        return SQLiteBackend(':memory:')
+
+    def test_shared_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'conversations.db')
+            first = ConversationStore(SQLiteBackend(path))
+            second = ConversationStore(SQLiteBackend(path))
+            first.set('c1', {'turns': 2})
+            self.assertEqual(second.get('c1'), {'turns': 2})
+            first.close()
+            second.close()
+
+    def test_json_state(self):
+        store = self.make_store()
+        msg = NLIP_Factory.create_text('hello')
+        msg.add_conversation_token('conv-42')
+        store.set('m', msg)
+        self.assertEqual(store.get('m'), msg)
+        store.set('t', ('a', 1))
+        self.assertEqual(store.get('t'), ['a', 1])
+        with self.assertRaises(TypeError):
+            store.set('bad', object())
+
+    def test_totals_follow_updates(self):
+        store = self.make_store(max_entries=None)
+        store.set('c1', 'x' * 100)
+        store.set('c1', 'x' * 10)
+        store.set('c2', 'y')
+        store.delete('c2')
+        self.assertEqual((len(store), store.total_bytes), (1, 12))
+
+    def test_without_returning(self):
+        with patch('nlip_sdk.conversation._HAS_RETURNING', False):
+            store = self.make_store(ttl=10)
+            store.set('c1', {'turns': 1})
+            self.clock.now += 8
+            self.assertEqual(store.get('c1'), {'turns': 1})
+            self.clock.now += 8
+            self.assertEqual(store.get('c1'), {'turns': 1})
+            self.clock.now += 11
+            self.assertIsNone(store.get('c1'))
+
+
+if __name__ == "__main__":
+    unittest.main()
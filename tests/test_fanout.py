@@ -0,0 +1,106 @@
+import asyncio
+import unittest
+from contextlib import aclosing
+
+from nlip_sdk.client import NLIPClient
+from nlip_sdk.errors import QuorumError
+from nlip_sdk.fanout import FanOut, merge_by_conversation
+from nlip_sdk.nlip import NLIP_Factory
+from tests.test_client import StandInServer
+
+
+class Peers:
+    """Stand-in peers, replying after the given delays or failing with the given statuses"""
+    def __init__(self, delays, failures=()):
+        self.servers = [StandInServer(statuses=(500,) if position in failures else (), delay=delay)
+                        for position, delay in enumerate(delays)]
+
+    async def __aenter__(self) -> list:
+        return [await server.start() for server in self.servers]
+
+    async def __aexit__(self, *exc_info):
+        for server in self.servers:
+            await server.stop()
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+class TestFanOut(unittest.TestCase):
+    def setUp(self):
+        self.msg = NLIP_Factory.create_text("hello")
+
+    def test_as_completed_in_arrival_order(self):
+        async def scenario():
+            async with Peers([0.15, 0.0, 0.05]) as urls, NLIPClient(retries=0) as client:
+                fanout = FanOut(client)
+                async with aclosing(fanout.as_completed(self.msg, urls)) as replies:
+                    received = [reply async for reply in replies]
+                return urls, received
+        urls, received = run(scenario)
+        self.assertEqual([reply.url for reply in received], [urls[1], urls[2], urls[0]])
+        self.assertTrue(all(reply.ok and reply.message.extract_text() == "HELLO" for reply in received))
+
+    def test_first(self):
+        async def scenario():
+            async with Peers([0.5, 0.0, 0.0], failures={1}) as urls, NLIPClient(retries=0) as client:
+                replies = await FanOut(client).first(self.msg, urls, k=1)
+                return urls, replies
+        urls, replies = run(scenario)
+        self.assertEqual([reply.url for reply in replies], [urls[2]])
+
+    def test_bounded_concurrency(self):
+        peers = Peers([0.05] * 6)
+
+        async def scenario():
+            async with peers as urls, NLIPClient(retries=0) as client:
+                return await FanOut(client, max_concurrency=2).all(self.msg, urls)
+        replies = run(scenario)
+        self.assertEqual(len(replies), 6)
+        self.assertEqual(sum(server.max_active for server in peers.servers), 6)
+
+    def test_quorum(self):
+        async def scenario():
+            async with Peers([0.0, 0.0, 0.05, 0.5], failures={0}) as urls, NLIPClient(retries=0) as client:
+                fanout = FanOut(client)
+                replies = await fanout.quorum(self.msg, urls, quorum=2)
+            async with Peers([0.0, 0.0, 0.5], failures={0, 1}) as failing, NLIPClient(retries=0) as client:
+                start = asyncio.get_running_loop().time()
+                with self.assertRaises(QuorumError) as raised:
+                    await FanOut(client).quorum(self.msg, failing, quorum=2)
+                self.assertLess(asyncio.get_running_loop().time() - start, 0.4)
+                return urls, replies, raised.exception
+        urls, replies, error = run(scenario)
+        self.assertEqual({reply.url for reply in replies}, {urls[1], urls[2]})
+        self.assertEqual(len(error.replies), 2)
+
+    def test_deadline(self):
+        async def scenario():
+            async with Peers([0.0, 1.0]) as urls, NLIPClient(retries=0) as client:
+                fanout = FanOut(client)
+                start = asyncio.get_running_loop().time()
+                replies = await fanout.all(self.msg, urls, timeout=0.2)
+                elapsed = asyncio.get_running_loop().time() - start
+                async with fanout.scatter(self.msg, urls, timeout=0.2) as scatter:
+                    async for reply in scatter:
+                        pass
+                    pending = scatter.pending
+                return urls, replies, elapsed, pending
+        urls, replies, elapsed, pending = run(scenario)
+        self.assertEqual([reply.url for reply in replies], [urls[0]])
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual(pending, [urls[1]])
+
+    def test_merge_by_conversation(self):
+        async def scenario():
+            async with Peers([0.0, 0.0], failures={1}) as urls, NLIPClient(retries=0) as client:
+                return await FanOut(client).all(self.msg, urls)
+        replies = run(scenario)
+        merged = merge_by_conversation(replies)
+        self.assertEqual(list(merged), [None])
+        self.assertEqual(len(merged[None]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
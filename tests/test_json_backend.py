@@ -0,0 +1,76 @@
+import unittest
+
+import pydantic_core
+
+from nlip_sdk import json_backend
+from nlip_sdk.lite import NLIP_LiteMessage
+from nlip_sdk.nlip import NLIP_Message, NLIP_Factory, ReservedTokens
+from nlip_sdk.streaming import parse_stream
+
+
+CONTENT = {'floats': [2.5e20, 1e16, 1e-07, 0.1, 1 / 3, -0.0, 123456789.0],
+           'integers': [0, -1, 2 ** 63 - 1, -2 ** 63, 2 ** 64, 10 ** 30],
+           'text': 'café   \x00 \x1f \x7f </ "quoted" \\ \U0001F600',
+           'nested': {'empty': {}, 'list': [], 'flags': [True, False, None]}}
+
+
+def make_message() -> NLIP_Message:
+    msg = NLIP_Factory.create_json(CONTENT, messagetype=ReservedTokens.control, label='data')
+    msg.add_text(CONTENT['text'], label='text')
+    msg.add_image(bytes(range(256)), 'png')
+    msg.add_conversation_token('conv0123')
+    return msg
+
+
+class TestJSONBackends(unittest.TestCase):
+    def setUp(self):
+        self.previous = json_backend.get_backend()
+        self.msg = make_message()
+        self.reference = self.msg.model_dump_json(exclude_none=True)
+
+    def tearDown(self):
+        json_backend._backend = self.previous
+
+    def test_stdlib_always_available(self):
+        self.assertEqual(json_backend.available_backends()[-1], 'stdlib')
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            json_backend.set_backend('yaml')
+
+    def test_identical_encoding(self):
+        for name in json_backend.available_backends():
+            with self.subTest(backend=name):
+                json_backend.set_backend(name)
+                self.assertEqual(self.msg.to_json(), self.reference)
+                self.assertEqual(NLIP_LiteMessage.from_model(self.msg).to_json(), self.reference)
+                self.assertEqual(NLIP_Message.dump_many([self.msg], ndjson=True), self.reference + '\n')
+
+    def test_identical_decoding(self):
+        expected = NLIP_Message.model_validate_json(self.reference)
+        for name in json_backend.available_backends():
+            with self.subTest(backend=name):
+                json_backend.set_backend(name)
+                self.assertEqual(json_backend.loads(self.reference.encode()), self.msg.to_dict())
+                self.assertEqual(NLIP_Message.from_json(self.reference), expected)
+                self.assertEqual(NLIP_Message.load_many(f"[{self.reference}]"), [expected])
+                self.assertEqual(parse_stream([self.reference.encode()]), expected)
+                self.assertEqual(json_backend.loads('[1e400, NaN]')[0], float('inf'))
+                self.assertEqual(json_backend.loads('18446744073709551616'), 2 ** 64)
+                self.assertEqual(json_backend.loads('[[{"a": -9223372036854775809}]]'), [[{'a': -2 ** 63 - 1}]])
+
+    def test_same_input_refused(self):
+        lone_surrogate = '{"format": "text", "subformat": "english", "content": "c\\ud800"}'
+        for name in json_backend.available_backends():
+            with self.subTest(backend=name):
+                json_backend.set_backend(name)
+                with self.assertRaises(ValueError):
+                    NLIP_Message.from_json(lone_surrogate)
+
+    def test_encoding_independent_of_backend(self):
+        self.assertEqual(json_backend.encode_model(self.msg).decode(), self.reference)
+        self.assertEqual(json_backend.dumps(CONTENT), pydantic_core.to_json(CONTENT))
+
+
+if __name__ == "__main__":
+    unittest.main()
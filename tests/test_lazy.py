@@ -0,0 +1,94 @@
+import unittest
+from nlip_sdk.errors import MalformedMessageError
+from nlip_sdk.lazy import NLIP_LazyMessage, NLIP_LazyStreamParser
+from nlip_sdk.nlip import NLIP_Factory, NLIP_Message
+
+
+def make_message() -> NLIP_Message:
+    msg = NLIP_Factory.create_text("Route me", messagetype="request", label="top")
+    msg.add_conversation_token("conv-7")
+    msg.add_json({"format": "token", "nested": {"label": "decoy"}}, label="data")
+    msg.add_text("Second part", label="part2")
+    msg.add_binary(b"\x00\x01\x02", "octet-stream", "raw", label="blob")
+    msg.add_text("Bonjour", language="french")
+    return msg
+
+
+class TestLazyMessage(unittest.TestCase):
+    def setUp(self):
+        # Binary content is received as base64 text, so compare with the parsed message
+        self.msg = NLIP_Message.from_json(make_message().to_json())
+        self.lazy = NLIP_LazyMessage.from_json(self.msg.to_json())
+
+    def decoded(self) -> list:
+        return [self.lazy.is_decoded(position) for position in range(len(self.lazy))]
+
+    def test_top_level_without_decoding(self):
+        self.assertEqual(self.lazy.messagetype, "request")
+        self.assertEqual(self.lazy.extract_field("text", "english"), "Route me")
+        self.assertFalse(self.lazy.is_control_msg())
+        self.assertEqual(len(self.lazy), 5)
+        self.assertEqual(self.decoded(), [False] * 5)
+
+    def test_extract_decodes_only_matches(self):
+        self.assertEqual(self.lazy.extract_conversation_token(), "conv-7")
+        self.assertEqual(self.decoded(), [True, False, False, False, False])
+        self.assertEqual(self.lazy.extract_text(), self.msg.extract_text())
+        self.assertEqual(self.decoded(), [True, False, True, False, False])
+        self.assertEqual(self.lazy.extract_field_list("structured"), self.msg.extract_field_list("structured"))
+        self.assertEqual(self.lazy.extract_text('french'), 'Bonjour')
+
+    def test_labels_ignore_nested_content(self):
+        self.assertIsNone(self.lazy.find_labeled_submessage("decoy"))
+        self.assertEqual(self.lazy.find_labeled_submessage("BLOB"), self.msg.find_labeled_submessage("blob"))
+        self.assertEqual(self.decoded(), [False, False, False, True, False])
+
+    def test_by_position(self):
+        self.assertEqual(self.lazy.submessage(1), self.msg.submessages[1])
+        self.assertEqual(self.lazy.raw_submessage(2), self.msg.submessages[2].model_dump(mode="json", exclude_none=True))
+
+    def test_round_trip(self):
+        self.assertEqual(self.lazy.to_json(), self.msg.to_json())
+        self.assertEqual(self.lazy.to_message(), self.msg)
+        self.lazy.submessage(2).update_content("changed")
+        self.msg.submessages[2].update_content("changed")
+        self.assertEqual(self.lazy.to_json(), self.msg.to_json())
+
+    def test_no_submessages(self):
+        msg = NLIP_Factory.create_text("alone")
+        lazy = NLIP_LazyMessage.from_json(msg.to_json())
+        self.assertIsNone(lazy.submessages)
+        self.assertEqual(lazy.to_message(), msg)
+        self.assertEqual(lazy.to_json(), msg.to_json())
+        self.assertIsNone(lazy.extract_conversation_token())
+
+    def test_whitespace(self):
+        encoded = '{ "format" : "text", "subformat": "english", "content": "hi",\n "submessages" : [ { "label" : "a" , "format": "token", "subformat": "conversation", "content": "c" } ] }'
+        lazy = NLIP_LazyMessage.from_json(encoded)
+        self.assertEqual(lazy.extract_conversation_token(), "c")
+        self.assertEqual(lazy.to_message(), NLIP_Message.from_json(encoded))
+
+    def test_stream_parser_events(self):
+        encoded = self.msg.to_json().encode()
+        received = []
+        parser = NLIP_LazyStreamParser(on_submessage=lambda position, raw: received.append(raw))
+        for start in range(0, len(encoded), 7):
+            parser.feed(encoded[start:start + 7])
+        lazy = parser.close()
+        self.assertEqual(len(received), 5)
+        self.assertTrue(all(isinstance(raw, dict) for raw in received))
+        self.assertEqual(lazy.to_message(), self.msg)
+
+    def test_malformed(self):
+        with self.assertRaises(MalformedMessageError):
+            NLIP_LazyMessage.from_json('{"format": "text", "subformat": "english", "content": "x", "submessages": [1]}')
+        with self.assertRaises(MalformedMessageError):
+            NLIP_LazyMessage.from_json('{"format": "text", "subformat": "english"')
+        with self.assertRaises(MalformedMessageError):
+            NLIP_LazyMessage.from_json('{"format": "text"}')
+        with self.assertRaises(MalformedMessageError):
+            NLIP_LazyStreamParser().feed(b'{"format": 1.2.3}')
+
+
+if __name__ == "__main__":
+    unittest.main()
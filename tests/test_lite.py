@@ -0,0 +1,57 @@
+import unittest
+from nlip_sdk.nlip import NLIP_SubMessage, NLIP_Factory, AllowedFormats, ReservedTokens
+from nlip_sdk.lite import NLIP_LiteMessage, NLIP_LiteSubMessage
+
+
+def build(msg):
+    for i in range(5):
+        msg.add_text(f"text {i}", label=f"part{i}")
+    msg.add_image(b'raw image', 'png')
+    msg.add_json({'key': [1, 2.5, None]})
+    msg.add_token('custom0123', 'custom')
+    msg.add_conversation_token('conv0123')
+    msg.add_authentication_token('auth0123')
+    msg.add_error_code('E42')
+    msg.add_error_text('Not found')
+    return msg
+
+
+class TestLiteMessage(unittest.TestCase):
+    def setUp(self):
+        self.model = build(NLIP_Factory.create_text("Hello", messagetype=ReservedTokens.control))
+        self.lite = build(NLIP_LiteMessage(AllowedFormats.text, 'english', "Hello", ReservedTokens.control))
+
+    def test_same_serialization(self):
+        self.assertEqual(self.lite.to_dict(), self.model.to_dict())
+        self.assertEqual(self.lite.to_json(), self.model.to_json())
+
+    def test_accessors(self):
+        self.assertTrue(self.lite.is_control_msg())
+        self.assertEqual(self.lite.extract_text(), self.model.extract_text())
+        self.assertEqual(self.lite.extract_conversation_token(), 'conv0123')
+        self.assertEqual(self.lite.extract_authentication_token(), 'auth0123')
+        self.assertEqual(self.lite.extract_token('CUSTOM'), 'custom0123')
+        self.assertEqual(self.lite.find_labeled_submessage('Part3').content, 'text 3')
+        self.assertEqual(self.lite.extract_field_list(AllowedFormats.error, 'code'), ['E42'])
+        self.assertEqual(self.model.extract_field_list(AllowedFormats.error, 'text'), ['Not found'])
+
+    def test_to_model(self):
+        self.assertEqual(self.lite.to_model(), self.model)
+        self.assertEqual(self.lite.to_model(validate=False), self.model)
+        self.assertEqual(NLIP_LiteMessage.from_model(self.model), self.lite)
+
+    def test_content_not_copied(self):
+        payload = bytes(range(256)) * 10
+        lite = NLIP_LiteMessage(AllowedFormats.binary, 'image/png', payload)
+        self.assertIs(lite.to_model().content, payload)
+        self.assertIs(NLIP_LiteMessage.from_model(lite.to_model()).content, payload)
+
+    def test_submessage(self):
+        submsg = NLIP_LiteSubMessage(AllowedFormats.text, 'English', 'Bonjour', 'greeting')
+        self.assertEqual(submsg.extract_field('TEXT', 'english'), 'Bonjour')
+        self.assertEqual(submsg.to_model(), NLIP_SubMessage(format='text', subformat='English', 
+                                                            content='Bonjour', label='greeting'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from nlip_sdk import metrics
+from nlip_sdk.errors import RethrownException
+from nlip_sdk.nlip import NLIP_Factory, NLIP_Message, NLIP_SubMessage
+
+
+class RecordingSink(metrics.MetricsSink):
+    def __init__(self):
+        self.records = list()
+
+    def record(self, operation, seconds, size=None, error=False):
+        self.records.append((operation, size, error))
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(metrics.disable)
+        self.registry = metrics.MetricsRegistry()
+
+    def test_disabled_by_default(self):
+        self.assertFalse(metrics.is_enabled())
+        self.assertNotIn('__init__', NLIP_Message.__dict__)
+        self.assertFalse(hasattr(NLIP_Message.to_json, '__wrapped__'))
+
+    def test_records(self):
+        metrics.enable(self.registry)
+        msg = NLIP_Factory.create_text('hello')
+        msg.add_text('world', label='second')
+        encoded = msg.to_json()
+        parsed = NLIP_Message.from_json(encoded)
+        self.assertEqual(parsed, msg)
+        parsed.extract_text()
+        parsed.to_dict()
+        snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot['construct']['latency']['count'], 1)
+        self.assertEqual(snapshot['construct_submessage']['latency']['count'], 1)
+        self.assertEqual(snapshot['to_json']['size']['sum'], len(encoded))
+        self.assertEqual(snapshot['from_json']['size']['sum'], len(encoded))
+        self.assertEqual(snapshot['extract_text']['latency']['count'], 1)
+        self.assertIsNone(snapshot['to_dict']['size'])
+        self.assertEqual(snapshot['to_json']['latency']['buckets'][float('inf')], 1)
+
+    def test_errors(self):
+        metrics.enable(self.registry)
+        with self.assertRaises(ValueError):
+            NLIP_Message.from_json('{"format": "text"}')
+        self.assertEqual(self.registry.snapshot()['from_json']['errors'], 1)
+
+    def test_disable_restores(self):
+        to_json = NLIP_Message.__dict__['to_json']
+        from_json = NLIP_Message.__dict__['from_json']
+        sink = RecordingSink()
+        metrics.enable(sink)
+        self.assertTrue(metrics.is_enabled())
+        NLIP_SubMessage(format='text', subformat='english', content='x')
+        metrics.disable()
+        self.assertIs(NLIP_Message.__dict__['to_json'], to_json)
+        self.assertIs(NLIP_Message.__dict__['from_json'], from_json)
+        self.assertNotIn('__init__', NLIP_SubMessage.__dict__)
+        NLIP_Factory.create_text('not recorded').to_json()
+        self.assertEqual(sink.records, [('construct_submessage', None, False)])
+
+    def test_prometheus(self):
+        metrics.enable(self.registry)
+        NLIP_Factory.create_text('hello').to_json()
+        text = self.registry.to_prometheus()
+        self.assertIn('# TYPE nlip_operation_seconds histogram', text)
+        self.assertIn('nlip_operation_seconds_count{operation="to_json"} 1', text)
+        self.assertIn('nlip_operation_bytes_bucket{operation="to_json",le="+Inf"} 1', text)
+        self.assertIn('nlip_operation_errors_total{operation="construct"} 0', text)
+
+    def test_opentelemetry(self):
+        try:
+            sink = metrics.OpenTelemetrySink()
+        except RethrownException:
+            self.skipTest("opentelemetry is not installed")
+        metrics.enable(sink)
+        NLIP_Factory.create_text('hello').to_json()
+
+
+if __name__ == "__main__":
+    unittest.main()
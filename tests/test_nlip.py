@@ -1,7 +1,16 @@
 # Assisted by WCA@IBM
 # Latest GenAI contribution: ibm/granite-8b-code-instruct
+import os
+import pickle
+import tempfile
 import unittest
+from io import BytesIO
+from unittest.mock import patch
+from json import loads
+from base64 import b64encode
 from nlip_sdk.nlip import NLIP_Message, NLIP_SubMessage, NLIP_Factory, AllowedFormats,ReservedTokens
+from nlip_sdk.nlip import nlip_compare_string, normalize
+from nlip_sdk import nlip
 
 class TestNLIPEncodeText(unittest.TestCase):
     def test_default_values(self):
@@ -32,6 +41,12 @@ class TestNLIPEncodeText(unittest.TestCase):
         actual = NLIP_Factory.create_text("message", language="spanish")
         self.assertEqual(expected, actual)
 
+    def test_error_code_and_text(self):
+        code = NLIP_Factory.create_error_code("E404")
+        text = NLIP_Factory.create_error_text("not found")
+        self.assertEqual((code.format, code.subformat, code.content), (AllowedFormats.error, "code", "E404"))
+        self.assertEqual((text.format, text.subformat, text.content), (AllowedFormats.error, "text", "not found"))
+
 class TestNLIPExtractText(unittest.TestCase):
     def test_basic_message(self):
         msg = NLIP_Message(messagetype=ReservedTokens.control,format=AllowedFormats.text, subformat='English', content='Hello world!')
@@ -68,6 +83,42 @@ class TestReservedTokens(unittest.TestCase):
                     self.assertEqual(index, ReservedTokens.get_suffix(value,seperator) )
 
 
+class TestNormalize(unittest.TestCase):
+    def test_interned(self):
+        first = normalize(''.join(['Eng', 'lish']))
+        second = normalize(''.join(['ENG', 'LISH']))
+        self.assertEqual(first, 'english')
+        self.assertIs(first, second)
+        self.assertIsNone(normalize(None))
+        self.assertIs(type(normalize(ReservedTokens.conv)), str)
+        self.assertEqual(normalize(ReservedTokens.conv), 'conversation')
+
+    def test_bounded(self):
+        long_label = 'Label' * 100
+        self.assertEqual(normalize(long_label), long_label.lower())
+        self.assertNotIn(long_label, nlip._normalized)
+        with patch.object(nlip, 'MAX_NORMALIZED', len(nlip._normalized)):
+            self.assertEqual(normalize('Never-Seen-Before'), 'never-seen-before')
+        self.assertNotIn('Never-Seen-Before', nlip._normalized)
+
+    def test_enum_lookup(self):
+        self.assertIs(AllowedFormats('TEXT'), AllowedFormats.text)
+        self.assertIs(AllowedFormats('Structured'), AllowedFormats.structured)
+        self.assertIs(ReservedTokens('Conversation'), ReservedTokens.conv)
+        with self.assertRaises(ValueError):
+            AllowedFormats('unknown')
+        with self.assertRaises(ValueError):
+            AllowedFormats(3)
+
+    def test_compare(self):
+        self.assertTrue(nlip_compare_string('Text', AllowedFormats.text))
+        self.assertFalse(nlip_compare_string('Text', None))
+        self.assertTrue(nlip_compare_string('Text', None, matchNone=True))
+        self.assertTrue(ReservedTokens.is_control('CONTROL'))
+        self.assertFalse(ReservedTokens.is_control(None))
+        self.assertTrue(ReservedTokens.is_reserved('Authorization-x'))
+        self.assertFalse(ReservedTokens.is_reserved('english'))
+
 class TestCorrelator(unittest.TestCase):
     def test_correlator(self):
         msg = NLIP_Factory.create_text("Hello")
@@ -77,6 +128,241 @@ class TestCorrelator(unittest.TestCase):
         self.assertEqual(conv, extract)
 
 
+class TestSubMessageIndex(unittest.TestCase):
+    def setUp(self):
+        self.msg = NLIP_Factory.create_text("Hello")
+        for i in range(50):
+            self.msg.add_text(f"text {i}", language='English', label=f"Part{i}")
+        self.msg.add_text("unlabeled", language='french')
+        self.msg.add_authentication_token("auth0123")
+
+    def test_labeled_lookup(self):
+        self.assertEqual(self.msg.find_labeled_submessage('part7').content, 'text 7')
+        self.assertEqual(self.msg.find_labeled_submessage('missing'), None)
+
+    def test_unlabeled_matches_any_label(self):
+        self.assertEqual(self.msg.extract_field_list(AllowedFormats.text, label='PART3'), 
+                         ['Hello', 'text 3', 'unlabeled'])
+        self.assertEqual(self.msg.extract_field_list(AllowedFormats.text, 'FRENCH'), ['unlabeled'])
+
+    def test_incremental_append(self):
+        self.assertEqual(self.msg.extract_authentication_token(), "auth0123")
+        self.msg.add_conversation_token("conv0123")
+        self.msg.submessages.append(NLIP_SubMessage(format='text', subformat='german', content='Hallo'))
+        self.assertEqual(self.msg.extract_conversation_token(), "conv0123")
+        self.assertEqual(self.msg.extract_text('german'), 'Hallo')
+
+    def test_invalidation(self):
+        self.assertEqual(self.msg.find_labeled_submessage('part1').content, 'text 1')
+        self.msg.submessages[1].label = 'renamed'
+        self.assertEqual(self.msg.find_labeled_submessage('part1'), None)
+        self.assertEqual(self.msg.find_labeled_submessage('Renamed').content, 'text 1')
+        self.msg.submessages = self.msg.submessages[:2]
+        self.assertEqual(self.msg.extract_authentication_token(), None)
+
+    def test_list_changed_in_place(self):
+        self.assertEqual(self.msg.find_labeled_submessage('part1').content, 'text 1')
+        self.msg.submessages.insert(0, NLIP_SubMessage(format='text', subformat='english', content='first', label='part1'))
+        self.assertEqual(self.msg.find_labeled_submessage('part1').content, 'first')
+        self.msg.submessages[5] = NLIP_SubMessage(format='text', subformat='english', content='new', label='part9')
+        self.assertEqual(self.msg.find_labeled_submessage('part4'), None)
+        self.assertEqual(self.msg.find_labeled_submessage('part9').content, 'new')
+        del self.msg.submessages[0]
+        self.msg.add_text("appended", label='part1')
+        self.assertEqual(self.msg.find_labeled_submessage('part1').content, 'text 1')
+
+    def test_changes_tracked_per_message(self):
+        other = NLIP_Factory.create_text("Other")
+        other.add_text("other text", label="other")
+        self.assertIsNotNone(self.msg.find_labeled_submessage('part1'))
+        index = self.msg.submessage_index()
+        other.submessages[0].label = 'renamed'
+        self.assertIs(self.msg.submessage_index(), index)
+        self.assertEqual(other.find_labeled_submessage('renamed').content, 'other text')
+        self.msg.submessages.sort(key=lambda submsg: submsg.content)
+        self.assertIsNot(self.msg.submessage_index(), index)
+        self.assertEqual(self.msg.find_labeled_submessage('part1').content, 'text 1')
+        self.msg.submessages[:2] = []
+        self.assertEqual(self.msg.find_labeled_submessage('part1').content, 'text 1')
+
+    def test_submessages_shared_with_a_copy(self):
+        copy = self.msg.model_copy(update={'submessages': list(self.msg.submessages)})
+        self.assertEqual(copy.find_labeled_submessage('part1').content, 'text 1')
+        self.assertEqual(self.msg.find_labeled_submessage('part1').content, 'text 1')
+        copy.submessages[1].label = 'renamed'
+        self.assertIsNone(self.msg.find_labeled_submessage('part1'))
+        self.assertIsNone(copy.find_labeled_submessage('part1'))
+        self.assertEqual(self.msg.find_labeled_submessage('renamed').content, 'text 1')
+        restored = pickle.loads(pickle.dumps(self.msg))
+        self.assertEqual(restored, self.msg)
+        restored.submessages[1].label = 'again'
+        self.assertEqual(restored.find_labeled_submessage('again').content, 'text 1')
+
+    def test_equality_ignores_index(self):
+        other = self.msg.model_copy(deep=True)
+        self.msg.extract_text()
+        self.assertEqual(self.msg, other)
+
+class TestBinaryContent(unittest.TestCase):
+    def test_stored_without_copy(self):
+        payload = bytes(range(256)) * 10
+        view = memoryview(payload)
+        msg = NLIP_Factory.create_image(payload, 'png')
+        msg.add_video(view, 'mp4')
+        self.assertIs(msg.content, payload)
+        self.assertIs(msg.submessages[0].content, view)
+
+    def test_base64_in_json(self):
+        payload = bytes(range(256)) * 10
+        msg = NLIP_Factory.create_text("Hello")
+        msg.add_audio(bytearray(payload), 'wav')
+        msg.add_image(b64encode(b'preencoded').decode(), 'png')
+        submessages = msg.to_dict()['submessages']
+        self.assertEqual(submessages[0]['content'], b64encode(payload).decode())
+        self.assertEqual(submessages[1]['content'], b64encode(b'preencoded').decode())
+
+    def test_invalid_content(self):
+        with self.assertRaises(ValueError):
+            NLIP_SubMessage(format=AllowedFormats.binary, subformat='image/png', content=1234)
+
+    def test_copy_and_pickle(self):
+        payload = bytes(range(256))
+        msg = NLIP_Message(format=AllowedFormats.binary, subformat='raw', content=memoryview(payload))
+        msg.add_image(memoryview(payload), 'png', label='photo')
+        for copied in (msg.model_copy(deep=True), pickle.loads(pickle.dumps(msg))):
+            self.assertEqual(copied.content, payload)
+            self.assertIsInstance(copied.submessages[0].content, bytes)
+            self.assertEqual(copied.to_json(), msg.to_json())
+        self.assertIsInstance(msg.content, memoryview)
+
+    def test_binary_file(self):
+        payload = bytes(range(256)) * 100
+        fd, filename = tempfile.mkstemp(suffix='.mp4')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(payload)
+        try:
+            msg = NLIP_Factory.create_text("Hello")
+            msg.add_binary_file(filename, 'video', 'mp4', label='clip')
+            self.assertIsInstance(msg.submessages[0].content, memoryview)
+            self.assertEqual(msg.submessages[0].subformat, 'video/mp4')
+            self.assertEqual(b''.join(msg.iter_json(1024)), msg.to_json().encode())
+            self.assertEqual(msg.to_dict()['submessages'][0]['content'], b64encode(payload).decode())
+        finally:
+            os.remove(filename)
+
+class TestStreamingJSON(unittest.TestCase):
+    def setUp(self):
+        self.msg = NLIP_Factory.create_json({'key': None, 'values': [1, 2.5e20, 'caf\u00e9\n']}, 
+                                            messagetype=ReservedTokens.control)
+        self.msg.add_text('A "quoted" line\n' * 500, label='transcript')
+        self.msg.add_image(bytes(range(256)) * 100, 'png')
+        self.msg.add_conversation_token('conv0123')
+
+    def test_same_as_to_json(self):
+        expected = self.msg.to_json().encode()
+        for chunk_size in [1, 7, 1024, 65536]:
+            self.assertEqual(b''.join(self.msg.iter_json(chunk_size)), expected)
+
+    def test_bounded_chunks(self):
+        chunks = list(self.msg.iter_json(1024))
+        self.assertGreater(len(chunks), 10)
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), 2 * 1024)
+
+    def test_write_json(self):
+        fp = BytesIO()
+        written = self.msg.write_json(fp, 512)
+        self.assertEqual(fp.getvalue(), self.msg.to_json().encode())
+        self.assertEqual(written, len(fp.getvalue()))
+
+class TestJSONCache(unittest.TestCase):
+    def setUp(self):
+        self.msg = NLIP_Factory.create_text("Hello", messagetype="request")
+        self.msg.add_text("Part one", label="one")
+        self.msg.add_json({'record': 1, 'values': [1.5, 'x']})
+        self.msg.add_image(bytes(range(256)), 'png')
+
+    def test_fragments_reused(self):
+        expected = self.msg.model_dump_json(exclude_none=True)
+        self.assertEqual(self.msg.to_json(), expected)
+        fragments = [submsg.json_fragment() for submsg in self.msg.submessages]
+        self.assertEqual(self.msg.to_json(), expected)
+        for submsg, fragment in zip(self.msg.submessages, fragments):
+            if isinstance(submsg.content, dict):
+                self.assertEqual(submsg.json_fragment(), fragment)
+            else:
+                self.assertIs(submsg.json_fragment(), fragment)
+
+    def test_invalidated_by_assignment(self):
+        self.msg.to_json()
+        self.msg.submessages[0].update_content("Changed")
+        self.msg.submessages[1].label = "data"
+        self.msg.content = "Bye"
+        self.assertEqual(self.msg.to_json(), self.msg.model_dump_json(exclude_none=True))
+        self.assertIn('"Changed"', self.msg.to_json())
+        self.assertIn('"label":"data"', self.msg.to_json())
+
+    def test_content_changed_in_place(self):
+        self.msg.add_image(bytearray(b'before'), 'png')
+        self.msg.to_json()
+        self.msg.to_json()
+        self.msg.submessages[1].content['record'] = 2
+        self.msg.submessages[3].content[:] = b'after'
+        expected = self.msg.model_dump_json(exclude_none=True)
+        self.assertIn('"record":2', expected)
+        self.assertEqual(self.msg.to_json(), expected)
+        self.assertEqual(b''.join(self.msg.iter_json(16)), expected.encode())
+
+    def test_large_fragment_not_cached(self):
+        msg = NLIP_Factory.create_text("Hello")
+        msg.add_text("x" * 100, label="big")
+        with patch('nlip_sdk.nlip.MAX_CACHED_JSON', 50):
+            fragment = msg.submessages[0].json_fragment()
+            self.assertIsNot(msg.submessages[0].json_fragment(), fragment)
+            self.assertEqual(msg.to_json(), msg.model_dump_json(exclude_none=True))
+
+    def test_iter_json_uses_cache(self):
+        self.msg.to_json()
+        for chunk_size in [1, 7, 1024]:
+            self.assertEqual(b''.join(self.msg.iter_json(chunk_size)), self.msg.to_json().encode())
+
+class TestToDict(unittest.TestCase):
+    def test_same_as_json_round_trip(self):
+        msg = NLIP_Factory.create_json({'key': None, 1: [2.5, None, (1, 2)]}, messagetype=ReservedTokens.control)
+        msg.add_text('Hello', label='greeting')
+        msg.add_image(b'raw image', 'png')
+        msg.add_conversation_token('conv0123')
+        self.assertEqual(msg.to_dict(), loads(msg.to_json()))
+
+    def test_plain_values(self):
+        msg = NLIP_Factory.create_control('stop')
+        result = msg.to_dict()
+        self.assertIs(type(result['messagetype']), str)
+        self.assertIs(type(result['format']), str)
+        self.assertNotIn('label', result)
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.messages = list()
+        for i in range(20):
+            msg = NLIP_Factory.create_text(f"Message {i}", messagetype=ReservedTokens.control if i % 2 else None)
+            msg.add_conversation_token(f"conv{i}")
+            self.messages.append(msg)
+
+    def test_dump_many(self):
+        self.assertEqual(loads(NLIP_Message.dump_many(self.messages)), [msg.to_dict() for msg in self.messages])
+        self.assertEqual(NLIP_Message.dump_many(self.messages, ndjson=True), 
+                         ''.join(msg.to_json() + '\n' for msg in self.messages))
+
+    def test_round_trip(self):
+        self.assertEqual(NLIP_Message.load_many(NLIP_Message.dump_many(self.messages)), self.messages)
+        ndjson = NLIP_Message.dump_many(self.messages, ndjson=True)
+        self.assertEqual(NLIP_Message.load_many(ndjson + '\n\n', ndjson=True), self.messages)
+        self.assertEqual(NLIP_Message.load_many(ndjson.encode(), ndjson=True), self.messages)
+
+    def test_empty(self):
+        self.assertEqual(NLIP_Message.dump_many([]), '[]')
+        self.assertEqual(NLIP_Message.load_many('', ndjson=True), [])
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
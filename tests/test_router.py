@@ -0,0 +1,67 @@
+import asyncio
+import unittest
+from nlip_sdk.errors import NoRouteError
+from nlip_sdk.nlip import NLIP_Factory, NLIP_Message
+from nlip_sdk.router import Router
+
+
+def named(name):
+    return lambda msg: name
+
+
+class TestRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = Router()
+        self.router.add(named('control'), messagetype='control', format='text', subformat='english')
+        self.router.add(named('text'), format='text')
+        self.router.add(named('english'), format='text', subformat='english')
+        self.router.add(named('auth'), format='token', subformat='authorization*')
+        self.router.add(named('token'), format='token')
+
+    def test_exact_and_wildcards(self):
+        self.assertEqual(self.router(NLIP_Factory.create_text('hi')), 'english')
+        self.assertEqual(self.router(NLIP_Factory.create_text('salut', language='french')), 'text')
+        self.assertEqual(self.router(NLIP_Factory.create_control('stop')), 'control')
+
+    def test_case_insensitive(self):
+        msg = NLIP_Message(format='TEXT', subformat='English', content='hi')
+        self.assertEqual(self.router(msg), 'english')
+
+    def test_prefix(self):
+        self.assertEqual(self.router(NLIP_Factory.create_token('t', 'Authorization-bearer')), 'auth')
+        self.assertEqual(self.router(NLIP_Factory.create_token('t', 'conversation')), 'token')
+
+    def test_specificity_over_order(self):
+        router = Router()
+        router.add(named('any'))
+        router.add(named('label'), label='urgent')
+        router.add(named('format-label'), format='text', label='urgent')
+        self.assertEqual(router(NLIP_Factory.create_text('x', label='Urgent')), 'format-label')
+        self.assertEqual(router(NLIP_Factory.create_json({}, label='urgent')), 'label')
+        self.assertEqual(router(NLIP_Factory.create_json({})), 'any')
+
+    def test_table_updated_on_add(self):
+        msg = NLIP_Factory.create_json({'a': 1})
+        with self.assertRaises(NoRouteError):
+            self.router(msg)
+        self.router.add(named('structured'), format='structured')
+        self.assertEqual(self.router(msg), 'structured')
+
+    def test_resolved_keys_are_cached(self):
+        msg = NLIP_Factory.create_text('hola', language='spanish')
+        self.router(msg)
+        self.assertIn(Router.key(msg), self.router._table)
+
+    def test_default_and_decorator(self):
+        router = Router(default=named('default'))
+
+        @router.route(format='binary', subformat='image*')
+        async def image(msg):
+            return 'image'
+        self.assertEqual(router(NLIP_Factory.create_text('x')), 'default')
+        reply = asyncio.run(router.adispatch(NLIP_Factory.create_image(b'\x89PNG', 'png')))
+        self.assertEqual(reply, 'image')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+import asyncio
+import socket
+import struct
+import unittest
+from nlip_sdk.client import NLIPClient
+from nlip_sdk.errors import TransportError
+from nlip_sdk.nlip import NLIP_Factory, NLIP_Message
+from nlip_sdk.server import NLIPServer
+from nlip_sdk.transport import format_head, iter_body, read_head
+
+
+def upper(msg: NLIP_Message) -> NLIP_Message:
+    return NLIP_Factory.create_text(msg.extract_text().upper())
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def start(server: NLIPServer) -> str:
+    listening = await server.start(port=0)
+    port = listening.sockets[0].getsockname()[1]
+    return f"http://127.0.0.1:{port}/nlip/"
+
+
+class TestNLIPServer(unittest.TestCase):
+    def test_exchange(self):
+        async def scenario():
+            async with NLIPServer(upper) as server:
+                url = await start(server)
+                async with NLIPClient(url) as client:
+                    return [(await client.send(NLIP_Factory.create_text(word))).extract_text()
+                            for word in ['one', 'two']]
+        self.assertEqual(run(scenario()), ['ONE', 'TWO'])
+
+    def test_pipelined_replies_in_order(self):
+        async def slow_first(msg):
+            text = msg.extract_text()
+            await asyncio.sleep(0.05 if text == 'm0' else 0)
+            return upper(msg)
+
+        async def scenario():
+            async with NLIPServer(slow_first, workers=4) as server:
+                url = await start(server)
+                reader, writer = await asyncio.open_connection('127.0.0.1', int(url.split(':')[2].split('/')[0]))
+                for i in range(4):
+                    body = NLIP_Factory.create_text(f"m{i}").to_json().encode()
+                    writer.write(format_head("POST /nlip/ HTTP/1.1", {'Content-Length': str(len(body))}) + body)
+                await writer.drain()
+                texts = list()
+                for _ in range(4):
+                    head = await read_head(reader)
+                    body = b''.join([piece async for piece in iter_body(reader, head)])
+                    texts.append(NLIP_Message.from_json(body).extract_text())
+                writer.close()
+                return texts
+        self.assertEqual(run(scenario()), ['M0', 'M1', 'M2', 'M3'])
+
+    def test_overload_shedding(self):
+        async def slow(msg):
+            await asyncio.sleep(0.05)
+            return upper(msg)
+
+        async def scenario():
+            async with NLIPServer(slow, workers=1, queue_size=1) as server:
+                url = await start(server)
+                async with NLIPClient(url, retries=0) as client:
+                    return await asyncio.gather(*[client.send(NLIP_Factory.create_text(f"m{i}")) for i in range(6)],
+                                                return_exceptions=True)
+        results = run(scenario())
+        refused = [result for result in results if isinstance(result, TransportError)]
+        self.assertTrue(refused)
+        self.assertTrue(all(result.status == 503 for result in refused))
+        self.assertTrue(any(isinstance(result, NLIP_Message) for result in results))
+
+    def test_control_messages_first(self):
+        handled = list()
+
+        async def scenario():
+            release = asyncio.Event()
+
+            async def handler(msg):
+                await release.wait()
+                handled.append(msg.extract_text())
+                return None
+
+            async with NLIPServer(handler, workers=1, queue_size=1, control_queue_size=1) as server:
+                await server.start(port=0)
+                blocked = server.submit(NLIP_Factory.create_text('first'))
+                await asyncio.sleep(0)
+                data = server.submit(NLIP_Factory.create_text('data'))
+                self.assertIsNone(server.submit(NLIP_Factory.create_text('refused')))
+                control = server.submit(NLIP_Factory.create_control('control'))
+                self.assertIsNotNone(control)
+                self.assertIsNone(server.submit(NLIP_Factory.create_control('refused')))
+                release.set()
+                await asyncio.gather(blocked, data, control)
+        run(scenario())
+        self.assertEqual(handled, ['first', 'control', 'data'])
+
+    def test_errors(self):
+        def failing(msg):
+            raise RuntimeError("boom")
+
+        async def scenario():
+            async with NLIPServer(failing) as server:
+                url = await start(server)
+                statuses = list()
+                async with NLIPClient(url, retries=0) as client:
+                    for target in [url, url + 'other']:
+                        try:
+                            await client.send(NLIP_Factory.create_text('x'), url=target)
+                        except TransportError as e:
+                            statuses.append(e.status)
+                return statuses
+        self.assertEqual(run(scenario()), [500, 404])
+
+
+    def test_malformed_requests(self):
+        async def scenario():
+            async with NLIPServer(upper) as server:
+                url = await start(server)
+                port = int(url.split(':')[2].split('/')[0])
+                statuses = list()
+                for body in [b'{"format":"text"}', b'{"format":1.2.3}',
+                             b'{"format":"text","subformat":"english","content":"x","submessages":[{"format":"text"}]}']:
+                    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                    writer.write(format_head("POST /nlip/ HTTP/1.1", {'Content-Length': str(len(body))}) + body)
+                    await writer.drain()
+                    head = await read_head(reader)
+                    statuses.append(head.first_line[1])
+                    writer.close()
+                return statuses
+        self.assertEqual(run(scenario()), ['400', '400', '400'])
+
+    def test_malformed_refused_requests(self):
+        async def scenario():
+            async with NLIPServer(upper) as server:
+                url = await start(server)
+                port = int(url.split(':')[2].split('/')[0])
+                replies = list()
+                for first_line, headers in [("POST /other HTTP/1.1", {'Content-Length': 'x'}),
+                                            ("GET /nlip/ HTTP/1.1", {'Transfer-Encoding': 'chunked'})]:
+                    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                    writer.write(format_head(first_line, headers) + b'zz\r\n')
+                    await writer.drain()
+                    head = await read_head(reader)
+                    replies.append((head.first_line[1], head.headers.get('connection')))
+                    writer.close()
+                return replies
+        self.assertEqual(run(scenario()), [('400', 'close'), ('400', 'close')])
+
+    def test_reset_with_full_pipeline(self):
+        async def slow(msg):
+            await asyncio.sleep(0.02)
+            return upper(msg)
+
+        async def scenario():
+            async with NLIPServer(slow, max_pipeline=2) as server:
+                url = await start(server)
+                port = int(url.split(':')[2].split('/')[0])
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                for i in range(8):
+                    body = NLIP_Factory.create_text(f"m{i}").to_json().encode()
+                    writer.write(format_head("POST /nlip/ HTTP/1.1", {'Content-Length': str(len(body))}) + body)
+                await writer.drain()
+                await asyncio.sleep(0.01)
+                # Closing with a zero linger time resets the connection
+                writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                                           struct.pack('ii', 1, 0))
+                writer.close()
+                for _ in range(100):
+                    if not server._connections:
+                        break
+                    await asyncio.sleep(0.01)
+                return len(server._connections)
+        self.assertEqual(run(scenario()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+from nlip_sdk.errors import MalformedMessageError
+from nlip_sdk.nlip import NLIP_Message, NLIP_Factory, ReservedTokens
+from nlip_sdk.streaming import (NLIP_StreamParser, FIELD_EVENT, SUBMESSAGE_EVENT, 
+                                iter_events, parse_stream, aparse_stream)
+
+
+def make_message() -> NLIP_Message:
+    msg = NLIP_Factory.create_json({'key': None, 'nested': {'list': [1, 2.5, '}]"\\\\']}}, 
+                                   messagetype=ReservedTokens.control)
+    msg.add_conversation_token('conv0123')
+    msg.add_text('A "quoted" line with \\\\ and café\n' * 200, label='transcript')
+    msg.add_image(bytes(range(256)) * 50, 'png')
+    return msg
+
+
+def split(data: bytes, size: int) -> list:
+    return [data[start:start+size] for start in range(0, len(data), size)]
+
+
+class TestStreamParser(unittest.TestCase):
+    def setUp(self):
+        self.data = make_message().to_json().encode()
+        self.expected = NLIP_Message.model_validate_json(self.data)
+
+    def test_any_chunking(self):
+        for size in [1, 2, 3, 17, 1024, len(self.data)]:
+            self.assertEqual(parse_stream(split(self.data, size)), self.expected)
+
+    def test_events_in_order(self):
+        events = [event[:2] for event in iter_events(split(self.data, 64))]
+        self.assertEqual(events, [(FIELD_EVENT, 'messagetype'), (FIELD_EVENT, 'format'), 
+                                  (FIELD_EVENT, 'subformat'), (FIELD_EVENT, 'content'),
+                                  (SUBMESSAGE_EVENT, 0), (SUBMESSAGE_EVENT, 1), (SUBMESSAGE_EVENT, 2)])
+
+    def test_token_before_end(self):
+        parser = NLIP_StreamParser()
+        end_of_token = self.data.index(b'conv0123') + 100
+        parser.feed(self.data[:end_of_token])
+        self.assertEqual(parser.fields['messagetype'], 'control')
+        self.assertEqual(parser.submessages[0].content, 'conv0123')
+        self.assertFalse(parser.is_complete())
+
+    def test_callbacks(self):
+        fields, positions = list(), list()
+        parse_stream(split(self.data, 100), on_field=lambda name, value: fields.append(name),
+                     on_submessage=lambda position, submsg: positions.append(position))
+        self.assertEqual(fields, ['messagetype', 'format', 'subformat', 'content'])
+        self.assertEqual(positions, [0, 1, 2])
+
+    def test_async(self):
+        async def chunks():
+            for chunk in split(self.data, 500):
+                yield chunk
+        positions = list()
+        async def on_submessage(position, submsg):
+            positions.append(position)
+        msg = asyncio.run(aparse_stream(chunks(), on_submessage=on_submessage))
+        self.assertEqual(msg, self.expected)
+        self.assertEqual(positions, [0, 1, 2])
+
+    def test_empty_submessages(self):
+        msg = parse_stream([b'{ "format": "text", "subformat": "english", "content": "Hi", "submessages": [] }'])
+        self.assertEqual(msg.submessages, [])
+        self.assertEqual(msg.extract_text(), 'Hi')
+
+    def test_truncated(self):
+        with self.assertRaises(MalformedMessageError):
+            parse_stream([self.data[:-10]])
+
+    def test_invalid(self):
+        with self.assertRaises(MalformedMessageError):
+            parse_stream([b'["format", "text"]'])
+
+    def test_invalid_json_value(self):
+        with self.assertRaises(MalformedMessageError):
+            parse_stream([b'{"format": 1.2.3, "subformat": "english", "content": "Hi"}'])
+
+    def test_invalid_fields(self):
+        with self.assertRaises(MalformedMessageError):
+            parse_stream([b'{"format": "text"}'])
+        parser = NLIP_StreamParser()
+        with self.assertRaises(MalformedMessageError):
+            parser.feed(b'{"format": "text", "subformat": "english", "content": "Hi", "submessages": [{"format": "text"}]}')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import pickle
+import unittest
+
+from pydantic import ValidationError
+
+from nlip_sdk.nlip import AllowedFormats, NLIP_Factory, NLIP_Message, NLIP_SubMessage
+from nlip_sdk.template import NLIP_Template
+
+
+def make_base() -> NLIP_Message:
+    msg = NLIP_Factory.create_text("placeholder", messagetype="response")
+    msg.add_authentication_token("bearer-abc")
+    msg.add_conversation_token("conv0123")
+    msg.add_text("You are a helpful agent", label="system")
+    return msg
+
+
+def make_reply(text: str) -> NLIP_Message:
+    msg = make_base()
+    msg.content = text
+    return msg
+
+
+class TestTemplate(unittest.TestCase):
+    def setUp(self):
+        self.base = make_base()
+        self.template = NLIP_Template(self.base)
+
+    def test_message(self):
+        reply = self.template.message(content="Hello")
+        self.assertEqual(reply, make_reply("Hello"))
+        self.assertEqual(reply.to_json(), make_reply("Hello").to_json())
+        self.assertEqual(reply.messagetype, "response")
+
+    def test_submessages_shared(self):
+        first = self.template.message(content="one")
+        second = self.template.message(content="two")
+        self.assertIsNot(first.submessages, second.submessages)
+        for a, b in zip(first.submessages, second.submessages):
+            self.assertIs(a, b)
+
+    def test_add_to_derived_message(self):
+        first = self.template.message(content="one")
+        first.add_text("extra", label="note")
+        second = self.template.message(content="two")
+        self.assertEqual(len(first.submessages), 4)
+        self.assertEqual(len(second.submessages), 3)
+        self.assertEqual(len(self.template.submessages), 3)
+        self.assertEqual(first.find_labeled_submessage('note').content, "extra")
+
+    def test_shared_submessages_frozen(self):
+        reply = self.template.message(content="one")
+        with self.assertRaises(ValidationError):
+            reply.submessages[0].update_content("changed")
+
+    def test_writable_submessage(self):
+        first = self.template.message(content="one")
+        position = first.submessage_index().find_label("system")[0]
+        first.writable_submessage(position).update_content("Be brief")
+        second = self.template.message(content="two")
+        self.assertEqual(first.find_labeled_submessage("system").content, "Be brief")
+        self.assertEqual(second.find_labeled_submessage("system").content, "You are a helpful agent")
+        self.assertIn('"Be brief"', first.to_json())
+
+    def test_shared_content_frozen(self):
+        base = make_base()
+        record = {'turns': [{'role': 'system'}], 'count': 1}
+        base.add_json(record, label='record')
+        base.add_binary(bytearray(b'raw'), 'image', 'png', label='image')
+        template = NLIP_Template(base)
+        record['count'] = 2
+        base.submessages[-1].content[:] = b'new'
+        first = template.message(content="one")
+        shared = first.find_labeled_submessage('record')
+        self.assertEqual(shared.content, {'turns': [{'role': 'system'}], 'count': 1})
+        self.assertEqual(first.find_labeled_submessage('image').content, b'raw')
+        expected = first.to_json()
+        for change in [lambda content: content.update(count=3), lambda content: content['turns'].append({}),
+                       lambda content: content['turns'][0].pop('role')]:
+            with self.assertRaises(TypeError):
+                change(shared.content)
+        self.assertEqual(first.to_json(), expected)
+        self.assertEqual(first.to_json(), first.model_dump_json(exclude_none=True))
+        self.assertIs(shared.json_fragment(), shared.json_fragment())
+        position = first.submessage_index().find_label('record')[0]
+        first.writable_submessage(position).content['turns'].append({'role': 'user'})
+        self.assertEqual(len(first.find_labeled_submessage('record').content['turns']), 2)
+        self.assertEqual(template.message(content="two").find_labeled_submessage('record').content, shared.content)
+        self.assertEqual(pickle.loads(pickle.dumps(shared)).content, shared.content)
+
+    def test_force_conversation_token(self):
+        first = self.template.message(content="one")
+        first.add_conversation_token("conv9999", force_change=True)
+        self.assertEqual(first.extract_conversation_token(), "conv9999")
+        self.assertEqual(self.template.message(content="two").extract_conversation_token(), "conv0123")
+
+    def test_derived_templates(self):
+        extended = self.template.add_submessage(
+            NLIP_SubMessage(format=AllowedFormats.text, subformat="english", content="context", label="ctx"))
+        updated = extended.update_content("SYSTEM", "Be brief")
+        self.assertEqual(len(self.template.submessages), 3)
+        self.assertEqual(len(extended.submessages), 4)
+        self.assertIs(updated.submessages[0], self.template.submessages[0])
+        self.assertEqual(updated.message().find_labeled_submessage("system").content, "Be brief")
+        self.assertEqual(extended.message().find_labeled_submessage("system").content, "You are a helpful agent")
+
+    def test_without_submessages(self):
+        template = NLIP_Template(NLIP_Factory.create_text("alone"))
+        self.assertEqual(template.message(), NLIP_Factory.create_text("alone"))
+        self.assertIsNone(template.message().submessages)
+
+    def test_invalid_field(self):
+        with self.assertRaises(ValidationError):
+            self.template.message(content=1234)
+
+
+if __name__ == "__main__":
+    unittest.main()
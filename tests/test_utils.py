@@ -1,6 +1,8 @@
 # Assisted by WCA@IBM
 # Latest GenAI contribution: ibm/granite-8b-code-instruct
 
+import os
+import tempfile
 import unittest 
 from nlip_sdk import utils as ut
 
@@ -85,5 +87,35 @@ class TestGetFileExtension(unittest.TestCase):
         actual_extension = ut.get_file_extension(filename)
         self.assertEqual(actual_extension, expected_extension)
 
+class TestChunkedFiles(unittest.TestCase):
+    def setUp(self):
+        self.content = bytes(range(256)) * 1000 + b'tail'
+        fd, self.filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as file:
+            file.write(self.content)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_read_file_chunks(self):
+        chunks = list(ut.read_file_chunks(self.filename, 1000))
+        self.assertEqual(b''.join(chunks), self.content)
+        self.assertTrue(all(len(chunk) == 1000 for chunk in chunks[:-1]))
+
+    def test_read_binary_file_chunks(self):
+        for chunk_size in [1, 1000, 65536]:
+            encoded = ''.join(ut.read_binary_file_chunks(self.filename, chunk_size))
+            self.assertEqual(encoded, ut.read_binary_file(self.filename))
+
+    def test_map_binary_file(self):
+        view = ut.map_binary_file(self.filename)
+        self.assertTrue(view.readonly)
+        self.assertEqual(view, self.content)
+
+    def test_map_empty_file(self):
+        with open(self.filename, 'wb'):
+            pass
+        self.assertEqual(ut.map_binary_file(self.filename), b'')
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,54 @@
+import unittest
+from nlip_sdk.errors import MalformedMessageError
+from nlip_sdk.nlip import NLIP_Message, NLIP_Factory, ReservedTokens
+from nlip_sdk import wire
+
+
+VALUES = [None, True, False, 0, 127, 128, 255, 256, 65535, 65536, 2 ** 32, 2 ** 64 - 1,
+          -1, -32, -33, -128, -129, -32768, -32769, -2 ** 31 - 1, -2 ** 63, 1.5, -0.0, 1e300,
+          '', 'x' * 31, 'x' * 32, 'é' * 200, 'y' * 70000, b'', b'\x00' * 300, b'z' * 70000,
+          [], list(range(16)), list(range(70000)), {}, {str(i): i for i in range(16)}, {'nested': [{'a': [None]}]}]
+
+
+class TestWireFormat(unittest.TestCase):
+    def setUp(self):
+        self.msg = NLIP_Factory.create_json({'values': [1, -5, 2.5, None, True, 'café']}, 
+                                            messagetype=ReservedTokens.control, label='data')
+        self.msg.add_image(bytes(range(256)) * 100, 'png')
+        self.msg.add_text('Hello', language='English')
+        self.msg.add_conversation_token('conv0123')
+        self.msg.add_token('abc', 'custom', label='custom')
+
+    def test_values_round_trip(self):
+        for value in VALUES:
+            self.assertEqual(wire.unpackb(wire.packb(value)), value)
+
+    def test_message_round_trip(self):
+        decoded = NLIP_Message.from_bytes(self.msg.to_bytes())
+        self.assertEqual(decoded, self.msg)
+        self.assertEqual(decoded.to_json(), self.msg.to_json())
+        self.assertIsInstance(decoded.submessages[0].content, bytes)
+
+    def test_compact(self):
+        self.assertLess(len(self.msg.to_bytes()), 0.8 * len(self.msg.to_json()))
+        self.assertEqual(NLIP_Factory.create_text('hello').to_bytes(), b'\x83\x01\x00\x02\x0a\x03\xa5hello')
+
+    def test_case_preserved(self):
+        msg = NLIP_Message(format='Text', subformat='english', content='Hi')
+        self.assertEqual(NLIP_Message.from_bytes(msg.to_bytes()).format, 'Text')
+
+    def test_malformed(self):
+        data = self.msg.to_bytes()
+        for bad in [data[:-10], data + b'\x00', b'\x81\x09\x00', b'\xc1',
+                    b'\x81\x05\x05', b'\x81\x05\x91\x05', b'\x91' * 50000,
+                    b'\x82\x01\x00\x03\x05', wire.packb({1: 0, 2: 10, 3: 'x', 5: [{1: 0, 2: 10, 3: 'y', 5: []}]})]:
+            with self.assertRaises(MalformedMessageError):
+                NLIP_Message.from_bytes(bad)
+
+    def test_big_integer(self):
+        with self.assertRaises((ValueError, OverflowError)):
+            wire.packb(2 ** 64)
+
+
+if __name__ == "__main__":
+    unittest.main()
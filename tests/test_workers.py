@@ -0,0 +1,116 @@
+import asyncio
+import unittest
+from multiprocessing.shared_memory import SharedMemory
+from unittest.mock import patch
+
+from pydantic import ValidationError
+
+from nlip_sdk import workers
+from nlip_sdk.nlip import NLIP_Factory, NLIP_Message
+from nlip_sdk.workers import WorkerPool, encode_async, estimate_size
+
+
+def make_message() -> NLIP_Message:
+    msg = NLIP_Factory.create_text("Describe these", messagetype="request")
+    msg.add_image(bytes(range(256)) * 40, 'png', label='first')
+    msg.add_video(memoryview(bytearray(b'\x00\x01frame' * 1000)), 'mp4')
+    msg.add_json({'frames': 2, 'rate': 29.97})
+    msg.add_conversation_token('conv0123')
+    return msg
+
+
+class SharedSegments:
+    """Records the names of the shared memory segments created by the pool"""
+    def __init__(self):
+        self.names = list()
+
+    def __enter__(self) -> 'SharedSegments':
+        def recording(*args, **kwargs):
+            shm = SharedMemory(*args, **kwargs)
+            self.names.append(shm.name)
+            return shm
+        self.patcher = patch.object(workers, 'SharedMemory', side_effect=recording)
+        self.patcher.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.patcher.stop()
+
+    def released(self) -> bool:
+        for name in self.names:
+            try:
+                SharedMemory(name=name).close()
+            except FileNotFoundError:
+                continue
+            return False
+        return True
+
+
+class TestWorkerPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = WorkerPool(max_workers=2, threshold=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def test_encode(self):
+        msg = make_message()
+        with SharedSegments() as segments:
+            self.assertEqual(self.pool.encode(msg), msg.to_json().encode())
+        self.assertEqual(len(segments.names), 1)
+        self.assertTrue(segments.released())
+
+    def test_encode_without_binary(self):
+        msg = NLIP_Factory.create_json({'key': 'value'})
+        msg.add_text("more")
+        self.assertEqual(self.pool.encode(msg), msg.to_json().encode())
+
+    def test_decode(self):
+        msg = make_message()
+        encoded = msg.to_json()
+        expected = NLIP_Message.from_json(encoded)
+        with SharedSegments() as segments:
+            self.assertEqual(self.pool.decode(encoded), expected)
+            self.assertEqual(self.pool.decode(encoded.encode()), expected)
+        self.assertEqual(len(segments.names), 2)
+        self.assertTrue(segments.released())
+
+    def test_decode_invalid(self):
+        with self.assertRaises(ValidationError):
+            self.pool.decode('{"format": "text", "subformat": "café", "content": 1234}')
+
+    def test_async(self):
+        msg = make_message()
+
+        async def run():
+            encoded = await asyncio.gather(*(self.pool.encode_async(msg) for _ in range(4)))
+            decoded = await self.pool.decode_async(encoded[0])
+            return encoded, decoded
+
+        with SharedSegments() as segments:
+            encoded, decoded = asyncio.run(run())
+        self.assertEqual(len(segments.names), 5)
+        self.assertTrue(segments.released())
+        self.assertEqual(set(encoded), {msg.to_json().encode()})
+        self.assertEqual(decoded, NLIP_Message.from_json(msg.to_json()))
+
+    def test_module_function(self):
+        msg = make_message()
+        self.assertEqual(asyncio.run(encode_async(msg, self.pool)), msg.to_json().encode())
+
+
+class TestThreshold(unittest.TestCase):
+    def test_small_messages_stay_in_process(self):
+        msg = make_message()
+        self.assertGreater(estimate_size(msg), 10000)
+        with WorkerPool(max_workers=1, threshold=estimate_size(msg)) as pool:
+            self.assertEqual(pool.encode(msg), msg.to_json().encode())
+            small = NLIP_Factory.create_text("hi")
+            self.assertEqual(pool.decode(small.to_json()), small)
+            self.assertFalse(pool._executor._processes)
+
+
+if __name__ == "__main__":
+    unittest.main()